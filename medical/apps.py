@@ -1,4 +1,4 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 
 MODULE_NAME = "medical"
 
@@ -12,6 +12,10 @@ DEFAULT_CFG = {
     "gql_mutation_medical_services_add_perms": ['121402'],
     "gql_mutation_medical_services_update_perms": ['121403'],
     "gql_mutation_medical_services_delete_perms": ['121404'],
+    "catalog_cache_enabled": True,
+    "catalog_cache_ttl": 300,
+    "delta_sync_lag": 60,
+    "delta_sync_page_size": 1000,
 }
 
 
@@ -27,6 +31,10 @@ class MedicalConfig(AppConfig):
     gql_mutation_medical_services_add_perms = []
     gql_mutation_medical_services_update_perms = []
     gql_mutation_medical_services_delete_perms = []
+    catalog_cache_enabled = True
+    catalog_cache_ttl = 300
+    delta_sync_lag = 60
+    delta_sync_page_size = 1000
 
     def __load_config(self, cfg):
         for field in cfg:
@@ -37,3 +45,27 @@ class MedicalConfig(AppConfig):
         from core.models import ModuleConfiguration
         cfg = ModuleConfiguration.get_or_default(MODULE_NAME, DEFAULT_CFG)
         self.__load_config(cfg)
+        self.__connect_pricelist_receivers()
+
+    def __connect_pricelist_receivers(self):
+        # the pricelist detail models only exist when medical_pricelist is installed
+        if not apps.is_installed("medical_pricelist"):
+            return
+        from django.db.models.signals import post_save, post_delete
+        from .models import update_pricelist_membership
+        for signal, name in ((post_save, "save"), (post_delete, "delete")):
+            signal.connect(update_pricelist_membership, sender="medical_pricelist.ItemsPricelistDetail",
+                           dispatch_uid=f"medical_item_pricelist_membership_{name}")
+            signal.connect(update_pricelist_membership, sender="medical_pricelist.ServicesPricelistDetail",
+                           dispatch_uid=f"medical_service_pricelist_membership_{name}")
+
+    def set_dataloaders(self, dataloaders):
+        from .dataloaders import ItemLoader, ServiceLoader, ServiceItemsByParentLoader, \
+            ServiceServicesByParentLoader, ServiceItemsByItemLoader, ServiceServicesByServiceLoader
+
+        dataloaders["medical_item_loader"] = ItemLoader()
+        dataloaders["medical_service_loader"] = ServiceLoader()
+        dataloaders["medical_service_items_by_parent_loader"] = ServiceItemsByParentLoader()
+        dataloaders["medical_service_services_by_parent_loader"] = ServiceServicesByParentLoader()
+        dataloaders["medical_service_items_by_item_loader"] = ServiceItemsByItemLoader()
+        dataloaders["medical_service_services_by_service_loader"] = ServiceServicesByServiceLoader()
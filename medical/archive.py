@@ -0,0 +1,121 @@
+import logging
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+
+from medical.services import LOOKUP_CHUNK_SIZE
+from medical.versions import bump_catalog_version_of
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = LOOKUP_CHUNK_SIZE
+
+
+class ArchiveResult(namedtuple("ArchiveResult", ["model", "moved", "size_before", "size_after"])):
+    """
+    Outcome of archive_history() for one model: the number of versions moved and the size of the table (bytes,
+    None if the database doesn't tell) before and after.
+    """
+    __slots__ = ()
+
+    @property
+    def reclaimed(self):
+        if self.size_before is None or self.size_after is None:
+            return None
+        return self.size_before - self.size_after
+
+
+def archive_model_for(model):
+    """
+    :return: the archive model of Item or Service (ItemArchive, ServiceArchive)
+    """
+    return apps.get_model(model._meta.app_label, f"{model._meta.object_name}Archive")
+
+
+def versions_model_for(model):
+    """
+    :return: the read only model of all the versions of Item or Service, current table and archive (ItemVersion,
+             ServiceVersion): its querysets can be filtered, ordered and paged like the ones of the model, and load
+             Item or Service instances. The readers of past versions (temporal.as_of(), temporal.codes_as_of(), the
+             eligibility index, the history with include_archive) go through it.
+    """
+    return apps.get_model(model._meta.app_label, f"{model._meta.object_name}Version")
+
+
+def has_archive(model):
+    """
+    :return: whether the closed versions of the model are archived (Item and Service)
+    """
+    try:
+        archive_model_for(model)
+    except LookupError:
+        return False
+    return True
+
+
+def table_size(model, using=DEFAULT_DB_ALIAS):
+    """
+    :return: the space used by the table of a model (data and indexes) in bytes, None if unknown. PostgreSQL only
+             gives the space back to the system after a VACUUM (FULL), SQLite after a VACUUM.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_total_relation_size(%s)", [connection.ops.quote_name(table)])
+        elif connection.vendor == "microsoft":
+            cursor.execute("SELECT SUM(used_page_count) * 8192 FROM sys.dm_db_partition_stats "
+                           "WHERE object_id = OBJECT_ID(%s)", [table])
+        elif connection.vendor == "sqlite":
+            # dbstat is an optional SQLite extension
+            try:
+                cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR tbl_name = %s", [table, table])
+            except DatabaseError:
+                return None
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def closed_versions(model, before):
+    """
+    The history copies (legacy_id set) of an Item or Service closed before a time. The current rows and the deleted
+    rows (referenced by the claims and the delta sync tombstones) are never archived.
+    """
+    return model.objects.filter(legacy_id__isnull=False, validity_to__lt=before)
+
+
+def archive_history(model, before, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=None, dry_run=False,
+                    using=DEFAULT_DB_ALIAS):
+    """
+    Moves the closed versions of an Item or Service older than a cutoff to its archive table, chunk_size rows per
+    transaction: an interrupted run leaves whole chunks moved and the next run continues with the remaining ones.
+    Each chunk bumps the catalog version, so that the in-process indexes of the versions are rebuilt.
+    :param before: the versions whose validity_to is before this time are archived
+    :param max_chunks: stop after that many chunks (spreads a large archival over several runs)
+    :param dry_run: only count the versions that would be moved
+    :return: an ArchiveResult
+    """
+    archive = archive_model_for(model)
+    attnames = [field.attname for field in model._meta.concrete_fields]
+    pk_index = attnames.index(model._meta.pk.attname)
+    pending = closed_versions(model, before).using(using)
+    if dry_run:
+        return ArchiveResult(model, pending.count(), table_size(model, using), None)
+
+    size_before = table_size(model, using)
+    moved = chunk_count = 0
+    while max_chunks is None or chunk_count < max_chunks:
+        with transaction.atomic(using=using):
+            rows = list(pending.order_by("id").values_list(*attnames)[:chunk_size])
+            if not rows:
+                break
+            archive.objects.using(using).bulk_create([archive(**dict(zip(attnames, row))) for row in rows])
+            model.objects.using(using).filter(id__in=[row[pk_index] for row in rows]).delete()
+            bump_catalog_version_of(model, using)
+        moved += len(rows)
+        chunk_count += 1
+        logger.debug("medical %s history: %s versions archived", model.__name__, moved)
+    return ArchiveResult(model, moved, size_before, table_size(model, using))
@@ -0,0 +1,221 @@
+import csv
+import functools
+import io
+import logging
+from copy import copy
+from gettext import gettext as _
+from operator import or_
+
+from core import assert_string_length
+from django.db import transaction
+from django.db.models import Q
+
+from medical.cache import catalog_cache_for
+from medical.history import is_new_version
+from medical.versions import bump_catalog_version_of
+from medical.models import Item, Service, ItemMutation, ServiceMutation
+from medical.services import LOOKUP_CHUNK_SIZE, chunks, history_copy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+ROW_CREATED = "created"
+ROW_UPDATED = "updated"
+ROW_UNCHANGED = "unchanged"
+ROW_FAILED = "failed"
+
+REQUIRED_FIELDS = {
+    Item: ["code", "name", "type", "care_type", "price"],
+    Service: ["code", "name", "type", "care_type", "price", "level"],
+}
+# fields that can be set through the bulk upsert, the others (ids, validity, audit) are managed here
+UPSERT_FIELDS = {
+    Item: ["code", "name", "type", "package", "price", "quantity", "maximum_amount", "care_type",
+           "frequency", "patient_category"],
+    Service: ["code", "name", "type", "category", "level", "packagetype", "manualPrice", "price",
+              "maximum_amount", "care_type", "frequency", "patient_category"],
+}
+# fields written back by bulk_update on the current version of a row
+UPDATE_FIELDS = {
+    model: fields + ["validity_from", "audit_user_id"] for model, fields in UPSERT_FIELDS.items()
+}
+
+
+def parse_upsert_file(content):
+    """
+    Reads a CSV file (with a header line naming the fields) into a list of rows.
+    Empty cells are read as None, patient_categories can be given as a |-separated list of masks.
+    """
+    rows = []
+    for record in csv.DictReader(io.StringIO(content)):
+        row = {key.strip(): (value.strip() if value and value.strip() else None)
+               for key, value in record.items() if key}
+        if row.get("patient_categories"):
+            row["patient_categories"] = [int(mask) for mask in row["patient_categories"].split("|")]
+        rows.append(row)
+    return rows
+
+
+def _coerce_row(model, row, audit_user_id):
+    data = dict(row)
+    patient_categories = data.pop("patient_categories", None)
+    if patient_categories:
+        data["patient_category"] = functools.reduce(or_, patient_categories)
+    elif data.get("patient_category") is None:
+        if model is Service:
+            data["patient_category"] = Service.DEFAULT_PATIENT_CATEGORY
+        else:
+            raise ValueError(_("medical.mutation.patient_category_missing"))
+    missing = [field for field in REQUIRED_FIELDS[model] if data.get(field) is None]
+    if missing:
+        # the message key has no placeholder: the fields follow it
+        raise ValueError(f'{_("medical.bulk.missing_fields")}: {", ".join(missing)}')
+    assert_string_length(data["code"], 6)
+    coerced = {"uuid": data.get("uuid"), "audit_user_id": audit_user_id}
+    for field_name in UPSERT_FIELDS[model]:
+        if field_name in data:
+            field = model._meta.get_field(field_name)
+            if data[field_name] is None and not field.null and field.has_default():
+                continue
+            coerced[field_name] = field.to_python(data[field_name])
+    return coerced
+
+
+def _fetch_current(model, uuids, codes):
+    """
+    Resolves all the referenced current rows, one query per LOOKUP_CHUNK_SIZE keys.
+    """
+    by_uuid, by_code = {}, {}
+    keys = [("uuid", value) for value in uuids] + [("code", value) for value in codes]
+    for chunk in chunks(keys, LOOKUP_CHUNK_SIZE):
+        condition = Q()
+        for field_name in ("uuid", "code"):
+            values = [value for key, value in chunk if key == field_name]
+            if values:
+                condition |= Q(**{f"{field_name}__in": values})
+        for instance in model.objects.filter(condition, validity_to__isnull=True):
+            by_uuid[str(instance.uuid).lower()] = instance
+            by_code[instance.code] = instance
+    return by_uuid, by_code
+
+
+def _link_mutation(model, user, client_mutation_id, instances):
+    if not client_mutation_id or not instances:
+        return
+    from core.models import MutationLog
+    mutation_id = MutationLog.objects \
+        .filter(client_mutation_id=client_mutation_id, user=user) \
+        .order_by("-request_date_time") \
+        .values_list("id", flat=True) \
+        .first()
+    if mutation_id is None:
+        return
+    if model is Item:
+        links = [ItemMutation(mutation_id=mutation_id, item=instance) for instance in instances]
+        ItemMutation.objects.bulk_create(links)
+    else:
+        links = [ServiceMutation(mutation_id=mutation_id, service=instance) for instance in instances]
+        ServiceMutation.objects.bulk_create(links)
+
+
+def bulk_upsert_items_or_services(model, rows, user, client_mutation_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Creates or updates a list of Items or Services in bulk.
+    Rows are matched on uuid if given, otherwise on the code of the current version. Changes are detected with
+    history.is_new_version() (like save_history_on_update): the rows with a changed field get a history copy and a
+    new validity_from, the other ones are left untouched.
+    :param model: Item or Service
+    :param rows: list of dicts with the fields of ItemInputType/ServiceInputType
+    :param chunk_size: number of rows written per transaction
+    :return: a report with one {row, code, uuid, status, message} entry per row
+    """
+    from core.utils import TimeUtils
+    audit_user_id = user.id_for_audit
+    report = []
+    coerced_rows = []
+    for index, row in enumerate(rows):
+        try:
+            coerced_rows.append((index, _coerce_row(model, row, audit_user_id)))
+        except Exception as exc:
+            report.append({"row": index, "code": row.get("code"), "uuid": row.get("uuid"),
+                           "status": ROW_FAILED, "message": str(exc)})
+
+    by_uuid, by_code = _fetch_current(
+        model,
+        {data["uuid"] for _, data in coerced_rows if data["uuid"]},
+        {data["code"] for _, data in coerced_rows},
+    )
+    cache = catalog_cache_for(model)
+    seen_codes = set()
+    for chunk in chunks(coerced_rows, chunk_size):
+        now = TimeUtils.now()
+        histories, updated, created = [], [], []
+        for index, data in chunk:
+            entry = {"row": index, "code": data["code"], "uuid": data["uuid"], "message": None}
+            report.append(entry)
+            row_uuid = data.pop("uuid")
+            if row_uuid:
+                existing = by_uuid.get(str(row_uuid).lower())
+                if existing is None:
+                    entry.update(status=ROW_FAILED, message=f'{_("medical.bulk.uuid_does_not_exist")}: {row_uuid}')
+                    continue
+            else:
+                existing = by_code.get(data["code"])
+            owner = by_code.get(data["code"])
+            if data["code"] in seen_codes or (owner is not None and owner is not existing):
+                entry.update(status=ROW_FAILED, message=_("Code already exists."))
+                continue
+            seen_codes.add(data["code"])
+
+            if existing is None:
+                instance = model(validity_from=now, **data)
+                created.append(instance)
+                by_code[instance.code] = instance
+                entry.update(status=ROW_CREATED, uuid=str(instance.uuid))
+                continue
+
+            candidate = copy(existing)
+            for key, value in data.items():
+                setattr(candidate, key, value)
+            entry["uuid"] = str(existing.uuid)
+            if not is_new_version(model, existing, candidate):
+                entry["status"] = ROW_UNCHANGED
+                continue
+            histories.append(history_copy(existing, now))
+            candidate.validity_from = now
+            updated.append(candidate)
+            entry["status"] = ROW_UPDATED
+            if candidate.code != existing.code:
+                by_code.pop(existing.code, None)
+                by_code[candidate.code] = candidate
+
+        with transaction.atomic():
+            model.objects.bulk_create(histories, batch_size=chunk_size)
+            model.objects.bulk_update(updated, UPDATE_FIELDS[model], batch_size=chunk_size)
+            model.objects.bulk_create(created, batch_size=chunk_size)
+            _link_mutation(model, user, client_mutation_id, updated + created)
+            if updated or created:
+                bump_catalog_version_of(model)
+
+        for instance in updated + created:
+            if instance.pk is None:
+                # backend did not return the new ids
+                cache.invalidate()
+                break
+            cache.refresh_instance(instance)
+        logger.debug("bulk upsert of %s: %s histories, %s updated, %s created",
+                     model.__name__, len(histories), len(updated), len(created))
+
+    report.sort(key=lambda entry: entry["row"])
+    return report
+
+
+def report_errors(report):
+    """
+    :return: the failed rows of a bulk upsert report, in the error structure of the mutations
+    """
+    return [{
+        'title': entry["code"] or entry["row"],
+        'list': [{'message': entry["message"], 'detail': f"row {entry['row']}"}]
+    } for entry in report if entry["status"] == ROW_FAILED]
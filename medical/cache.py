@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import transaction
+
+from medical.apps import MedicalConfig
+from medical.versions import catalog_version, entities_of
+
+logger = logging.getLogger(__name__)
+
+ITEM_CACHE_FIELDS = (
+    "id", "uuid", "code", "name", "type", "package", "price", "quantity", "maximum_amount",
+    "care_type", "frequency", "patient_category", "validity_from",
+)
+SERVICE_CACHE_FIELDS = (
+    "id", "uuid", "code", "name", "type", "category", "level", "packagetype", "manualPrice", "price",
+    "maximum_amount", "care_type", "frequency", "patient_category", "validity_from",
+)
+
+
+class CatalogCache:
+    """
+    In-process snapshot of the valid (current) rows of Item or Service, kept as immutable records
+    indexed by id, uuid and code.
+    The snapshot is loaded on first use, patched by the model signals of this process once their
+    transaction commits and reloaded once it is older than MedicalConfig.catalog_cache_ttl seconds,
+    so that changes made by other processes are picked up as well. It may therefore miss rows
+    written by other processes: the readers treat a miss as "ask the database", unless they check
+    the snapshot against the catalog version (known_codes()).
+    """
+
+    def __init__(self, model_name, fields):
+        self.model_name = model_name
+        self.fields = fields
+        self.record_type = namedtuple(f"Cached{model_name}", fields)
+        self._lock = threading.RLock()
+        self._by_id = None
+        self._by_uuid = None
+        self._by_code = None
+        self._loaded_at = None
+        # catalog version of the model when the snapshot was loaded
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    @property
+    def model(self):
+        return apps.get_model("medical", self.model_name)
+
+    @staticmethod
+    def is_enabled():
+        return MedicalConfig.catalog_cache_enabled
+
+    def _is_stale(self):
+        if self._by_id is None:
+            return True
+        ttl = MedicalConfig.catalog_cache_ttl
+        return ttl is not None and time.monotonic() - self._loaded_at > ttl
+
+    def _catalog_version(self):
+        return catalog_version(entities_of(self.model)[0])
+
+    def _load(self, version=None):
+        from core import filter_validity
+        # version first: a change committed meanwhile makes the next check reload again
+        version = self._catalog_version() if version is None else version
+        rows = self.model.objects.filter(*filter_validity()).values_list(*self.fields)
+        by_id, by_uuid, by_code = {}, {}, {}
+        for row in rows.iterator(chunk_size=2000):
+            record = self.record_type(*row)
+            by_id[record.id] = record
+            by_uuid[str(record.uuid).lower()] = record
+            by_code[record.code] = record
+        self._by_id, self._by_uuid, self._by_code = by_id, by_uuid, by_code
+        self._version = version
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.debug("medical %s catalog cache loaded with %s records", self.model_name, len(by_id))
+
+    def _snapshot(self):
+        with self._lock:
+            if self._is_stale():
+                self._load()
+            return self._by_id, self._by_uuid, self._by_code
+
+    def _lookup(self, index, key):
+        record = self._snapshot()[index].get(key)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def get_by_id(self, record_id):
+        return self._lookup(0, record_id)
+
+    def get_by_uuid(self, record_uuid):
+        return self._lookup(1, str(record_uuid).lower())
+
+    def get_by_code(self, code):
+        return self._lookup(2, code)
+
+    def has_code(self, code):
+        return self.get_by_code(code) is not None
+
+    def known_codes(self, codes):
+        """
+        :return: the codes used by a current row of the snapshot, checked against the catalog version with one
+                 query and reloaded when the version changed since it was loaded (a change committed by this process
+                 or by another one): the other codes were not used when the last committed change was bumped.
+        """
+        version = self._catalog_version()
+        with self._lock:
+            if self._by_id is None or self._version != version:
+                self._load(version)
+            return {code for code in codes if code in self._by_code}
+
+    def records(self):
+        return list(self._snapshot()[0].values())
+
+    def _to_record(self, instance):
+        values = []
+        for field_name in self.fields:
+            field = self.model._meta.get_field(field_name)
+            values.append(field.to_python(getattr(instance, field.attname)))
+        return self.record_type(*values)
+
+    def _drop(self, record_id):
+        old = self._by_id.pop(record_id, None)
+        if old is not None:
+            self._by_uuid.pop(str(old.uuid).lower(), None)
+            if self._by_code.get(old.code) is old:
+                del self._by_code[old.code]
+
+    def _current_record(self, instance):
+        # history copies and deleted rows have no record
+        if instance.validity_to is None and instance.legacy_id is None:
+            return self._to_record(instance)
+        return None
+
+    def _patch(self, record_id, record):
+        with self._lock:
+            if self._by_id is None:
+                return
+            self._drop(record_id)
+            if record is not None:
+                self._by_id[record.id] = record
+                self._by_uuid[str(record.uuid).lower()] = record
+                self._by_code[record.code] = record
+
+    def refresh_instance(self, instance):
+        """
+        Patches the snapshot with a saved instance: history copies and deleted rows are dropped,
+        current rows are (re)indexed. Nothing is done while the snapshot is not loaded.
+        """
+        if instance.pk is not None:
+            self._patch(instance.pk, self._current_record(instance))
+
+    def refresh_on_commit(self, instance, using=None):
+        """
+        Same as refresh_instance(), once the current transaction commits: a rolled back save leaves the snapshot
+        unchanged. The record is taken from the instance now, later changes of the instance are not seen.
+        """
+        if instance.pk is None:
+            return
+        record_id, record = instance.pk, self._current_record(instance)
+        transaction.on_commit(lambda: self._patch(record_id, record), using=using)
+
+    def discard(self, record_ids):
+        with self._lock:
+            if self._by_id is None:
+                return
+            for record_id in record_ids:
+                self._drop(record_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = self._by_uuid = self._by_code = None
+            self._loaded_at = self._version = None
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "loaded": self._by_id is not None,
+            "size": len(self._by_id) if self._by_id is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+        }
+
+
+item_catalog_cache = CatalogCache("Item", ITEM_CACHE_FIELDS)
+service_catalog_cache = CatalogCache("Service", SERVICE_CACHE_FIELDS)
+
+
+def catalog_cache_for(model):
+    """
+    :param model: Item or Service (class or instance), or the model name
+    :return: the catalog cache of that model
+    """
+    name = model if isinstance(model, str) else getattr(model, "_meta").object_name
+    return {"Item": item_catalog_cache, "Service": service_catalog_cache}[name]
+
+
+def catalog_cache_stats():
+    return [item_catalog_cache.stats(), service_catalog_cache.stats()]
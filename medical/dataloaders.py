@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+from promise.dataloader import DataLoader
+from promise import Promise
+
+from .apps import MODULE_NAME
+from .models import Item, Service, ServiceItem, ServiceService
+from .services import LOOKUP_CHUNK_SIZE
+
+
+class _ByIdLoader(DataLoader):
+    model = None
+
+    def __init__(self):
+        super().__init__(max_batch_size=LOOKUP_CHUNK_SIZE)
+
+    def batch_load_fn(self, keys):
+        rows = self.model.objects.in_bulk(list(set(keys)))
+        return Promise.resolve([rows.get(key) for key in keys])
+
+
+class ItemLoader(_ByIdLoader):
+    model = Item
+
+
+class ServiceLoader(_ByIdLoader):
+    model = Service
+
+
+class _ChildrenLoader(DataLoader):
+    """
+    Loads the package relation rows (ServiceItem or ServiceService) of several services in one query,
+    the rows of each key being the ones whose key_field is that key
+    """
+    model = None
+    key_field = None
+
+    def __init__(self):
+        super().__init__(max_batch_size=LOOKUP_CHUNK_SIZE)
+
+    def batch_load_fn(self, keys):
+        rows = defaultdict(list)
+        for row in self.model.objects.filter(**{f"{self.key_field}__in": set(keys)}).order_by("id"):
+            rows[getattr(row, self.key_field)].append(row)
+        return Promise.resolve([rows.get(key, []) for key in keys])
+
+
+class ServiceItemsByParentLoader(_ChildrenLoader):
+    model = ServiceItem
+    key_field = "parent_id"
+
+
+class ServiceServicesByParentLoader(_ChildrenLoader):
+    model = ServiceService
+    key_field = "parent_id"
+
+
+class ServiceItemsByItemLoader(_ChildrenLoader):
+    model = ServiceItem
+    key_field = "item_id"
+
+
+class ServiceServicesByServiceLoader(_ChildrenLoader):
+    model = ServiceService
+    key_field = "service_id"
+
+
+def get_dataloader(info, name):
+    """
+    The loaders registered by MedicalConfig.set_dataloaders() on the request context, registered on first use
+    when the GraphQL view did not set them up. Either way they live as long as the request.
+    """
+    dataloaders = getattr(info.context, "dataloaders", None)
+    if dataloaders is None:
+        dataloaders = {}
+        info.context.dataloaders = dataloaders
+    if name not in dataloaders:
+        from django.apps import apps
+        apps.get_app_config(MODULE_NAME).set_dataloaders(dataloaders)
+    return dataloaders[name]
@@ -0,0 +1,69 @@
+import datetime
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from medical.apps import MedicalConfig
+
+# deletion of a row, for the clients to drop it from their local copy
+Tombstone = namedtuple("Tombstone", ["uuid", "code", "deleted_at"])
+
+# until/until_id: pass as since/after_id to get the next delta; has_more: the changed rows were cut at the page size
+Delta = namedtuple("Delta", ["until", "until_id", "changed", "removed", "has_more"])
+
+
+def _comparable(when):
+    # same awareness as the validity columns
+    if settings.USE_TZ and timezone.is_naive(when):
+        return timezone.make_aware(when)
+    if not settings.USE_TZ and timezone.is_aware(when):
+        return timezone.make_naive(when)
+    return when
+
+
+def changed_since(model, since, after_id=None, until=None, page_size=None):
+    """
+    Changes of the Items or Services between two times, to apply onto a local copy of the current catalog. A
+    VersionedModel row keeps its id and uuid across its versions (the previous version is copied to a history row)
+    so that:
+    - the rows created or updated are the current rows with a validity_from in the period,
+    - the rows deleted are the rows that are not history copies (no legacy_id) with a validity_to in the period.
+    The history copies themselves are not part of the changes. Both conditions are backed by partial indexes (see
+    migration 0015).
+    validity_from and validity_to are set when the row is written, not when its transaction commits: until trails
+    now by MedicalConfig.delta_sync_lag seconds, so that the transactions still running when a delta is computed
+    are part of a later delta rather than lost (as long as they commit within that lag).
+    The changed rows are paged on (validity_from, id): a delta cut at the page size ends at the last row returned,
+    with has_more, and the next one continues with the rows after that (validity_from, id).
+    :param since: end of the previous delta (its until), excluded unless after_id is given
+    :param after_id: id of the last row of the previous delta (its until_id) when it was cut at the page size
+    :param until: end of the delta, included, now minus the lag if None
+    :param page_size: maximum number of changed rows, MedicalConfig.delta_sync_page_size if None
+    :return: Delta(until, until_id, list of the changed rows, list of Tombstone, has_more)
+    """
+    from core.utils import TimeUtils
+    since = _comparable(since)
+    if until is None:
+        until = TimeUtils.now() - datetime.timedelta(seconds=MedicalConfig.delta_sync_lag)
+    until = _comparable(until)
+    page_size = page_size or MedicalConfig.delta_sync_page_size
+    after = Q(validity_from__gt=since)
+    if after_id is not None:
+        after |= Q(validity_from=since, id__gt=after_id)
+    changed = list(model.objects
+                   .filter(after, validity_to__isnull=True, validity_from__lte=until)
+                   .order_by("validity_from", "id")[:page_size + 1])
+    has_more = len(changed) > page_size
+    until_id = None
+    if has_more:
+        changed = changed[:page_size]
+        until, until_id = changed[-1].validity_from, changed[-1].id
+    removed = [
+        Tombstone(*row) for row in model.objects
+        .filter(legacy_id__isnull=True, validity_to__gt=since, validity_to__lte=until)
+        .order_by("validity_to")
+        .values_list("uuid", "code", "validity_to")
+    ]
+    return Delta(until, until_id, changed, removed, has_more)
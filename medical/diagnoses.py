@@ -0,0 +1,156 @@
+import csv
+import logging
+import time
+
+from django.db import transaction
+
+from medical.models import Diagnosis
+from medical.search import invalidate_diagnosis_search_index
+from medical.services import chunks, delete_history_in_bulk
+from medical.versions import bump_catalog_version, ENTITY_DIAGNOSIS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+# first errors kept in the statistics, the others are only counted
+MAX_REPORTED_ERRORS = 20
+
+CODE_MAX_LENGTH = Diagnosis._meta.get_field("code").max_length
+NAME_MAX_LENGTH = Diagnosis._meta.get_field("name").max_length
+
+
+def read_code_file(lines, delimiter=None):
+    """
+    Streams the (code, name) rows of a CSV or TSV code file with a header line naming (at least) the code and
+    name columns.
+    :param lines: iterable of text lines (e.g. an opened file)
+    :param delimiter: column separator, guessed from the header line if None
+    """
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        return
+    if delimiter is None:
+        delimiter = "\t" if "\t" in header else csv.Sniffer().sniff(header, delimiters=",;|").delimiter
+    columns = [column.strip().lower() for column in next(csv.reader([header], delimiter=delimiter))]
+    if "code" not in columns or "name" not in columns:
+        raise ValueError("the header line must name a code and a name column, got: %s" % ", ".join(columns))
+    code_column, name_column = columns.index("code"), columns.index("name")
+    for row in csv.reader(lines, delimiter=delimiter):
+        if not row:
+            continue
+        yield (row[code_column].strip() if len(row) > code_column else "",
+               row[name_column].strip() if len(row) > name_column else "")
+
+
+def _history(current, now):
+    # same copy as VersionedModel.save_history(), built from the loaded values
+    diagnosis_id, code, name, validity_from, audit_user_id = current
+    return Diagnosis(code=code, name=name, validity_from=validity_from, validity_to=now, legacy_id=diagnosis_id,
+                     audit_user_id=audit_user_id)
+
+
+def load_diagnoses(rows, audit_user_id, dry_run=False, remove_missing=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Synchronizes the current diagnoses with a code set, diffing by code against the current rows loaded in memory:
+    new codes are bulk inserted, renamed codes get a history copy and a new validity_from (like
+    save_history()), and with remove_missing the current codes that are not in the set are deleted (like
+    delete_history()). Rows are written chunk_size at a time, one transaction per chunk.
+    A code with several current rows is reported in duplicated and its rows of the file are invalid: it is left
+    as it is until the duplicates are fixed.
+    :param rows: iterable of (code, name), see read_code_file()
+    :param dry_run: only compute the statistics
+    :param remove_missing: also delete the current codes that are not in the set
+    :return: statistics: read, created, updated, unchanged, deleted, invalid, errors, duplicated, seconds,
+             rows_per_second
+    """
+    from core.utils import TimeUtils
+    started = time.monotonic()
+    stats = {"read": 0, "created": 0, "updated": 0, "unchanged": 0, "deleted": 0, "invalid": 0, "errors": [],
+             "duplicated": []}
+    current, duplicated = {}, {}
+    for row in Diagnosis.objects \
+            .filter(validity_to__isnull=True) \
+            .values_list("id", "code", "name", "validity_from", "audit_user_id") \
+            .iterator(chunk_size=chunk_size):
+        if row[1] in current:
+            duplicated.setdefault(row[1], [current[row[1]][0]]).append(row[0])
+        else:
+            current[row[1]] = row
+    for code, ids in sorted(duplicated.items()):
+        del current[code]
+        stats["duplicated"].append({"code": code, "ids": sorted(ids)})
+        logger.warning("diagnosis code %s has %s current rows, left unchanged", code, len(ids))
+    seen = set()
+
+    def invalid(line, message):
+        stats["invalid"] += 1
+        if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+            stats["errors"].append({"row": line, "message": message})
+
+    def write(created, updated):
+        if dry_run or not (created or updated):
+            return
+        now = TimeUtils.now()
+        with transaction.atomic():
+            Diagnosis.objects.bulk_create([_history(current[code], now) for code, _ in updated])
+            Diagnosis.objects.bulk_update([
+                Diagnosis(id=current[code][0], name=name, validity_from=now, audit_user_id=audit_user_id)
+                for code, name in updated
+            ], ["name", "validity_from", "audit_user_id"])
+            Diagnosis.objects.bulk_create([
+                Diagnosis(code=code, name=name, validity_from=now, audit_user_id=audit_user_id)
+                for code, name in created
+            ])
+            bump_catalog_version(ENTITY_DIAGNOSIS)
+
+    created, updated = [], []
+    for line, (code, name) in enumerate(rows, start=1):
+        stats["read"] += 1
+        if not code or not name:
+            invalid(line, "code and name are required")
+            continue
+        if len(code) > CODE_MAX_LENGTH or len(name) > NAME_MAX_LENGTH:
+            invalid(line, f"code {code} or its name is too long")
+            continue
+        if code in seen:
+            invalid(line, f"code {code} is duplicated")
+            continue
+        if code in duplicated:
+            invalid(line, f"code {code} has several current diagnoses")
+            continue
+        seen.add(code)
+        existing = current.get(code)
+        if existing is None:
+            created.append((code, name))
+        elif existing[2] != name:
+            updated.append((code, name))
+        else:
+            stats["unchanged"] += 1
+        if len(created) + len(updated) >= chunk_size:
+            write(created, updated)
+            stats["created"] += len(created)
+            stats["updated"] += len(updated)
+            created, updated = [], []
+    write(created, updated)
+    stats["created"] += len(created)
+    stats["updated"] += len(updated)
+
+    if remove_missing:
+        removed = [row[0] for code, row in current.items() if code not in seen]
+        stats["deleted"] = len(removed)
+        if removed and not dry_run:
+            now = TimeUtils.now()
+            for chunk in chunks(removed, chunk_size):
+                with transaction.atomic():
+                    delete_history_in_bulk(Diagnosis, chunk, now)
+                    bump_catalog_version(ENTITY_DIAGNOSIS)
+
+    if not dry_run:
+        # bulk writes send no post_save
+        invalidate_diagnosis_search_index()
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    stats["rows_per_second"] = round(stats["read"] / stats["seconds"]) if stats["seconds"] else None
+    logger.info("diagnoses loaded%s: %s", " (dry run)" if dry_run else "",
+                {key: value for key, value in stats.items() if key != "errors"})
+    return stats
@@ -0,0 +1,140 @@
+import calendar
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+from django.db.models import F
+
+from medical.temporal import end_of_day, versions_queryset
+from medical.versions import catalog_version, entities_of
+
+logger = logging.getLogger(__name__)
+
+VERDICT_ELIGIBLE = "eligible"
+# no version of the item/service is valid on the visit date
+VERDICT_NOT_VALID = "not_valid"
+VERDICT_PATIENT_CATEGORY = "patient_category"
+VERDICT_CARE_TYPE = "care_type"
+
+# care types as bits, so that both (B) covers out- and in-patient visits
+_CARE_TYPE_BITS = {"O": 1, "I": 2, "B": 3}
+_NO_END = np.iinfo(np.int64).max
+
+EligibilityRequest = namedtuple("EligibilityRequest", ["id", "patient_mask", "care_type", "visit_date"])
+
+
+def _seconds(when):
+    # naive datetimes are compared as they are stored, whatever the local time zone
+    return calendar.timegm(when.utctimetuple() if when.tzinfo is not None else when.timetuple())
+
+
+class EligibilityIndex:
+    """
+    Columns of all the versions of the Items or Services (archived ones included), to check claim lines in batch:
+    the versions of a row (the current row and its history copies, by legacy_id) are sorted by
+    (id << 32 | validity_from in seconds) so that the version valid at a time is found with one searchsorted for
+    the whole batch. The index is rebuilt when the catalog version of the model changed (see medical.versions).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._version = None
+        self._columns = None
+        self.loads = 0
+
+    def _load(self):
+        rows = list(versions_queryset(self.model)
+                    .values_list("id", "legacy_id", "validity_from", "validity_to", "patient_category", "care_type")
+                    .iterator(chunk_size=5000))
+        ids = np.array([row[1] or row[0] for row in rows], dtype=np.int64)
+        starts = np.array([max(_seconds(row[2]), 0) for row in rows], dtype=np.int64)
+        keys = (ids << 32) | starts
+        order = np.argsort(keys, kind="stable")
+        self._columns = {
+            "ids": ids[order],
+            "keys": keys[order],
+            "ends": np.array([_NO_END if row[3] is None else _seconds(row[3]) for row in rows], dtype=np.int64)[order],
+            "categories": np.array([row[4] or 0 for row in rows], dtype=np.int64)[order],
+            "care_types": np.array([_CARE_TYPE_BITS.get(row[5], 0) for row in rows], dtype=np.int64)[order],
+        }
+        self.loads += 1
+        logger.debug("medical %s eligibility index loaded with %s versions", self.model.__name__, len(rows))
+
+    def columns(self):
+        version = catalog_version(entities_of(self.model)[0])
+        with self._lock:
+            if self._columns is None or version != self._version:
+                self._load()
+                self._version = version
+            return self._columns
+
+    def invalidate(self):
+        with self._lock:
+            self._columns = None
+
+    def check(self, requests):
+        """
+        :param requests: iterable of (item or service id, patient mask, care type O/I/B, visit date) tuples
+        :return: the verdict of each request, in order: VERDICT_ELIGIBLE, VERDICT_NOT_VALID,
+                 VERDICT_PATIENT_CATEGORY (the patient mask is not included in the patient_category of the version
+                 valid on the visit date) or VERDICT_CARE_TYPE (the care type is not covered by the version)
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+        columns = self.columns()
+        if not len(columns["ids"]):
+            return [VERDICT_NOT_VALID] * len(requests)
+        times = {date: _seconds(end_of_day(date)) for date in {request[3] for request in requests}}
+        request_ids = np.array([request[0] for request in requests], dtype=np.int64)
+        request_masks = np.array([request[1] or 0 for request in requests], dtype=np.int64)
+        request_care = np.array([_CARE_TYPE_BITS.get(request[2], 0) for request in requests], dtype=np.int64)
+        request_times = np.array([times[request[3]] for request in requests], dtype=np.int64)
+
+        # last version of the id starting at or before the visit, still valid at the visit
+        positions = np.searchsorted(columns["keys"], (request_ids << 32) | request_times, side="right") - 1
+        found = positions >= 0
+        positions = np.where(found, positions, 0)
+        found &= (columns["ids"][positions] == request_ids) & (columns["ends"][positions] >= request_times)
+        categories = columns["categories"][positions]
+        care_types = columns["care_types"][positions]
+        verdicts = np.select(
+            [~found,
+             (categories & request_masks) != request_masks,
+             (care_types & request_care) != request_care],
+            [VERDICT_NOT_VALID, VERDICT_PATIENT_CATEGORY, VERDICT_CARE_TYPE],
+            default=VERDICT_ELIGIBLE)
+        return verdicts.tolist()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def eligibility_index_for(model):
+    with _indexes_lock:
+        if model not in _indexes:
+            _indexes[model] = EligibilityIndex(model)
+        return _indexes[model]
+
+
+def check_eligibility(model, requests):
+    """
+    Checks a batch of claim lines against the patient categories and care types of the Items or Services, see
+    EligibilityIndex.check()
+    """
+    return eligibility_index_for(model).check(requests)
+
+
+def filter_eligible(queryset, patient_mask, care_type):
+    """
+    Same check on the database, for an Item or Service queryset: the rows whose patient_category includes the
+    patient mask and whose care type covers the given one.
+    """
+    care_types = [code for code, bits in _CARE_TYPE_BITS.items() if bits & _CARE_TYPE_BITS[care_type] ==
+                  _CARE_TYPE_BITS[care_type]]
+    return queryset \
+        .annotate(patient_category_match=F("patient_category").bitand(patient_mask)) \
+        .filter(patient_category_match=patient_mask, care_type__in=care_types)
@@ -1,2 +1,8 @@
 class CodeAlreadyExistsError(Exception):
     pass
+
+
+class PackageCycleError(Exception):
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("Package cycle: %s" % " -> ".join(str(service_id) for service_id in cycle))
@@ -0,0 +1,93 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from medical.models import Diagnosis, Item, Service, ServiceItem, ServiceService
+from medical.temporal import end_of_day, validity_q, versions_queryset
+
+EXPORT_CHUNK_SIZE = 2000
+
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+FORMATS = [FORMAT_CSV, FORMAT_NDJSON]
+
+CONTENT_TYPES = {
+    FORMAT_CSV: "text/csv",
+    FORMAT_NDJSON: "application/x-ndjson",
+}
+
+_VERSION_FIELDS = ["validity_from", "validity_to", "legacy_id"]
+
+# entity name -> (model, exported fields, prefix of the versioned model used for the validity filter)
+EXPORTS = {
+    "items": (Item, [
+        "id", "uuid", "code", "name", "type", "package", "price", "quantity", "maximum_amount", "care_type",
+        "frequency", "patient_category", *_VERSION_FIELDS,
+    ], ""),
+    "services": (Service, [
+        "id", "uuid", "code", "name", "type", "category", "level", "packagetype", "manualPrice", "price",
+        "maximum_amount", "care_type", "frequency", "patient_category", *_VERSION_FIELDS,
+    ], ""),
+    "service_items": (ServiceItem, [
+        "id", "parent_id", "item_id", "qty_provided", "price_asked", "status", "pcpDate",
+    ], "parent__"),
+    "service_services": (ServiceService, [
+        "id", "parent_id", "service_id", "qty_provided", "price_asked", "status", "scpDate",
+    ], "parent__"),
+    "diagnoses": (Diagnosis, ["id", "code", "name", *_VERSION_FIELDS], ""),
+}
+
+
+def _validity_filter(as_of=None, prefix=""):
+    # core.filter_validity() semantics (see medical.temporal), with a prefix for the package links
+    if as_of is None:
+        return [Q(**{f"{prefix}validity_to__isnull": True})]
+    return [validity_q(end_of_day(as_of), prefix)]
+
+
+def export_queryset(entity, show_history=False, as_of=None):
+    """
+    Same row selection as the resolvers: the current rows by default, the rows valid at a date with as_of
+    (archived versions included, like temporal.as_of()), all the versions with show_history. Package links follow
+    the validity of their parent package.
+    :return: a values_list queryset ordered by id
+    """
+    model, fields, prefix = EXPORTS[entity]
+    if show_history:
+        return model.objects.order_by("id").values_list(*fields)
+    queryset = versions_queryset(model) if as_of is not None else model.objects.all()
+    queryset = queryset.filter(*_validity_filter(as_of, prefix))
+    return queryset.order_by("id").values_list(*fields)
+
+
+class _Echo:
+    """Pseudo-buffer for csv.writer, writerow() then returns the encoded line instead of writing it"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(fields, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(fields, rows):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + "\n"
+
+
+def stream_export(entity, export_format=FORMAT_CSV, show_history=False, as_of=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generator of the encoded lines of an export. Rows are fetched with a server-side cursor (where the backend
+    supports it) chunk_size at a time, so memory use does not depend on the size of the catalog.
+    """
+    _, fields, _ = EXPORTS[entity]
+    rows = export_queryset(entity, show_history, as_of).iterator(chunk_size=chunk_size)
+    if export_format == FORMAT_NDJSON:
+        return _ndjson_lines(fields, rows)
+    return _csv_lines(fields, rows)
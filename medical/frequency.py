@@ -0,0 +1,134 @@
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from medical.versions import catalog_version, entities_of
+
+logger = logging.getLogger(__name__)
+
+# (code index << 32) | (day + _DAY_OFFSET): the utilisation sorted by code, then date
+_DAY_OFFSET = 1 << 31
+
+FrequencyViolation = namedtuple("FrequencyViolation", ["line", "code", "date", "previous_date", "frequency"])
+
+
+def _days(dates):
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+class FrequencyRules:
+    """
+    Frequency (minimum number of days between two uses by the same insuree) of the current Items or Services that
+    have one, as sorted code/frequency arrays. The rules are reloaded when the catalog version of the model changed
+    (see medical.versions).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._version = None
+        self._rules = None
+        self.loads = 0
+
+    def _load(self):
+        code_length = self.model._meta.get_field("code").max_length
+        rows = sorted(self.model.objects
+                      .filter(validity_to__isnull=True, frequency__isnull=False, frequency__gt=0)
+                      .values_list("code", "frequency"))
+        self._rules = (np.array([row[0] for row in rows], dtype=f"U{code_length}"),
+                       np.array([row[1] for row in rows], dtype=np.int64))
+        self.loads += 1
+        logger.debug("medical %s frequency rules loaded: %s", self.model.__name__, len(rows))
+
+    def rules(self):
+        """
+        :return: (sorted codes, frequencies) arrays
+        """
+        version = catalog_version(entities_of(self.model)[0])
+        with self._lock:
+            if self._rules is None or version != self._version:
+                self._load()
+                self._version = version
+            return self._rules
+
+    def invalidate(self):
+        with self._lock:
+            self._rules = None
+
+    @staticmethod
+    def _code_indexes(codes, rule_codes):
+        # index of the rule of each code, -1 if the code has no frequency
+        codes = np.asarray(codes, dtype=str)
+        positions = np.searchsorted(rule_codes, codes)
+        clipped = np.minimum(positions, len(rule_codes) - 1)
+        return np.where(rule_codes[clipped] == codes, clipped, -1)
+
+    def violations(self, prior_codes, prior_dates, codes, dates):
+        """
+        Checks claim lines against the prior utilisation of an insuree: a line violates the frequency of its
+        item/service if the insuree used it less than frequency days before or after (a later claim can be
+        entered first). The prior utilisation is sorted once by (code, date) and every line is checked with one
+        searchsorted, whatever the number of lines.
+        :param prior_codes: codes of the prior utilisation (array or list), without the lines to check
+        :param prior_dates: dates of the prior utilisation, same length
+        :param codes: codes of the lines to check
+        :param dates: dates of the lines to check
+        :return: a FrequencyViolation (line index, code, date, closest prior date, frequency) per violating line
+        """
+        rule_codes, frequencies = self.rules()
+        if not len(rule_codes) or not len(codes):
+            return []
+        prior_indexes = self._code_indexes(prior_codes, rule_codes)
+        with_rule = prior_indexes >= 0
+        prior_keys = np.sort((prior_indexes[with_rule] << 32) | (_days(prior_dates)[with_rule] + _DAY_OFFSET))
+
+        line_indexes = self._code_indexes(codes, rule_codes)
+        line_days = _days(dates)
+        lines = np.nonzero(line_indexes >= 0)[0]
+        if not len(prior_keys) or not len(lines):
+            return []
+        code_indexes = line_indexes[lines]
+        keys = (code_indexes << 32) | (line_days[lines] + _DAY_OFFSET)
+        frequency = frequencies[code_indexes]
+        # closest prior use of the same code, before (or on) and after the line
+        after = np.searchsorted(prior_keys, keys, side="right")
+        before = after - 1
+        last = len(prior_keys) - 1
+        before_keys = prior_keys[np.maximum(before, 0)]
+        after_keys = prior_keys[np.minimum(after, last)]
+        has_before = (before >= 0) & (before_keys >> 32 == code_indexes)
+        has_after = (after <= last) & (after_keys >> 32 == code_indexes)
+        before_gap = keys - before_keys
+        after_gap = after_keys - keys
+        violates_before = has_before & (before_gap < frequency)
+        violates_after = has_after & (after_gap < frequency)
+        violating = np.nonzero(violates_before | violates_after)[0]
+
+        use_before = violates_before & (~violates_after | (before_gap <= after_gap))
+        previous_keys = np.where(use_before, before_keys, after_keys)
+        previous_dates = ((previous_keys & 0xFFFFFFFF) - _DAY_OFFSET).astype("datetime64[D]")
+        codes = np.asarray(codes)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        return [FrequencyViolation(int(lines[index]), str(codes[lines[index]]), dates[lines[index]].item(),
+                                   previous_dates[index].item(), int(frequency[index]))
+                for index in violating]
+
+
+_rules = {}
+_rules_lock = threading.Lock()
+
+
+def frequency_rules_for(model):
+    with _rules_lock:
+        if model not in _rules:
+            _rules[model] = FrequencyRules(model)
+        return _rules[model]
+
+
+def frequency_violations(model, prior_codes, prior_dates, codes, dates):
+    """
+    See FrequencyRules.violations()
+    """
+    return frequency_rules_for(model).violations(prior_codes, prior_dates, codes, dates)
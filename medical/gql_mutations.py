@@ -14,9 +14,10 @@ from django.contrib.auth.models import AnonymousUser
 from django.core.exceptions import ValidationError, PermissionDenied
 from medical.apps import MedicalConfig
 from medical.models import Service, ServiceMutation, Item, ItemMutation, ServiceService, ServiceItem
-from medical.services import set_item_or_service_deleted
+from medical.services import set_items_or_services_deleted
 from django.db import models
 from medical.utils import process_items_relations, process_services_relations
+from medical.bulk import bulk_upsert_items_or_services, parse_upsert_file, report_errors
 
 
 logger = logging.getLogger(__name__)
@@ -192,6 +193,8 @@ def check_if_code_already_exists(
         data: dict,
         item_service_model: django.db.models.base.ModelBase
 ):
+    # checked against the database and not the catalog cache: the cache of this process can miss a code that
+    # another process created less than catalog_cache_ttl seconds ago
     if item_service_model.objects.all().filter(code=data['code'], validity_to__isnull=True).exists():
         raise CodeAlreadyExistsError(_("Code already exists."))
 
@@ -269,19 +272,7 @@ class DeleteServiceMutation(OpenIMISMutation):
     def async_mutate(cls, user, **data):
         if not user.has_perms(MedicalConfig.gql_mutation_medical_services_delete_perms):
             raise PermissionDenied(_("unauthorized"))
-        errors = []
-        for service_uuid in data["uuids"]:
-            service = Service.objects \
-                .filter(uuid=service_uuid) \
-                .first()
-            if service is None:
-                errors.append({
-                    'title': service_uuid,
-                    'list': [{'message': _(
-                        "service.validation.id_does_not_exist") % {'id': service_uuid}}]
-                })
-                continue
-            errors += set_item_or_service_deleted(service, "service")
+        errors = set_items_or_services_deleted(Service, data["uuids"], "service")
         if len(errors) == 1:
             errors = errors[0]['list']
         return errors
@@ -291,6 +282,98 @@ class ItemInputType(ItemOrServiceInputType):
     package = graphene.String()
     quantity = graphene.Decimal()
 
+
+class BulkItemOrServiceRowType(InputObjectType):
+    uuid = graphene.String(required=False)
+    code = ServiceCodeInputType(required=True)
+    name = graphene.String(required=True)
+    type = graphene.String(required=True)
+    care_type = graphene.String(required=True)
+    patient_category = graphene.Int(required=False)
+    patient_categories = graphene.List(of_type=PatientCategoriesEnum, required=False)
+    frequency = graphene.Decimal(required=False)
+    price = graphene.Decimal(required=True)
+    maximum_amount = graphene.Decimal(required=False)
+
+
+class BulkItemRowType(BulkItemOrServiceRowType):
+    package = graphene.String()
+    quantity = graphene.Decimal()
+
+
+class BulkServiceRowType(BulkItemOrServiceRowType):
+    level = graphene.String(required=True)
+    packagetype = graphene.String(required=False)
+    manualPrice = graphene.Boolean(required=False)
+    category = graphene.String(required=False)
+
+
+class BulkUpsertItemsOrServicesMutation(OpenIMISMutation):
+    """
+    Creates or updates a whole list of items/services, given as rows or as a CSV file content, with a constant
+    number of queries per chunk of rows. Failed rows are returned in the errors, one entry per row.
+    """
+    rows_field = None
+
+    @classmethod
+    def do_mutate(cls, perms, user, **data):
+        if type(user) is AnonymousUser or not user.id:
+            raise ValidationError(
+                _("mutation.authentication_required"))
+        if not user.has_perms(perms):
+            raise PermissionDenied(_("unauthorized"))
+        rows = list(data.get(cls.rows_field) or [])
+        if data.get("file"):
+            rows += parse_upsert_file(data["file"])
+        report = bulk_upsert_items_or_services(
+            cls.item_service_model, rows, user, client_mutation_id=data.get("client_mutation_id"))
+        logger.info("Bulk upsert of %s rows: %s", len(report),
+                    {status: sum(1 for entry in report if entry["status"] == status)
+                     for status in {entry["status"] for entry in report}})
+        return report_errors(report)
+
+
+class BulkUpsertItemsMutation(BulkUpsertItemsOrServicesMutation):
+    _mutation_module = "medical"
+    _mutation_class = "BulkUpsertItemsMutation"
+    item_service_model = Item
+    rows_field = "items"
+
+    class Input(OpenIMISMutation.Input):
+        items = graphene.List(BulkItemRowType, required=False)
+        file = graphene.String(required=False, description="CSV content, one item per line after a header line")
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        try:
+            return cls.do_mutate(MedicalConfig.gql_mutation_medical_items_add_perms
+                                 + MedicalConfig.gql_mutation_medical_items_update_perms, user, **data)
+        except Exception as exc:
+            return [{
+                'message': _("item.mutation.failed_to_bulk_upsert_items"),
+                'detail': str(exc)}]
+
+
+class BulkUpsertServicesMutation(BulkUpsertItemsOrServicesMutation):
+    _mutation_module = "medical"
+    _mutation_class = "BulkUpsertServicesMutation"
+    item_service_model = Service
+    rows_field = "services"
+
+    class Input(OpenIMISMutation.Input):
+        services = graphene.List(BulkServiceRowType, required=False)
+        file = graphene.String(required=False, description="CSV content, one service per line after a header line")
+
+    @classmethod
+    def async_mutate(cls, user, **data):
+        try:
+            return cls.do_mutate(MedicalConfig.gql_mutation_medical_services_add_perms
+                                 + MedicalConfig.gql_mutation_medical_services_update_perms, user, **data)
+        except Exception as exc:
+            return [{
+                'message': _("service.mutation.failed_to_bulk_upsert_services"),
+                'detail': str(exc)}]
+
 class CreateItemMutation(CreateOrUpdateItemOrServiceMutation):
     _mutation_module = "medical"
     _mutation_class = "CreateItemMutation"
@@ -338,19 +421,7 @@ class DeleteItemMutation(OpenIMISMutation):
     def async_mutate(cls, user, **data):
         if not user.has_perms(MedicalConfig.gql_mutation_medical_items_delete_perms):
             raise PermissionDenied(_("unauthorized"))
-        errors = []
-        for item_uuid in data["uuids"]:
-            item = Item.objects \
-                .filter(uuid=item_uuid) \
-                .first()
-            if item is None:
-                errors.append({
-                    'title': item_uuid,
-                    'list': [{'message': _(
-                        "item.validation.id_does_not_exist") % {'id': item_uuid}}]
-                })
-                continue
-            errors += set_item_or_service_deleted(item, "item")
+        errors = set_items_or_services_deleted(Item, data["uuids"], "item")
         if len(errors) == 1:
             errors = errors[0]['list']
         return errors
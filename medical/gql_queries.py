@@ -2,6 +2,7 @@ import graphene
 from core import prefix_filterset, ExtendedConnection, filter_validity
 from graphene.utils.deduplicator import deflate
 from graphene_django import DjangoObjectType
+from .dataloaders import get_dataloader
 from .models import Service, ServiceItem, ServiceService
 
 
@@ -28,12 +29,34 @@ class ServiceGQLType(DjangoObjectType):
     #     service_ids = Service.get_queryset(queryset, info).values('uuid').all()
     #     return Service.objects.filter(uuid__in=service_ids)
 
+    # the package relations are batched per request, whatever the page size
+    def resolve_servicesLinked(self, info):
+        return get_dataloader(info, "medical_service_items_by_parent_loader").load(self.id)
+
+    def resolve_serviceservice_set(self, info):
+        return get_dataloader(info, "medical_service_services_by_parent_loader").load(self.id)
+
+    def resolve_servicesServices(self, info):
+        return get_dataloader(info, "medical_service_services_by_service_loader").load(self.id)
+
 
 class ServiceItemGQLType(DjangoObjectType):
     class Meta:
         model = ServiceItem
 
+    def resolve_item(self, info):
+        return get_dataloader(info, "medical_item_loader").load(self.item_id)
+
+    def resolve_parent(self, info):
+        return get_dataloader(info, "medical_service_loader").load(self.parent_id)
+
 
 class ServiceServiceGQLType(DjangoObjectType):
     class Meta:
         model = ServiceService
+
+    def resolve_service(self, info):
+        return get_dataloader(info, "medical_service_loader").load(self.service_id)
+
+    def resolve_parent(self, info):
+        return get_dataloader(info, "medical_service_loader").load(self.parent_id)
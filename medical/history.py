@@ -0,0 +1,69 @@
+from collections import namedtuple
+
+from django.db.models import IntegerField, Q, Subquery
+from django.db.models.functions import Coalesce
+
+# the persisted fields whose change creates a new version: all but the keys, the validity and the audit user.
+# Broader than Item.__eq__ and Service.__eq__, which ignore maximum_amount, packagetype and manualPrice
+VERSIONED_FIELDS = {
+    "Item": ("code", "name", "type", "price", "care_type", "patient_category", "quantity", "frequency", "package",
+             "maximum_amount"),
+    "Service": ("code", "name", "type", "level", "price", "care_type", "patient_category", "frequency", "category",
+                "packagetype", "manualPrice", "maximum_amount"),
+}
+# optional string fields, None and empty string are the same (as in __eq__)
+_OPTIONAL_FIELDS = {"package", "category"}
+
+FieldChange = namedtuple("FieldChange", ["field", "old", "new"])
+Version = namedtuple("Version", ["instance", "changes"])
+
+
+def version_chain_queryset(model, uuid, user, include_archive=False):
+    """
+    All the versions of one Item or Service, in one query on the primary key and the (legacy_id, validity_from)
+    history index: the row with the uuid (current row or history copy) gives the id of the current row, the
+    versions are that row and the copies pointing to it by legacy_id.
+    The rows come from model.get_queryset(show_history=True): a user without the full query right (OMT-281) only
+    gets the current version.
+    """
+    root = Subquery(model.objects.filter(uuid=uuid)
+                    .values(root=Coalesce("legacy_id", "id", output_field=IntegerField()))[:1])
+    queryset = model.get_queryset(None, user, show_history=True, include_archive=include_archive)
+    return queryset.filter(Q(id=root) | Q(legacy_id=root)).order_by("validity_from", "id")
+
+
+def _same(field, old, new):
+    if field in _OPTIONAL_FIELDS:
+        return (old or None) == (new or None)
+    return old == new
+
+
+def version_changes(model, previous, version):
+    """
+    :return: the FieldChange of each versioned field that differs between two versions
+    """
+    return [FieldChange(field, getattr(previous, field), getattr(version, field))
+            for field in VERSIONED_FIELDS[model._meta.object_name]
+            if not _same(field, getattr(previous, field), getattr(version, field))]
+
+
+def is_new_version(model, previous, version):
+    """
+    :return: whether saving version over previous changes a versioned field, and so needs a history copy and a new
+             validity_from (see save_history_on_update and the bulk upsert)
+    """
+    return any(not _same(field, getattr(previous, field), getattr(version, field))
+               for field in VERSIONED_FIELDS[model._meta.object_name])
+
+
+def version_history(model, uuid, user, include_archive=False):
+    """
+    The versions of one Item or Service ordered by validity_from, each with its changes from the previous version
+    (none for the first one).
+    :return: a list of Version(instance, changes)
+    """
+    history, previous = [], None
+    for version in version_chain_queryset(model, uuid, user, include_archive):
+        history.append(Version(version, [] if previous is None else version_changes(model, previous, version)))
+        previous = version
+    return history
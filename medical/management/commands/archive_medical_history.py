@@ -0,0 +1,45 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medical.archive import DEFAULT_CHUNK_SIZE, archive_history
+from medical.models import Item, Service
+
+MODELS = {"item": Item, "service": Service}
+
+
+def _size(size):
+    return "unknown" if size is None else f"{size / 1024:.0f} KiB"
+
+
+class Command(BaseCommand):
+    help = "Moves the item and service versions closed before a cutoff to the tblItems_archive/tblServices_archive " \
+           "tables, in chunks of one transaction each: an interrupted run can just be started again."
+
+    def add_arguments(self, parser):
+        cutoff = parser.add_mutually_exclusive_group(required=True)
+        cutoff.add_argument("--before", type=datetime.date.fromisoformat,
+                            help="archive the versions closed before this date (YYYY-MM-DD)")
+        cutoff.add_argument("--older-than-days", type=int, help="archive the versions closed more than N days ago")
+        parser.add_argument("--entity", choices=sorted(MODELS), action="append",
+                            help="item and/or service (default: both)")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument("--max-chunks", type=int, help="stop after N chunks per entity, the next run resumes")
+        parser.add_argument("--dry-run", action="store_true", help="only count the versions that would be archived")
+
+    def handle(self, *args, **options):
+        if options["before"] is not None:
+            before = datetime.datetime.combine(options["before"], datetime.time.min)
+        else:
+            before = datetime.datetime.now() - datetime.timedelta(days=options["older_than_days"])
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        for entity in options["entity"] or sorted(MODELS):
+            result = archive_history(MODELS[entity], before, chunk_size=options["chunk_size"],
+                                     max_chunks=options["max_chunks"], dry_run=options["dry_run"])
+            if options["dry_run"]:
+                self.stdout.write(f"{entity}: {result.moved} versions closed before {before:%Y-%m-%d} "
+                                  f"would be archived, table size {_size(result.size_before)}")
+                continue
+            self.stdout.write(f"{entity}: {result.moved} versions archived, table size {_size(result.size_before)} "
+                              f"-> {_size(result.size_after)} ({_size(result.reclaimed)} reclaimed)")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from medical.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Writes the current items, services and package links to a memory-mappable snapshot file " \
+           "(see medical.snapshot.CatalogSnapshot)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="snapshot file, replaced atomically")
+
+    def handle(self, *args, **options):
+        header = write_snapshot(options["path"])
+        sizes = {key.split(".")[0]: spec["shape"][0] for key, spec in header["arrays"].items()
+                 if key.endswith(".id") or key == "link.parent"}
+        self.stdout.write(f"snapshot written to {options['path']}: {sizes.get('item', 0)} items, "
+                          f"{sizes.get('service', 0)} services, {sizes.get('link', 0)} package links")
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from medical.export import EXPORTS, FORMATS, FORMAT_CSV, EXPORT_CHUNK_SIZE, stream_export
+
+
+class Command(BaseCommand):
+    help = "Streams the medical catalog (items, services, package links or diagnoses) as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("entity", choices=list(EXPORTS))
+        parser.add_argument("--format", dest="export_format", choices=FORMATS, default=FORMAT_CSV)
+        parser.add_argument("--output", help="file to write to, standard output by default")
+        parser.add_argument("--show-history", action="store_true", help="export all the versions of the rows")
+        parser.add_argument("--as-of", type=datetime.date.fromisoformat,
+                            help="export the rows valid at this date (YYYY-MM-DD)")
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        lines = stream_export(
+            options["entity"], options["export_format"],
+            show_history=options["show_history"], as_of=options["as_of"], chunk_size=options["chunk_size"])
+        if not options["output"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        count = 0
+        with open(options["output"], "w", newline="", encoding="utf-8") as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        self.stdout.write(f"{count} lines written to {options['output']}")
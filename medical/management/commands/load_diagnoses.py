@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from medical.diagnoses import DEFAULT_CHUNK_SIZE, load_diagnoses, read_code_file
+
+
+class Command(BaseCommand):
+    help = "Synchronizes the diagnoses (ICD codes) with a CSV or TSV code file having code and name columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("file")
+        parser.add_argument("--delimiter", help="column separator, guessed from the header line by default")
+        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument("--dry-run", action="store_true", help="only compute the changes")
+        parser.add_argument("--remove-missing", action="store_true",
+                            help="also delete the current codes that are not in the file")
+        parser.add_argument("--audit-user-id", type=int, default=-1)
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        with open(options["file"], newline="", encoding=options["encoding"]) as code_file:
+            stats = load_diagnoses(
+                read_code_file(code_file, options["delimiter"]),
+                audit_user_id=options["audit_user_id"],
+                dry_run=options["dry_run"],
+                remove_missing=options["remove_missing"],
+                chunk_size=options["chunk_size"],
+            )
+        for error in stats["errors"]:
+            self.stderr.write(f"row {error['row']}: {error['message']}")
+        for duplicate in stats["duplicated"]:
+            self.stderr.write(f"code {duplicate['code']} has several current diagnoses (ids "
+                              f"{', '.join(str(diagnosis_id) for diagnosis_id in duplicate['ids'])}), left unchanged")
+        self.stdout.write(
+            "{mode}{read} rows read: {created} created, {updated} updated, {unchanged} unchanged, {deleted} deleted, "
+            "{invalid} invalid in {seconds}s ({rows_per_second} rows/s)".format(
+                mode="[dry run] " if options["dry_run"] else "", **stats))
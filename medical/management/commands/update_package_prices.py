@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from medical.pricing import DEFAULT_CHUNK_SIZE, update_package_prices
+
+
+class Command(BaseCommand):
+    help = "Recomputes the price of the packages (packagetype P or F without manual price) from their content."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="only list the prices that would change")
+        parser.add_argument("--audit-user-id", type=int, help="audit user of the updated services")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        changes = update_package_prices(
+            audit_user_id=options["audit_user_id"], dry_run=options["dry_run"], chunk_size=options["chunk_size"])
+        for service_id, price in sorted(changes.items()):
+            self.stdout.write(f"{service_id}\t{price}")
+        verb = "would change" if options["dry_run"] else "updated"
+        self.stdout.write(f"{len(changes)} package prices {verb}")
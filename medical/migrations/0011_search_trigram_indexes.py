@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# (table, index name, column) of the code/name columns searched with icontains by the *_str queries.
+# Django renders icontains as UPPER("col"::text) LIKE UPPER(...) on PostgreSQL, hence the indexed expression.
+TRIGRAM_INDEXES = [
+    ("tblItems", "tblItems_code_trgm", "ItemCode"),
+    ("tblItems", "tblItems_name_trgm", "ItemName"),
+    ("tblServices", "tblServices_code_trgm", "ServCode"),
+    ("tblServices", "tblServices_name_trgm", "ServName"),
+    ("tblICDCodes", "tblICDCodes_code_trgm", "ICDCode"),
+    ("tblICDCodes", "tblICDCodes_name_trgm", "ICDName"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        # other backends search through the in-memory index of medical.search
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for _, name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0010_rename_servicelinkeditem_serviceitem_parent_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
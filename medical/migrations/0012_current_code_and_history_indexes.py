@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0011_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(condition=models.Q(validity_to__isnull=True), fields=['code'],
+                               name='tblICDCodes_current_code'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(fields=['legacy_id', 'validity_from'], name='tblICDCodes_history'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(validity_to__isnull=True), fields=['code'],
+                               name='tblItems_current_code'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['legacy_id', 'validity_from'], name='tblItems_history'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(condition=models.Q(validity_to__isnull=True), fields=['code'],
+                               name='tblServices_current_code'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['legacy_id', 'validity_from'], name='tblServices_history'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+# (table, index name) of the GiST indexes on the validity range used by medical.temporal.as_of() on PostgreSQL.
+# The range constructor has to match the column type for the expression to be immutable.
+RANGE_INDEXES = [
+    ("tblItems", "tblItems_validity_range"),
+    ("tblServices", "tblServices_validity_range"),
+]
+
+
+def create_range_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        # other backends resolve the versions with the (code, validity_from) index and medical.temporal
+        return
+    for table, name in RANGE_INDEXES:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                [table, "ValidityFrom"])
+            row = cursor.fetchone()
+        range_function = "tstzrange" if row and "with time zone" in row[0] else "tsrange"
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" '
+            f'USING gist ({range_function}("ValidityFrom", "ValidityTo", \'[]\'))'
+        )
+
+
+def drop_range_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for _, name in RANGE_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0012_current_code_and_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['code', 'validity_from'], name='tblItems_code_validity'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['code', 'validity_from'], name='tblServices_code_validity'),
+        ),
+        migrations.RunPython(create_range_indexes, drop_range_indexes),
+    ]
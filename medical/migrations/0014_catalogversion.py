@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0013_validity_range_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('entity', models.CharField(db_column='Entity', max_length=20, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(db_column='Version', default=0)),
+            ],
+            options={
+                'db_table': 'medical_CatalogVersion',
+                'managed': True,
+            },
+        ),
+    ]
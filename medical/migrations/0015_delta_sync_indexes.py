@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0014_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(validity_to__isnull=True), fields=['validity_from'],
+                               name='tblItems_changed'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(legacy_id__isnull=True), fields=['validity_to'],
+                               name='tblItems_removed'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(condition=models.Q(validity_to__isnull=True), fields=['validity_from'],
+                               name='tblServices_changed'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(condition=models.Q(legacy_id__isnull=True), fields=['validity_to'],
+                               name='tblServices_removed'),
+        ),
+    ]
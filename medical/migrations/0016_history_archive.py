@@ -0,0 +1,74 @@
+import core.fields
+import datetime
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0015_delta_sync_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemArchive',
+            fields=[
+                ('validity_from', core.fields.DateTimeField(db_column='ValidityFrom', default=datetime.datetime.now)),
+                ('validity_to', core.fields.DateTimeField(blank=True, db_column='ValidityTo', null=True)),
+                ('legacy_id', models.IntegerField(blank=True, db_column='LegacyID', null=True)),
+                ('id', models.IntegerField(db_column='ItemID', primary_key=True, serialize=False)),
+                ('uuid', models.CharField(db_column='ItemUUID', default=uuid.uuid4, max_length=36,
+                                          unique=True)),
+                ('code', models.CharField(db_column='ItemCode', max_length=6)),
+                ('name', models.CharField(db_column='ItemName', max_length=100)),
+                ('type', models.CharField(db_column='ItemType', max_length=1)),
+                ('package', models.CharField(blank=True, db_column='ItemPackage', max_length=255, null=True)),
+                ('price', models.DecimalField(db_column='ItemPrice', decimal_places=2, max_digits=18)),
+                ('quantity', models.DecimalField(blank=True, db_column='Quantity', decimal_places=2, max_digits=18,
+                                                  null=True)),
+                ('maximum_amount', models.DecimalField(blank=True, db_column='MaximumAmount', decimal_places=2,
+                                                        max_digits=18, null=True)),
+                ('care_type', models.CharField(db_column='ItemCareType', max_length=1)),
+                ('frequency', models.SmallIntegerField(blank=True, db_column='ItemFrequency', null=True)),
+                ('patient_category', models.SmallIntegerField(db_column='ItemPatCat')),
+                ('audit_user_id', models.IntegerField(db_column='AuditUserID')),
+            ],
+            options={
+                'db_table': 'tblItems_archive',
+                'managed': True,
+                'indexes': [models.Index(fields=['legacy_id', 'validity_from'], name='tblItems_archive_history')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ServiceArchive',
+            fields=[
+                ('validity_from', core.fields.DateTimeField(db_column='ValidityFrom', default=datetime.datetime.now)),
+                ('validity_to', core.fields.DateTimeField(blank=True, db_column='ValidityTo', null=True)),
+                ('legacy_id', models.IntegerField(blank=True, db_column='LegacyID', null=True)),
+                ('id', models.IntegerField(db_column='ServiceID', primary_key=True, serialize=False)),
+                ('uuid', models.CharField(db_column='ServiceUUID', default=uuid.uuid4, max_length=36,
+                                          unique=True)),
+                ('category', models.CharField(blank=True, db_column='ServCategory', max_length=1, null=True)),
+                ('code', models.CharField(db_column='ServCode', max_length=6)),
+                ('name', models.CharField(db_column='ServName', max_length=100)),
+                ('type', models.CharField(db_column='ServType', max_length=1)),
+                ('packagetype', models.CharField(choices=[('P', 'P'), ('S', 'S'), ('F', 'F')],
+                                                 db_column='ServPackageType', default='S', max_length=1)),
+                ('manualPrice', models.BooleanField(default=False)),
+                ('level', models.CharField(db_column='ServLevel', max_length=1)),
+                ('price', models.DecimalField(db_column='ServPrice', decimal_places=2, max_digits=18)),
+                ('maximum_amount', models.DecimalField(blank=True, db_column='MaximumAmount', decimal_places=2,
+                                                        max_digits=18, null=True)),
+                ('care_type', models.CharField(db_column='ServCareType', max_length=1)),
+                ('frequency', models.SmallIntegerField(blank=True, db_column='ServFrequency', null=True)),
+                ('patient_category', models.SmallIntegerField(db_column='ServPatCat', default=15)),
+                ('audit_user_id', models.IntegerField(blank=True, db_column='AuditUserID', null=True)),
+            ],
+            options={
+                'db_table': 'tblServices_archive',
+                'managed': True,
+                'indexes': [models.Index(fields=['legacy_id', 'validity_from'], name='tblServices_archive_history')],
+            },
+        ),
+    ]
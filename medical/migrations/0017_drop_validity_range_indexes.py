@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# the GiST indexes created by migration 0013: medical.temporal.as_of() now uses the same
+# validity_from/validity_to predicate on all the backends, so no query uses them anymore
+RANGE_INDEXES = [
+    ("tblItems", "tblItems_validity_range"),
+    ("tblServices", "tblServices_validity_range"),
+]
+
+
+def drop_range_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for _, name in RANGE_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+def create_range_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, name in RANGE_INDEXES:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                [table, "ValidityFrom"])
+            row = cursor.fetchone()
+        range_function = "tstzrange" if row and "with time zone" in row[0] else "tsrange"
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" '
+            f'USING gist ({range_function}("ValidityFrom", "ValidityTo", \'[]\'))'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0016_history_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_range_indexes, create_range_indexes),
+    ]
@@ -0,0 +1,97 @@
+import core.fields
+import datetime
+import uuid
+from django.db import migrations, models
+
+# (model, view): the views of all the versions of Item and Service, their current table and archive table
+VERSION_VIEWS = [
+    ("Item", "tblItems_versions"),
+    ("Service", "tblServices_versions"),
+]
+
+
+def create_version_views(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for model_name, view in VERSION_VIEWS:
+        model = apps.get_model("medical", model_name)
+        archive = apps.get_model("medical", f"{model_name}Archive")
+        # the columns in the order of the model, as ItemVersion/ServiceVersion load them as Item/Service instances
+        columns = ", ".join(quote(field.column) for field in model._meta.concrete_fields)
+        schema_editor.execute(
+            f"CREATE VIEW {quote(view)} AS SELECT {columns} FROM {quote(model._meta.db_table)} "
+            f"UNION ALL SELECT {columns} FROM {quote(archive._meta.db_table)}"
+        )
+
+
+def drop_version_views(apps, schema_editor):
+    for _, view in VERSION_VIEWS:
+        schema_editor.execute(f"DROP VIEW {schema_editor.quote_name(view)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0017_drop_validity_range_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemVersion',
+            fields=[
+                ('validity_from', core.fields.DateTimeField(db_column='ValidityFrom', default=datetime.datetime.now)),
+                ('validity_to', core.fields.DateTimeField(blank=True, db_column='ValidityTo', null=True)),
+                ('legacy_id', models.IntegerField(blank=True, db_column='LegacyID', null=True)),
+                ('id', models.IntegerField(db_column='ItemID', primary_key=True, serialize=False)),
+                ('uuid', models.CharField(db_column='ItemUUID', default=uuid.uuid4, max_length=36,
+                                          unique=True)),
+                ('code', models.CharField(db_column='ItemCode', max_length=6)),
+                ('name', models.CharField(db_column='ItemName', max_length=100)),
+                ('type', models.CharField(db_column='ItemType', max_length=1)),
+                ('package', models.CharField(blank=True, db_column='ItemPackage', max_length=255, null=True)),
+                ('price', models.DecimalField(db_column='ItemPrice', decimal_places=2, max_digits=18)),
+                ('quantity', models.DecimalField(blank=True, db_column='Quantity', decimal_places=2, max_digits=18,
+                                                 null=True)),
+                ('maximum_amount', models.DecimalField(blank=True, db_column='MaximumAmount', decimal_places=2,
+                                                       max_digits=18, null=True)),
+                ('care_type', models.CharField(db_column='ItemCareType', max_length=1)),
+                ('frequency', models.SmallIntegerField(blank=True, db_column='ItemFrequency', null=True)),
+                ('patient_category', models.SmallIntegerField(db_column='ItemPatCat')),
+                ('audit_user_id', models.IntegerField(db_column='AuditUserID')),
+            ],
+            options={
+                'db_table': 'tblItems_versions',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ServiceVersion',
+            fields=[
+                ('validity_from', core.fields.DateTimeField(db_column='ValidityFrom', default=datetime.datetime.now)),
+                ('validity_to', core.fields.DateTimeField(blank=True, db_column='ValidityTo', null=True)),
+                ('legacy_id', models.IntegerField(blank=True, db_column='LegacyID', null=True)),
+                ('id', models.IntegerField(db_column='ServiceID', primary_key=True, serialize=False)),
+                ('uuid', models.CharField(db_column='ServiceUUID', default=uuid.uuid4, max_length=36,
+                                          unique=True)),
+                ('category', models.CharField(blank=True, db_column='ServCategory', max_length=1, null=True)),
+                ('code', models.CharField(db_column='ServCode', max_length=6)),
+                ('name', models.CharField(db_column='ServName', max_length=100)),
+                ('type', models.CharField(db_column='ServType', max_length=1)),
+                ('packagetype', models.CharField(choices=[('P', 'P'), ('S', 'S'), ('F', 'F')],
+                                                 db_column='ServPackageType', default='S', max_length=1)),
+                ('manualPrice', models.BooleanField(default=False)),
+                ('level', models.CharField(db_column='ServLevel', max_length=1)),
+                ('price', models.DecimalField(db_column='ServPrice', decimal_places=2, max_digits=18)),
+                ('maximum_amount', models.DecimalField(blank=True, db_column='MaximumAmount', decimal_places=2,
+                                                       max_digits=18, null=True)),
+                ('care_type', models.CharField(db_column='ServCareType', max_length=1)),
+                ('frequency', models.SmallIntegerField(blank=True, db_column='ServFrequency', null=True)),
+                ('patient_category', models.SmallIntegerField(db_column='ServPatCat', default=15)),
+                ('audit_user_id', models.IntegerField(blank=True, db_column='AuditUserID', null=True)),
+            ],
+            options={
+                'db_table': 'tblServices_versions',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_version_views, drop_version_views),
+    ]
@@ -1,17 +1,23 @@
 import string
 import uuid
+from datetime import datetime as py_datetime
 
 from core.models import VersionedModel, ObjectMutation
-from django.db import models
+from django.db import models, DEFAULT_DB_ALIAS
 from django.utils import timezone as django_tz 
 from core import models as core_models
-from django.db.models.signals import pre_save
+from core import fields
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
 from django.dispatch import receiver
 from graphql import ResolveInfo
 from django.conf import settings
 import core
 from medical.apps import MedicalConfig
+from medical.cache import catalog_cache_for
+from medical.history import is_new_version
+from medical.search import invalidate_diagnosis_search_index
 from medical.services import set_item_or_service_deleted
+from medical.versions import bump_catalog_version_of, create_catalog_versions
 
 
 class Diagnosis(core_models.VersionedModel):
@@ -46,6 +52,67 @@ class Diagnosis(core_models.VersionedModel):
     class Meta:
         managed = True
         db_table = 'tblICDCodes'
+        indexes = [
+            models.Index(fields=['code'], condition=models.Q(validity_to__isnull=True),
+                         name='tblICDCodes_current_code'),
+            models.Index(fields=['legacy_id', 'validity_from'], name='tblICDCodes_history'),
+        ]
+
+
+@receiver(post_save, sender=Diagnosis)
+def update_diagnosis_search_index(sender, instance, **kwargs):
+    invalidate_diagnosis_search_index()
+
+
+class LoadedStateTracker:
+    """
+    Keeps the field values of an instance as they were loaded from the database, so that the version
+    stored in the database is known at save time without re-reading the row.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        loaded = getattr(self, "_loaded_values", None)
+        if fields is None or loaded is None:
+            self.reset_loaded_state()
+        else:
+            for field_name in fields:
+                attname = self._meta.get_field(field_name).attname
+                loaded[attname] = getattr(self, attname)
+
+    def reset_loaded_state(self):
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def loaded_instance(self):
+        """
+        :return: an unsaved copy of the row as it was loaded, None if the instance was not (fully) loaded
+        """
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None or len(loaded) != len(self._meta.concrete_fields) or loaded.get("id") != self.pk:
+            return None
+        old_instance = self.__class__(**loaded)
+        old_instance._state.adding = False
+        old_instance._state.db = self._state.db
+        return old_instance
+
+
+def loaded_or_stored_instance(sender, instance):
+    """
+    :return: the version of instance currently in the database, from its loaded state if available
+    """
+    old_instance = instance.loaded_instance()
+    if old_instance is not None:
+        return old_instance
+    try:
+        return sender.objects.get(pk=instance.pk)
+    except sender.DoesNotExist:
+        return None
 
 
 class ItemOrService:
@@ -55,8 +122,25 @@ class ItemOrService:
 
     CARE_TYPE_VALUES = [CARE_TYPE_BOTH, CARE_TYPE_IN_PATIENT, CARE_TYPE_OUT_PATIENT]
 
+    @classmethod
+    def as_of(cls, date):
+        """
+        :return: queryset of the versions valid on the date, see medical.temporal.as_of()
+        """
+        from medical.temporal import as_of
+        return as_of(cls, date)
 
-class Item(VersionedModel, ItemOrService):
+    @classmethod
+    def codes_as_of(cls, requests):
+        """
+        :param requests: iterable of (code, date) tuples
+        :return: {(code, date): version valid on that date or None}, see medical.temporal.codes_as_of()
+        """
+        from medical.temporal import codes_as_of
+        return codes_as_of(cls, requests)
+
+
+class Item(LoadedStateTracker, VersionedModel, ItemOrService):
     id = models.AutoField(db_column='ItemID', primary_key=True)
     uuid = models.CharField(db_column='ItemUUID', max_length=36, default=uuid.uuid4, unique=True)
     code = models.CharField(db_column='ItemCode', max_length=6)
@@ -110,13 +194,14 @@ class Item(VersionedModel, ItemOrService):
         return queryset
 
     @classmethod
-    def get_queryset(cls, queryset, user, show_history=False):
+    def get_queryset(cls, queryset, user, show_history=False, include_archive=False):
         # GraphQL calls with an info object while Rest calls with the user itself
         if isinstance(user, ResolveInfo):
             user = user.context.user
         # OMT-281 only allow history if the user has full permission
         if show_history and user.has_perms(MedicalConfig.gql_query_medical_items_perms):
-            queryset = Item.objects.all()
+            # with the versions moved out by the archive_medical_history command
+            queryset = ItemVersion.objects.all() if include_archive else Item.objects.all()
         else:
             queryset = Item.filter_queryset(queryset)
         if settings.ROW_SECURITY and user.is_anonymous:
@@ -135,6 +220,19 @@ class Item(VersionedModel, ItemOrService):
     class Meta:
         managed = True
         db_table = 'tblItems'
+        indexes = [
+            # most lookups only consider the current version of a row
+            models.Index(fields=['code'], condition=models.Q(validity_to__isnull=True),
+                         name='tblItems_current_code'),
+            models.Index(fields=['legacy_id', 'validity_from'], name='tblItems_history'),
+            # point in time lookups of codes (as_of)
+            models.Index(fields=['code', 'validity_from'], name='tblItems_code_validity'),
+            # delta sync (medical.delta): updated current rows and deleted rows since a time
+            models.Index(fields=['validity_from'], condition=models.Q(validity_to__isnull=True),
+                         name='tblItems_changed'),
+            models.Index(fields=['validity_to'], condition=models.Q(legacy_id__isnull=True),
+                         name='tblItems_removed'),
+        ]
 
     TYPE_DRUG = "D"
     TYPE_MEDICAL_CONSUMABLE = "M"
@@ -143,13 +241,14 @@ class Item(VersionedModel, ItemOrService):
 
 @receiver(pre_save, sender=Item)
 def save_history_on_update(sender, instance, **kwargs):
-    try:
-        old_instance = sender.objects.get(pk=instance.pk)
-    except sender.DoesNotExist:
+    if instance.pk is None:
         # The object is being created for the first time, so no history save is needed
         return
-    # Compare the old and new instances to see if any fields have changed
-    if instance != old_instance:
+    old_instance = loaded_or_stored_instance(sender, instance)
+    if old_instance is None:
+        return
+    # Compare the old and new instances to see if any versioned field has changed
+    if is_new_version(sender, old_instance, instance):
         # One or more fields have changed, so save history
         old_instance.save_history()
         from core import datetime
@@ -161,7 +260,7 @@ class PackageTypes(models.TextChoices):
     S = "S", "S"
     F = "F", "F"
 
-class Service(VersionedModel, ItemOrService):
+class Service(LoadedStateTracker, VersionedModel, ItemOrService):
 
     DEFAULT_PATIENT_CATEGORY = 15
 
@@ -233,14 +332,15 @@ class Service(VersionedModel, ItemOrService):
         return queryset
 
     @classmethod
-    def get_queryset(cls, queryset, user, show_history=False):
+    def get_queryset(cls, queryset, user, show_history=False, include_archive=False):
         # GraphQL calls with an info object while Rest calls with the user itself
         if isinstance(user, ResolveInfo):
             user = user.context.user
 
         # OMT-281 only allow history if the user has full permission
         if show_history and user.has_perms(MedicalConfig.gql_query_medical_services_perms):
-            queryset = Service.objects.all()
+            # with the versions moved out by the archive_medical_history command
+            queryset = ServiceVersion.objects.all() if include_archive else Service.objects.all()
         else:
             queryset = Service.filter_queryset(queryset)
         if settings.ROW_SECURITY and user.is_anonymous:
@@ -251,6 +351,19 @@ class Service(VersionedModel, ItemOrService):
     class Meta:
         managed = True
         db_table = 'tblServices'
+        indexes = [
+            # most lookups only consider the current version of a row
+            models.Index(fields=['code'], condition=models.Q(validity_to__isnull=True),
+                         name='tblServices_current_code'),
+            models.Index(fields=['legacy_id', 'validity_from'], name='tblServices_history'),
+            # point in time lookups of codes (as_of)
+            models.Index(fields=['code', 'validity_from'], name='tblServices_code_validity'),
+            # delta sync (medical.delta): updated current rows and deleted rows since a time
+            models.Index(fields=['validity_from'], condition=models.Q(validity_to__isnull=True),
+                         name='tblServices_changed'),
+            models.Index(fields=['validity_to'], condition=models.Q(legacy_id__isnull=True),
+                         name='tblServices_removed'),
+        ]
 
     TYPE_PREVENTATIVE = "P"
     TYPE_CURATIVE = "C"
@@ -275,13 +388,14 @@ class Service(VersionedModel, ItemOrService):
 
 @receiver(pre_save, sender=Service)
 def save_history_on_update(sender, instance, **kwargs):
-    try:
-        old_instance = sender.objects.get(pk=instance.pk)
-    except sender.DoesNotExist:
+    if instance.pk is None:
         # The object is being created for the first time, so no history save is needed
         return
-    # Compare the old and new instances to see if any fields have changed
-    if instance != old_instance:
+    old_instance = loaded_or_stored_instance(sender, instance)
+    if old_instance is None:
+        return
+    # Compare the old and new instances to see if any versioned field has changed
+    if is_new_version(sender, old_instance, instance):
         # One or more fields have changed, so save history
         old_instance.save_history()
         from core import datetime
@@ -289,6 +403,26 @@ def save_history_on_update(sender, instance, **kwargs):
         instance.validity_from = now
 
 
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Service)
+def update_catalog_cache(sender, instance, using=None, **kwargs):
+    # post_save rather than pre_save: created rows only get their pk once saved
+    catalog_cache_for(sender).refresh_on_commit(instance, using)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Service)
+def reset_loaded_state(sender, instance, **kwargs):
+    # the saved values are now the ones in the database
+    instance.reset_loaded_state()
+
+
+# connected by MedicalConfig.ready() when medical_pricelist is installed
+def update_pricelist_membership(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # the pricelist membership indexes of all the processes reload once the change is committed
+    bump_catalog_version_of(sender, using)
+
+
 class ServiceService(models.Model):
     """class representing relation between package and services """
     id = models.AutoField(primary_key=True, db_column='idSCP')
@@ -345,3 +479,148 @@ class ServiceMutation(core_models.UUIDModel, core_models.ObjectMutation):
     class Meta:
         managed = True
         db_table = "medical_ServiceMutation"
+
+
+class CatalogVersion(models.Model):
+    """
+    Version of each catalog entity (see medical.versions), incremented with every change so that the clients can
+    fetch the lists only when they changed.
+    """
+    entity = models.CharField(db_column="Entity", primary_key=True, max_length=20)
+    version = models.BigIntegerField(db_column="Version", default=0)
+
+    class Meta:
+        managed = True
+        db_table = "medical_CatalogVersion"
+
+
+class ItemColumns(models.Model):
+    """
+    Columns of tblItems, in the same order, for the archive of the closed versions and the view of all the versions
+    (see medical.archive). The ids are kept (no auto increment) so that the archived rows still point to their
+    current row by legacy_id.
+    """
+    validity_from = fields.DateTimeField(db_column='ValidityFrom', default=py_datetime.now)
+    validity_to = fields.DateTimeField(db_column='ValidityTo', blank=True, null=True)
+    legacy_id = models.IntegerField(db_column='LegacyID', blank=True, null=True)
+    id = models.IntegerField(db_column='ItemID', primary_key=True)
+    uuid = models.CharField(db_column='ItemUUID', max_length=36, default=uuid.uuid4, unique=True)
+    code = models.CharField(db_column='ItemCode', max_length=6)
+    name = models.CharField(db_column='ItemName', max_length=100)
+    type = models.CharField(db_column='ItemType', max_length=1)
+    package = models.CharField(db_column='ItemPackage', max_length=255, blank=True, null=True)
+    price = models.DecimalField(db_column='ItemPrice', max_digits=18, decimal_places=2)
+    quantity = models.DecimalField(db_column='Quantity', max_digits=18, decimal_places=2, blank=True, null=True)
+    maximum_amount = models.DecimalField(db_column='MaximumAmount', max_digits=18, decimal_places=2, blank=True,
+                                         null=True)
+    care_type = models.CharField(db_column='ItemCareType', max_length=1)
+    frequency = models.SmallIntegerField(db_column='ItemFrequency', blank=True, null=True)
+    patient_category = models.SmallIntegerField(db_column='ItemPatCat')
+    audit_user_id = models.IntegerField(db_column='AuditUserID')
+
+    class Meta:
+        abstract = True
+
+
+class ItemArchive(ItemColumns):
+    """
+    Closed versions of Item moved out of tblItems by medical.archive.archive_history()
+    """
+
+    class Meta:
+        managed = True
+        db_table = 'tblItems_archive'
+        indexes = [
+            models.Index(fields=['legacy_id', 'validity_from'], name='tblItems_archive_history'),
+        ]
+
+
+class ItemVersion(ItemColumns):
+    """
+    All the versions of Item, current table and archive, through the tblItems_versions view (UNION ALL of both
+    tables, see migration 0018). Read only, the rows are loaded as Item instances.
+    """
+
+    class Meta:
+        managed = False
+        db_table = 'tblItems_versions'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        return Item.from_db(db, field_names, values)
+
+
+class ServiceColumns(models.Model):
+    """
+    Columns of tblServices, like ItemColumns
+    """
+    validity_from = fields.DateTimeField(db_column='ValidityFrom', default=py_datetime.now)
+    validity_to = fields.DateTimeField(db_column='ValidityTo', blank=True, null=True)
+    legacy_id = models.IntegerField(db_column='LegacyID', blank=True, null=True)
+    id = models.IntegerField(db_column='ServiceID', primary_key=True)
+    uuid = models.CharField(db_column='ServiceUUID', max_length=36, default=uuid.uuid4, unique=True)
+    category = models.CharField(db_column='ServCategory', max_length=1, blank=True, null=True)
+    code = models.CharField(db_column='ServCode', max_length=6)
+    name = models.CharField(db_column='ServName', max_length=100)
+    type = models.CharField(db_column='ServType', max_length=1)
+    packagetype = models.CharField(db_column='ServPackageType', choices=PackageTypes.choices, max_length=1,
+                                   default=PackageTypes.S)
+    manualPrice = models.BooleanField(default=False)
+    level = models.CharField(db_column='ServLevel', max_length=1)
+    price = models.DecimalField(db_column='ServPrice', max_digits=18, decimal_places=2)
+    maximum_amount = models.DecimalField(db_column='MaximumAmount', max_digits=18, decimal_places=2, blank=True,
+                                         null=True)
+    care_type = models.CharField(db_column='ServCareType', max_length=1)
+    frequency = models.SmallIntegerField(db_column='ServFrequency', blank=True, null=True)
+    patient_category = models.SmallIntegerField(db_column='ServPatCat', default=Service.DEFAULT_PATIENT_CATEGORY)
+    audit_user_id = models.IntegerField(db_column='AuditUserID', blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+
+class ServiceArchive(ServiceColumns):
+    """
+    Closed versions of Service moved out of tblServices by medical.archive.archive_history()
+    """
+
+    class Meta:
+        managed = True
+        db_table = 'tblServices_archive'
+        indexes = [
+            models.Index(fields=['legacy_id', 'validity_from'], name='tblServices_archive_history'),
+        ]
+
+
+class ServiceVersion(ServiceColumns):
+    """
+    All the versions of Service through the tblServices_versions view, like ItemVersion
+    """
+
+    class Meta:
+        managed = False
+        db_table = 'tblServices_versions'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        return Service.from_db(db, field_names, values)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Diagnosis)
+@receiver(post_save, sender=ServiceItem)
+@receiver(post_save, sender=ServiceService)
+@receiver(post_delete, sender=ServiceItem)
+@receiver(post_delete, sender=ServiceService)
+def update_catalog_version(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # the history copies come with the change of the current row, and the bulk writes, that send no signal, bump
+    # the version themselves. Bumped once per transaction, on commit
+    if getattr(instance, "legacy_id", None) is None:
+        bump_catalog_version_of(sender, using)
+
+
+@receiver(post_migrate)
+def init_catalog_versions(sender, using="default", **kwargs):
+    if sender.name == MedicalConfig.name:
+        create_catalog_versions(using)
@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+
+from medical.apps import MedicalConfig
+from medical.exceptions import PackageCycleError
+
+logger = logging.getLogger(__name__)
+
+KIND_ITEM = "item"
+KIND_SERVICE = "service"
+
+# one leaf of an expanded package: qty_provided is the cumulated quantity (product of the quantities along the
+# path, summed over the paths), amount the sum of qty * price_asked of the leaf links and price_asked the resulting
+# unit price. amount and price_asked are None as soon as one of the paths has no price_asked. The price_asked of the
+# links to sub-packages is not used, the sub-packages being replaced by their content.
+PackageLine = namedtuple("PackageLine", ["kind", "id", "qty_provided", "price_asked", "amount"])
+
+_ONE = Decimal(1)
+
+
+def _quantity(qty_provided):
+    # a package link without quantity provides one unit
+    return _ONE if qty_provided is None else Decimal(qty_provided)
+
+
+class PackageGraph:
+    """
+    In-process graph of the package relations (ServiceItem and ServiceService), with the expansion of each
+    package into its leaf items and services memoized.
+    The edges are loaded in two queries on first use and reloaded after MedicalConfig.catalog_cache_ttl seconds,
+    like the catalog caches. refresh_package() reloads the edges of one package and forgets the expansions of that
+    package and of the packages containing it; the writes of this process call it once they are committed (see
+    refresh_package_on_commit()). The cycle checks of the writes don't use the graph but the database (see
+    check_children()).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._children = None
+        self._parents = None
+        self._expansions = {}
+        self._loaded_at = None
+        self.loads = 0
+
+    def _is_stale(self):
+        if self._children is None or not MedicalConfig.catalog_cache_enabled:
+            return True
+        ttl = MedicalConfig.catalog_cache_ttl
+        return ttl is not None and time.monotonic() - self._loaded_at > ttl
+
+    @staticmethod
+    def _load_edges(parent_ids=None):
+        from medical.models import ServiceItem, ServiceService
+        edges = defaultdict(list)
+        for model, kind, child_field in ((ServiceItem, KIND_ITEM, "item_id"),
+                                         (ServiceService, KIND_SERVICE, "service_id")):
+            rows = model.objects.filter(status=True)
+            if parent_ids is not None:
+                rows = rows.filter(parent_id__in=parent_ids)
+            for parent_id, child_id, qty_provided, price_asked in rows \
+                    .order_by("id") \
+                    .values_list("parent_id", child_field, "qty_provided", "price_asked") \
+                    .iterator(chunk_size=2000):
+                edges[parent_id].append((kind, child_id, _quantity(qty_provided), price_asked))
+        return edges
+
+    def _load(self):
+        children = self._load_edges()
+        parents = defaultdict(set)
+        for parent_id, edges in children.items():
+            for kind, child_id, _, _ in edges:
+                if kind == KIND_SERVICE:
+                    parents[child_id].add(parent_id)
+        self._children, self._parents = children, parents
+        self._expansions = {}
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.debug("medical package graph loaded with %s packages", len(children))
+
+    def _ensure_loaded(self):
+        if self._is_stale():
+            self._load()
+
+    def _ancestors(self, service_id):
+        seen = {service_id}
+        pending = [service_id]
+        while pending:
+            for parent_id in self._parents.get(pending.pop(), ()):
+                if parent_id not in seen:
+                    seen.add(parent_id)
+                    pending.append(parent_id)
+        return seen
+
+    def _expand(self, service_id, path):
+        expansion = self._expansions.get(service_id)
+        if expansion is not None:
+            return expansion
+        if service_id in path:
+            cycle = path[path.index(service_id):] + [service_id]
+            raise PackageCycleError(cycle)
+        path.append(service_id)
+        expansion = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        for kind, child_id, qty, price_asked in self._children.get(service_id, ()):
+            if kind == KIND_SERVICE and child_id in self._children:
+                sub_lines = self._expand(child_id, path).items()
+            else:
+                sub_lines = [((kind, child_id), (_ONE, price_asked))]
+            for key, (sub_qty, sub_amount) in sub_lines:
+                line = expansion[key]
+                line[0] += qty * sub_qty
+                line[1] = None if line[1] is None or sub_amount is None else line[1] + qty * sub_amount
+        path.pop()
+        self._expansions[service_id] = expansion = dict(expansion)
+        return expansion
+
+    def expand(self, service_id, qty_provided=1):
+        """
+        Flattens a package into its leaf items and services (services that are not packages themselves).
+        :param service_id: id of the package (Service)
+        :param qty_provided: number of packages, the quantities and amounts are multiplied by it
+        :return: list of PackageLine, items first then services, by id. Empty if the service is not a package.
+        :raises PackageCycleError: if the package contains itself
+        """
+        with self._lock:
+            self._ensure_loaded()
+            expansion = self._expand(service_id, [])
+        factor = _quantity(qty_provided)
+        lines = []
+        for (kind, child_id), (qty, amount) in sorted(expansion.items(), key=lambda entry: entry[0]):
+            qty, amount = qty * factor, (amount * factor if amount is not None else None)
+            lines.append(PackageLine(kind, child_id, qty, amount / qty if amount is not None and qty else None,
+                                     amount))
+        return lines
+
+    def children(self, service_id):
+        """
+        :return: the links of a package as (kind, child id, qty_provided, price_asked) tuples
+        """
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._children.get(service_id, ()))
+
+    def refresh_package(self, service_id):
+        """
+        Reloads the children of one package (two queries) and forgets the memoized expansions depending on it.
+        Nothing is done while the graph is not loaded.
+        """
+        with self._lock:
+            if self._children is None:
+                return
+            for kind, child_id, _, _ in self._children.pop(service_id, ()):
+                if kind == KIND_SERVICE:
+                    self._parents[child_id].discard(service_id)
+            edges = self._load_edges([service_id]).get(service_id)
+            if edges:
+                self._children[service_id] = edges
+                for kind, child_id, _, _ in edges:
+                    if kind == KIND_SERVICE:
+                        self._parents[child_id].add(service_id)
+            for ancestor_id in self._ancestors(service_id):
+                self._expansions.pop(ancestor_id, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._children = self._parents = None
+            self._expansions = {}
+            self._loaded_at = None
+
+
+package_graph = PackageGraph()
+
+
+def expand_package(service_id, qty_provided=1):
+    """
+    Flattened bill of materials of a package, see PackageGraph.expand()
+    """
+    return package_graph.expand(service_id, qty_provided)
+
+
+def package_ancestors(service_id):
+    """
+    The service and the packages containing it, directly or not, read from the database (one query per level) so
+    that the links written by other processes or earlier in the current transaction are taken into account.
+    """
+    from medical.models import ServiceService
+    ancestors = {service_id}
+    pending = [service_id]
+    while pending:
+        parent_ids = set(ServiceService.objects
+                         .filter(status=True, service_id__in=pending)
+                         .values_list("parent_id", flat=True))
+        pending = list(parent_ids - ancestors)
+        ancestors.update(pending)
+    return ancestors
+
+
+def check_children(service_id, child_service_ids):
+    """
+    :raises PackageCycleError: if making the services children of the package would make it contain itself
+    """
+    if not child_service_ids:
+        return
+    ancestors = package_ancestors(service_id)
+    for child_id in child_service_ids:
+        # the child already contains the package (or is the package)
+        if child_id in ancestors:
+            raise PackageCycleError([service_id, child_id, service_id])
+
+
+def refresh_package_on_commit(service_id, using=None):
+    """
+    PackageGraph.refresh_package() once the current transaction commits: the in-process graph never holds the
+    links of a rolled back change.
+    """
+    transaction.on_commit(lambda: package_graph.refresh_package(service_id), using=using)
@@ -0,0 +1,206 @@
+import base64
+import datetime
+import decimal
+import json
+import uuid
+
+from core.data_masking.masking_decorator import anonymize_gql
+from core.schema import OrderedDjangoFilterConnectionField
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q, QuerySet
+from django.db.models.constants import LOOKUP_SEP
+from graphene.relay import PageInfo
+from graphene_django.settings import graphene_settings
+from graphql.language import ast
+from promise import Promise
+
+KEYSET_CURSOR_PREFIX = "keyset:"
+
+
+def _json_value(value):
+    # full precision: the seek compares for equality on the previous keys
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} can't be used in a keyset cursor")
+
+
+def encode_cursor(values):
+    return base64.b64encode(
+        (KEYSET_CURSOR_PREFIX + json.dumps(values, default=_json_value)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    :return: the key values of a cursor made by encode_cursor(), None if it isn't one (e.g. an offset cursor)
+    """
+    try:
+        decoded = base64.b64decode(cursor).decode("utf-8")
+    except (ValueError, TypeError):
+        return None
+    if not decoded.startswith(KEYSET_CURSOR_PREFIX):
+        return None
+    try:
+        return json.loads(decoded[len(KEYSET_CURSOR_PREFIX):])
+    except ValueError:
+        return None
+
+
+def _is_nullable(model, path):
+    nullable = False
+    for name in path.split(LOOKUP_SEP):
+        field = model._meta.get_field(name)
+        nullable = nullable or field.null
+        model = field.related_model
+        if model is None:
+            break
+    return nullable
+
+
+def keyset_ordering(queryset):
+    """
+    :return: the ordering of the queryset as (field path, descending, nullable) tuples ending with the primary key,
+             None if it can't be used for keyset pagination (random order, expressions, unknown fields)
+    """
+    order_by = queryset.query.order_by or (queryset.query.get_meta().ordering if queryset.query.default_ordering
+                                           else ())
+    ordering = []
+    for order in order_by:
+        if not isinstance(order, str) or order == "?":
+            return None
+        descending = order.startswith("-")
+        path = order.lstrip("-+")
+        if path == "pk":
+            path = queryset.model._meta.pk.name
+        try:
+            nullable = _is_nullable(queryset.model, path)
+        except FieldDoesNotExist:
+            return None
+        ordering.append((path, descending, nullable))
+        if path == queryset.model._meta.pk.name:
+            return ordering
+    return ordering + [(queryset.model._meta.pk.name, False, False)]
+
+
+def _after(path, descending, nullable, value):
+    # NULLs come last in ascending order and first in descending order, see keyset_page()
+    if value is None:
+        return Q(**{f"{path}__isnull": False}) if descending else None
+    after = Q(**{f"{path}__lt" if descending else f"{path}__gt": value})
+    return after | Q(**{f"{path}__isnull": True}) if nullable and not descending else after
+
+
+def _seek(ordering, values):
+    seek = Q(pk__in=[])
+    for position, (path, descending, nullable) in enumerate(ordering):
+        after = _after(path, descending, nullable, values[position])
+        if after is not None:
+            for previous, (previous_path, _, _) in enumerate(ordering[:position]):
+                previous_value = values[previous]
+                after &= Q(**{f"{previous_path}__isnull": True}) if previous_value is None \
+                    else Q(**{previous_path: previous_value})
+            seek |= after
+    path, descending, nullable = ordering[0]
+    if not nullable:
+        # redundant bound on the first key, so that the database seeks with an index on it
+        seek &= Q(**{f"{path}__lte" if descending else f"{path}__gte": values[0]})
+    return seek
+
+
+def keyset_page(queryset, first, after=None, ordering=None):
+    """
+    Page of a queryset following the row of the cursor after: instead of skipping the previous rows with an
+    OFFSET, the query seeks to the rows whose (order keys, id) come after the ones encoded in the cursor, so that
+    the cost of a page does not depend on its depth.
+    :param ordering: see keyset_ordering(), computed from the queryset if None
+    :return: (rows, cursors of the rows, whether there are more rows)
+    :raises ValueError: if the ordering can't be used or the cursor is not a keyset cursor for that ordering
+    """
+    ordering = ordering or keyset_ordering(queryset)
+    if ordering is None:
+        raise ValueError("the ordering of the query can't be used for keyset pagination")
+    queryset = queryset \
+        .annotate(**{f"keyset_{position}": F(path) for position, (path, _, _) in enumerate(ordering)}) \
+        .order_by(*[
+            F(path).desc(nulls_first=True) if descending and nullable else F(path).desc() if descending
+            else F(path).asc(nulls_last=True) if nullable else F(path).asc()
+            for path, descending, nullable in ordering
+        ])
+    if after is not None:
+        values = decode_cursor(after)
+        if values is None or len(values) != len(ordering):
+            raise ValueError("invalid keyset cursor: %s" % after)
+        queryset = queryset.filter(_seek(ordering, values))
+    rows = list(queryset[:first + 1])
+    cursors = [encode_cursor([getattr(row, f"keyset_{position}") for position in range(len(ordering))])
+               for row in rows[:first]]
+    return rows[:first], cursors, len(rows) > first
+
+
+def selects_field(info, field_name):
+    """
+    :return: whether the resolved field selects field_name on its result, True when it can't be told (fragments)
+    """
+    for field_ast in info.field_asts:
+        for selection in field_ast.selection_set.selections if field_ast.selection_set else ():
+            if not isinstance(selection, ast.Field) or selection.name.value == field_name:
+                return True
+    return False
+
+
+class KeysetConnectionField(OrderedDjangoFilterConnectionField):
+    """
+    OrderedDjangoFilterConnectionField with an opt-in keyset pagination mode: when the field is queried with
+    keyset: true, the cursors encode the (orderBy keys, id) of the rows and the next page is fetched with
+    keyset_page(). Only forward paging (first/after) is supported in that mode; a random order falls back to
+    offset pagination. The keyset connection only counts the rows when totalCount is queried.
+    """
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver, max_limit,
+                            enforce_first_or_last, root, info, **args):
+        result = super().connection_resolver(resolver, connection, default_manager, queryset_resolver, max_limit,
+                                             enforce_first_or_last, root, info, **args)
+        if not args.get("keyset") or not selects_field(info, "totalCount"):
+            return result
+
+        def count(resolved):
+            if getattr(resolved, "length", None) is None:
+                resolved.length = resolved.iterable.count()
+            return resolved
+
+        if Promise.is_thenable(result):
+            return Promise.resolve(result).then(count)
+        return count(result)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None, user=None):
+        if not args.get("keyset") or not isinstance(iterable, QuerySet):
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit, user=user)
+        ordering = keyset_ordering(iterable)
+        if ordering is None:
+            return super().resolve_connection(connection, args, iterable, max_limit=max_limit, user=user)
+        if args.get("last") is not None or args.get("before") is not None or args.get("offset") is not None:
+            raise ValueError("keyset pagination only pages forward, with first and after")
+        return cls.resolve_keyset_connection(connection, args, iterable, ordering, max_limit=max_limit, user=user)
+
+    @classmethod
+    @anonymize_gql()
+    def resolve_keyset_connection(cls, connection, args, iterable, ordering, max_limit=None, user=None):
+        max_limit = max_limit or graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        first = min(args.get("first") or max_limit, max_limit)
+        rows, cursors, has_next = keyset_page(iterable, first, args.get("after"), ordering)
+        result = connection(
+            edges=[connection.Edge(node=row, cursor=cursor) for row, cursor in zip(rows, cursors)],
+            page_info=PageInfo(
+                start_cursor=cursors[0] if cursors else None,
+                end_cursor=cursors[-1] if cursors else None,
+                has_previous_page=args.get("after") is not None,
+                has_next_page=has_next,
+            ),
+        )
+        result.iterable = iterable
+        # counted by connection_resolver(), only if totalCount is queried
+        result.length = None
+        return result
@@ -0,0 +1,101 @@
+import threading
+
+from django.apps import apps
+from django.db import connections
+
+from medical.apps import MedicalConfig
+from medical.versions import catalog_version, ENTITY_ITEM_PRICELIST, ENTITY_SERVICE_PRICELIST
+
+PRICELIST_APP = "medical_pricelist"
+
+
+class PricelistMembership:
+    """
+    In-process index of the Items (or Services) of the pricelists: per pricelist uuid, the ids having a current
+    pricelist detail. Pricelists are loaded on first use and kept while the catalog version of the pricelist details
+    is unchanged (one query per use): the saves and deletes of the details bump it once their transaction commits,
+    in any process, and so do the bulk deletes of medical.services. Writes of the details that send no signal
+    (queryset.update(), bulk_create()) have to bump it themselves (versions.bump_catalog_version()).
+    """
+
+    def __init__(self, detail_model_name, pricelist_field, member_field, entity):
+        self.detail_model_name = detail_model_name
+        self.pricelist_field = pricelist_field
+        self.member_field = member_field
+        self.entity = entity
+        self._lock = threading.RLock()
+        # pricelist uuid -> (pricelist id, frozenset of member ids, catalog version of the details)
+        self._entries = {}
+        self.loads = 0
+
+    @staticmethod
+    def is_enabled():
+        return MedicalConfig.catalog_cache_enabled and apps.is_installed(PRICELIST_APP)
+
+    @property
+    def detail_model(self):
+        return apps.get_model(PRICELIST_APP, self.detail_model_name)
+
+    def _load(self, pricelist_uuid, version):
+        detail_model = self.detail_model
+        pricelist_model = detail_model._meta.get_field(self.pricelist_field).related_model
+        pricelist_id = pricelist_model.objects.filter(uuid=pricelist_uuid).values_list("id", flat=True).first()
+        if pricelist_id is None:
+            return None, frozenset(), version
+        member_ids = frozenset(detail_model.objects
+                               .filter(**{f"{self.pricelist_field}_id": pricelist_id, "validity_to__isnull": True})
+                               .values_list(f"{self.member_field}_id", flat=True))
+        self.loads += 1
+        return pricelist_id, member_ids, version
+
+    def member_ids(self, pricelist_uuid):
+        """
+        :return: the ids of the members of the pricelist, None when the index is disabled
+        """
+        if not self.is_enabled():
+            return None
+        key = str(pricelist_uuid)
+        # version first: a change committed meanwhile makes the next use reload again
+        version = catalog_version(self.entity)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != version:
+                entry = self._entries[key] = self._load(key, version)
+            return entry[1]
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = {}
+
+
+item_pricelist_membership = PricelistMembership(
+    "ItemsPricelistDetail", "items_pricelist", "item", ENTITY_ITEM_PRICELIST)
+service_pricelist_membership = PricelistMembership(
+    "ServicesPricelistDetail", "services_pricelist", "service", ENTITY_SERVICE_PRICELIST)
+
+
+def pricelist_membership_for(model):
+    """
+    :param model: Item or Service (class or instance), or the model name, ItemVersion and ServiceVersion included
+    """
+    name = model if isinstance(model, str) else getattr(model, "_meta").object_name
+    return {"Item": item_pricelist_membership, "Service": service_pricelist_membership,
+            "ItemVersion": item_pricelist_membership, "ServiceVersion": service_pricelist_membership}[name]
+
+
+def filter_pricelist(queryset, pricelist_uuid):
+    """
+    Restricts an Item or Service queryset to the members of a pricelist: with an id IN (...) from the membership
+    index when it is enabled and the list fits in the parameters of the backend, with the join on the pricelist
+    details otherwise (a subquery for ItemVersion and ServiceVersion, which have no relation to the details).
+    """
+    membership = pricelist_membership_for(queryset.model)
+    member_ids = membership.member_ids(pricelist_uuid)
+    max_params = connections[queryset.db].features.max_query_params
+    if member_ids is not None and (max_params is None or len(member_ids) < max_params // 2):
+        return queryset.filter(id__in=sorted(member_ids))
+    details = {f"{membership.pricelist_field}__uuid": pricelist_uuid, "validity_to__isnull": True}
+    if queryset.model._meta.object_name.endswith("Version"):
+        return queryset.filter(id__in=membership.detail_model.objects.filter(**details)
+                               .values(f"{membership.member_field}_id"))
+    return queryset.filter(**{f"pricelist_details__{key}": value for key, value in details.items()})
@@ -0,0 +1,197 @@
+import logging
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+
+from medical.cache import item_catalog_cache, service_catalog_cache
+from medical.exceptions import PackageCycleError
+from medical.packages import package_graph, KIND_ITEM, KIND_SERVICE
+from medical.services import LOOKUP_CHUNK_SIZE, chunks, history_copy
+from medical.versions import bump_catalog_version, ENTITY_SERVICE
+
+logger = logging.getLogger(__name__)
+
+# package types whose price is derived from their content, unless manualPrice is set
+DERIVED_PACKAGE_TYPES = ("P", "F")
+DEFAULT_CHUNK_SIZE = 500
+
+_CENT = Decimal("0.01")
+
+
+def to_cents(price):
+    """
+    :return: a price as an integer number of cents (0 for None): prices are DecimalField(decimal_places=2), so the
+             int64 cents are exact
+    """
+    return 0 if price is None else int(Decimal(price) * 100)
+
+
+def _is_derived(packagetype, manual_price):
+    return packagetype in DERIVED_PACKAGE_TYPES and not manual_price
+
+
+class PackagePricing:
+    """
+    Columnar snapshot of the current services, items and package links, indexed by position: the services take
+    the positions 0..n_services-1 and the items the following ones.
+    """
+
+    def __init__(self):
+        from medical.models import Item, Service, ServiceItem, ServiceService
+        service_rows = list(Service.objects
+                            .filter(validity_to__isnull=True)
+                            .values_list("id", "price", "packagetype", "manualPrice")
+                            .iterator(chunk_size=2000))
+        item_rows = list(Item.objects
+                         .filter(validity_to__isnull=True)
+                         .values_list("id", "price")
+                         .iterator(chunk_size=2000))
+        self.service_ids = np.array([row[0] for row in service_rows], dtype=np.int64)
+        self.n_services = len(service_rows)
+        position = {(KIND_SERVICE, row[0]): index for index, row in enumerate(service_rows)}
+        position.update({(KIND_ITEM, row[0]): self.n_services + index for index, row in enumerate(item_rows)})
+        self.prices = np.array([to_cents(row[1]) for row in service_rows + item_rows], dtype=np.int64)
+        self.derived = np.array([_is_derived(row[2], row[3]) for row in service_rows], dtype=bool)
+
+        parents, children, quantities, asked, has_asked = [], [], [], [], []
+        skipped = 0
+        for model, kind, child_field in ((ServiceItem, KIND_ITEM, "item_id"),
+                                         (ServiceService, KIND_SERVICE, "service_id")):
+            for parent_id, child_id, qty_provided, price_asked in model.objects \
+                    .filter(status=True) \
+                    .values_list("parent_id", child_field, "qty_provided", "price_asked") \
+                    .iterator(chunk_size=2000):
+                parent = position.get((KIND_SERVICE, parent_id))
+                child = position.get((kind, child_id))
+                if parent is None or (child is None and price_asked is None):
+                    # link of a deleted package, or to a deleted item/service without price_asked
+                    skipped += 1
+                    continue
+                parents.append(parent)
+                children.append(0 if child is None else child)
+                quantities.append(1 if qty_provided is None else qty_provided)
+                asked.append(to_cents(price_asked))
+                has_asked.append(price_asked is not None)
+        if skipped:
+            logger.debug("package pricing: %s package links skipped", skipped)
+        self.parents = np.array(parents, dtype=np.int64)
+        self.children = np.array(children, dtype=np.int64)
+        self.quantities = np.array(quantities, dtype=np.int64)
+        self.asked = np.array(asked, dtype=np.int64)
+        self.has_asked = np.array(has_asked, dtype=bool)
+        # packages without any link keep their price
+        has_children = np.zeros(self.n_services, dtype=bool)
+        has_children[self.parents] = True
+        self.derived &= has_children
+
+    def compute(self):
+        """
+        Derived price of every package, nested packages included: each pass sums qty_provided * (price_asked or
+        the price of the child) per package over all the links at once. A package nested n levels deep gets its
+        final price after n passes, so the prices converge after at most (number of derived packages + 1) passes
+        unless the packages contain themselves.
+        :return: the prices in cents of the services, in the order of service_ids
+        :raises PackageCycleError: if the prices do not converge
+        """
+        prices = self.prices.copy()
+        for _ in range(int(self.derived.sum()) + 1):
+            unit_prices = np.where(self.has_asked, self.asked, prices[self.children])
+            totals = np.zeros(self.n_services, dtype=np.int64)
+            np.add.at(totals, self.parents, unit_prices * self.quantities)
+            new_prices = np.where(self.derived, totals, prices[:self.n_services])
+            if np.array_equal(new_prices, prices[:self.n_services]):
+                return new_prices
+            prices[:self.n_services] = new_prices
+        changing = self.service_ids[new_prices != self.prices[:self.n_services]]
+        raise PackageCycleError(changing.tolist())
+
+    def changes(self):
+        """
+        :return: {service id: new price} of the packages whose derived price differs from the stored one
+        """
+        prices = self.compute()
+        changed = np.nonzero(prices != self.prices[:self.n_services])[0]
+        return {int(self.service_ids[index]): (Decimal(int(prices[index])) / 100).quantize(_CENT)
+                for index in changed}
+
+
+def update_package_prices(audit_user_id=None, dry_run=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Recomputes the price of all the packages (packagetype P or F without manualPrice) from their content and
+    writes back the prices that changed, with a history copy of each updated service, chunk_size services per
+    transaction.
+    :param audit_user_id: audit user of the updated services, kept as is if None
+    :param dry_run: only compute the changes
+    :return: {service id: new price} of the updated services
+    """
+    from core.utils import TimeUtils
+    from medical.models import Service
+    changes = PackagePricing().changes()
+    if dry_run or not changes:
+        return changes
+    update_fields = ["price", "validity_from"] + (["audit_user_id"] if audit_user_id is not None else [])
+    for chunk in chunks(changes, chunk_size):
+        now = TimeUtils.now()
+        services = []
+        for lookup_chunk in chunks(chunk, LOOKUP_CHUNK_SIZE):
+            services += Service.objects.filter(id__in=lookup_chunk, validity_to__isnull=True)
+        histories = [history_copy(service, now) for service in services]
+        for service in services:
+            service.price = changes[service.id]
+            service.validity_from = now
+            if audit_user_id is not None:
+                service.audit_user_id = audit_user_id
+        with transaction.atomic():
+            Service.objects.bulk_create(histories, batch_size=chunk_size)
+            Service.objects.bulk_update(services, update_fields, batch_size=chunk_size)
+            bump_catalog_version(ENTITY_SERVICE)
+        for service in services:
+            service_catalog_cache.refresh_on_commit(service)
+    logger.info("package pricing: %s package prices updated", len(changes))
+    return changes
+
+
+def _list_price(kind, child_id, path):
+    if kind == KIND_SERVICE:
+        record = service_catalog_cache.get_by_id(child_id)
+        if record is not None and _is_derived(record.packagetype, record.manualPrice) \
+                and package_graph.children(child_id):
+            return _package_price(child_id, package_graph.children(child_id), path)
+    else:
+        record = item_catalog_cache.get_by_id(child_id)
+    return record.price if record is not None else Decimal(0)
+
+
+def _package_price(service_id, links, path):
+    if service_id is not None and service_id in path:
+        raise PackageCycleError(path[path.index(service_id):] + [service_id])
+    path.append(service_id)
+    total = Decimal(0)
+    for kind, child_id, qty, price_asked in links:
+        unit_price = price_asked if price_asked is not None else _list_price(kind, child_id, path)
+        total += qty * unit_price
+    path.pop()
+    return total.quantize(_CENT)
+
+
+def package_price(service_id=None, items=None, services=None):
+    """
+    Derived price of a single package, for the edit form: same computation as PackagePricing, on the package
+    graph and the catalog caches.
+    :param service_id: id of the package, None for a package that is not saved yet
+    :param items: links to items (dicts with item_id, qty_provided and price_asked) replacing the saved ones
+    :param services: links to services (dicts with service_id, qty_provided and price_asked) replacing the saved
+                     ones
+    :return: the price as a Decimal
+    """
+    saved = package_graph.children(service_id) if service_id is not None else []
+    links = []
+    for kind, edited in ((KIND_ITEM, items), (KIND_SERVICE, services)):
+        if edited is None:
+            links += [link for link in saved if link[0] == kind]
+        else:
+            links += [(kind, link[f"{kind}_id"],
+                       Decimal(1 if link.get("qty_provided") is None else link["qty_provided"]),
+                       link.get("price_asked")) for link in edited]
+    return _package_price(service_id, links, [])
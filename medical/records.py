@@ -0,0 +1,127 @@
+from operator import itemgetter
+
+
+class CatalogRecord(tuple):
+    """
+    Read-only value of a catalog row, built from a values_list() tuple without the model machinery (field
+    descriptors, signals, loaded state). The subclasses list their fields in FIELDS and get a read-only attribute
+    per field; like a namedtuple, a record has no __dict__ (empty __slots__) and is created from the row tuple in
+    one call.
+    """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for index, name in enumerate(cls.FIELDS):
+            setattr(cls, name, property(itemgetter(index), doc=f"{name} of the row"))
+
+    def __new__(cls, *values):
+        return tuple.__new__(cls, values)
+
+    @classmethod
+    def from_row(cls, row):
+        return tuple.__new__(cls, row)
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    # the subclasses compare like their model, not like tuples
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__,
+                           ", ".join(f"{name}={value!r}" for name, value in zip(self.FIELDS, self)))
+
+
+class ItemRecord(CatalogRecord):
+    FIELDS = ("id", "uuid", "code", "name", "type", "package", "price", "quantity", "care_type", "frequency",
+              "patient_category")
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.code is not None and len(self.code) >= 1
+
+    def __str__(self):
+        return self.code + " " + self.name
+
+    # same as Item
+    def __eq__(self, other):
+        if not isinstance(other, ItemRecord) or \
+                (self.code, self.name, self.type, self.price, self.care_type, self.patient_category, self.quantity,
+                 self.frequency) != \
+                (other.code, other.name, other.type, other.price, other.care_type, other.patient_category,
+                 other.quantity, other.frequency):
+            return False
+        # optional string field, None and empty string are the same
+        return bool(self.package) == bool(other.package) and (not self.package or self.package == other.package)
+
+    def __hash__(self):
+        return hash((self.code, self.id, self.name, self.type, self.price, self.care_type, self.patient_category))
+
+
+class ServiceRecord(CatalogRecord):
+    FIELDS = ("id", "uuid", "code", "name", "type", "level", "category", "packagetype", "manualPrice", "price",
+              "care_type", "frequency", "patient_category")
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.code is not None and len(self.code) >= 1
+
+    def __str__(self):
+        return self.code + " " + self.name
+
+    # same as Service
+    def __eq__(self, other):
+        if not isinstance(other, ServiceRecord) or \
+                (self.code, self.name, self.type, self.level, self.price, self.care_type, self.patient_category,
+                 self.frequency) != \
+                (other.code, other.name, other.type, other.level, other.price, other.care_type,
+                 other.patient_category, other.frequency):
+            return False
+        # optional string field, None and empty string are the same
+        return bool(self.category) == bool(other.category) and (not self.category or self.category == other.category)
+
+    def __hash__(self):
+        return hash((self.code, self.id, self.name, self.type, self.price, self.care_type, self.patient_category))
+
+
+class DiagnosisRecord(CatalogRecord):
+    FIELDS = ("id", "code", "name")
+    __slots__ = ()
+
+    def __str__(self):
+        return self.code + " " + self.name
+
+    # same as django.db.models.Model: the same row
+    def __eq__(self, other):
+        if not isinstance(other, DiagnosisRecord):
+            return NotImplemented
+        if self.id is None:
+            return self is other
+        return self.id == other.id
+
+    def __hash__(self):
+        if self.id is None:
+            raise TypeError("Model instances without primary key value are unhashable")
+        return hash(self.id)
+
+
+_RECORD_CLASSES = {"Item": ItemRecord, "Service": ServiceRecord, "Diagnosis": DiagnosisRecord}
+
+
+def record_class_for(model):
+    return _RECORD_CLASSES[model._meta.object_name]
+
+
+def as_records(queryset, chunk_size=2000):
+    """
+    Streams the rows of an Item, Service or Diagnosis queryset as read-only records, straight from values_list()
+    tuples: for the read paths (claim processing, adjudication, reviews) that only read the fields.
+    """
+    record_class = record_class_for(queryset.model)
+    from_row = record_class.from_row
+    for row in queryset.values_list(*record_class.FIELDS).iterator(chunk_size=chunk_size):
+        yield from_row(row)
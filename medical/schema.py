@@ -3,18 +3,28 @@ from core import ExtendedConnection
 from core import filter_validity
 from core.schema import OrderedDjangoFilterConnectionField
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q
 from django.utils.translation import gettext as _
 from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
 from medical.gql_mutations import CreateServiceMutation, UpdateServiceMutation, DeleteServiceMutation, \
-    CreateItemMutation, UpdateItemMutation, DeleteItemMutation
+    CreateItemMutation, UpdateItemMutation, DeleteItemMutation, BulkUpsertItemsMutation, BulkUpsertServicesMutation, \
+    ServiceItemInputType, ServiceServiceInputType
 from .gql_queries import *
+from .dataloaders import get_dataloader
 
 from .apps import MedicalConfig
 from .models import Diagnosis, Item, Service
 import graphene_django_optimizer as gql_optimizer
-from .services import check_unique_code_item, check_unique_code_service
+from .services import check_unique_code_item, check_unique_code_service, taken_codes
+from .pricing import package_price
+from .pricelists import filter_pricelist
+from .history import version_history
+from .pagination import KeysetConnectionField
+from .delta import changed_since
+from .versions import catalog_versions, is_not_modified, ENTITY_ITEM, ENTITY_SERVICE, ENTITY_DIAGNOSIS
+from .cache import service_catalog_cache, catalog_cache_stats
+from .search import search_queryset, item_search_index, service_search_index, \
+    diagnosis_search_index, autocomplete_queryset
 
 
 class DiagnosisGQLType(DjangoObjectType):
@@ -42,19 +52,87 @@ class ItemGQLType(DjangoObjectType):
         }
         connection_class = ExtendedConnection
 
+    def resolve_itemsServices(self, info):
+        return get_dataloader(info, "medical_service_items_by_item_loader").load(self.id)
+
+
+class TombstoneGQLType(graphene.ObjectType):
+    uuid = graphene.String()
+    code = graphene.String()
+    deleted_at = graphene.DateTime()
+
+
+class ItemsDeltaGQLType(graphene.ObjectType):
+    until = graphene.DateTime(description="Pass as since to get the next delta")
+    until_id = graphene.Int(description="Pass as afterId to get the next delta")
+    has_more = graphene.Boolean(description="The changed rows were cut at the page size")
+    changed = graphene.List(ItemGQLType)
+    removed = graphene.List(TombstoneGQLType)
+
+
+class ServicesDeltaGQLType(graphene.ObjectType):
+    until = graphene.DateTime(description="Pass as since to get the next delta")
+    until_id = graphene.Int(description="Pass as afterId to get the next delta")
+    has_more = graphene.Boolean(description="The changed rows were cut at the page size")
+    changed = graphene.List(ServiceGQLType)
+    removed = graphene.List(TombstoneGQLType)
+
+
+class FieldChangeGQLType(graphene.ObjectType):
+    field = graphene.String()
+    old = graphene.String()
+    new = graphene.String()
+
+    @staticmethod
+    def _value(value):
+        return None if value is None else str(value)
+
+    def resolve_old(self, info):
+        return FieldChangeGQLType._value(self.old)
+
+    def resolve_new(self, info):
+        return FieldChangeGQLType._value(self.new)
+
+
+class ItemVersionGQLType(graphene.ObjectType):
+    version = graphene.Field(ItemGQLType)
+    changes = graphene.List(FieldChangeGQLType, description="Changes from the previous version")
+
+    def resolve_version(self, info):
+        return self.instance
+
+
+class ServiceVersionGQLType(graphene.ObjectType):
+    version = graphene.Field(ServiceGQLType)
+    changes = graphene.List(FieldChangeGQLType, description="Changes from the previous version")
+
+    def resolve_version(self, info):
+        return self.instance
+
+
+def _delta_page_size(first):
+    page_size = MedicalConfig.delta_sync_page_size
+    return min(first, page_size) if first else page_size
+
 
 class Query(graphene.ObjectType):
-    diagnoses = DjangoFilterConnectionField(DiagnosisGQLType)
+    diagnoses = DjangoFilterConnectionField(
+        DiagnosisGQLType,
+        if_version_not=graphene.Int(),
+    )
     diagnoses_str = DjangoFilterConnectionField(
         DiagnosisGQLType,
         str=graphene.String()
     )
-    medical_items = OrderedDjangoFilterConnectionField(
+    medical_items = KeysetConnectionField(
         ItemGQLType,
         client_mutation_id=graphene.String(),
         show_history=graphene.Boolean(),
+        include_archive=graphene.Boolean(description="With showHistory, also the archived versions"),
         orderBy=graphene.List(of_type=graphene.String),
         pricelist_uuid=graphene.UUID(),
+        keyset=graphene.Boolean(description="Cursors encode the orderBy keys of the rows (forward paging only)"),
+        if_version_not=graphene.Int(description="Empty result if the catalog version is still this one"),
     )
     medical_items_str = OrderedDjangoFilterConnectionField(
         ItemGQLType,
@@ -64,12 +142,15 @@ class Query(graphene.ObjectType):
         pricelist_uuid=graphene.UUID(),
     )
 
-    medical_services = OrderedDjangoFilterConnectionField(
+    medical_services = KeysetConnectionField(
         ServiceGQLType,
         client_mutation_id=graphene.String(),
         show_history=graphene.Boolean(),
+        include_archive=graphene.Boolean(description="With showHistory, also the archived versions"),
         orderBy=graphene.List(of_type=graphene.String),
         pricelist_uuid=graphene.UUID(),
+        keyset=graphene.Boolean(description="Cursors encode the orderBy keys of the rows (forward paging only)"),
+        if_version_not=graphene.Int(description="Empty result if the catalog version is still this one"),
     )
     medical_services_str = OrderedDjangoFilterConnectionField(
         ServiceGQLType,
@@ -78,6 +159,32 @@ class Query(graphene.ObjectType):
         orderBy=graphene.List(of_type=graphene.String),
         pricelist_uuid=graphene.UUID(),
     )
+    medical_items_changed_since = graphene.Field(
+        ItemsDeltaGQLType,
+        since=graphene.DateTime(required=True),
+        after_id=graphene.Int(),
+        first=graphene.Int(description="Maximum number of changed rows, at most delta_sync_page_size"),
+        description="Items created, updated or deleted since a time (delta sync)."
+    )
+    medical_services_changed_since = graphene.Field(
+        ServicesDeltaGQLType,
+        since=graphene.DateTime(required=True),
+        after_id=graphene.Int(),
+        first=graphene.Int(description="Maximum number of changed rows, at most delta_sync_page_size"),
+        description="Services created, updated or deleted since a time (delta sync)."
+    )
+    medical_item_history = graphene.List(
+        ItemVersionGQLType,
+        uuid=graphene.String(required=True),
+        include_archive=graphene.Boolean(),
+        description="Versions of an item, oldest first, with the changes from one version to the next."
+    )
+    medical_service_history = graphene.List(
+        ServiceVersionGQLType,
+        uuid=graphene.String(required=True),
+        include_archive=graphene.Boolean(),
+        description="Versions of a service, oldest first, with the changes from one version to the next."
+    )
     validate_item_code = graphene.Field(
         graphene.Boolean,
         item_code=graphene.String(required=True),
@@ -88,17 +195,48 @@ class Query(graphene.ObjectType):
         service_code=graphene.String(required=True),
         description="Checks that the specified service code is unique."
     )
+    validate_item_codes = graphene.List(
+        graphene.String,
+        item_codes=graphene.List(graphene.String, required=True),
+        description="Returns the specified item codes that are already used."
+    )
+    validate_service_codes = graphene.List(
+        graphene.String,
+        service_codes=graphene.List(graphene.String, required=True),
+        description="Returns the specified service codes that are already used."
+    )
+    medical_catalog_cache_stats = graphene.Field(
+        graphene.JSONString,
+        description="Hit/miss counters of the in-process Item and Service catalog caches."
+    )
+    medical_catalog_versions = graphene.Field(
+        graphene.JSONString,
+        description="Version of each catalog entity (item, service, diagnosis, package), incremented with each change."
+    )
+    medical_package_price = graphene.Field(
+        graphene.Decimal,
+        uuid=graphene.String(),
+        items=graphene.List(ServiceItemInputType),
+        services=graphene.List(ServiceServiceInputType),
+        description="Price of a package computed from its content, the items/services given replace the saved ones."
+    )
+
+    def resolve_diagnoses(self, info, if_version_not=None, **kwargs):
+        if is_not_modified(ENTITY_DIAGNOSIS, if_version_not):
+            return Diagnosis.objects.none()
+        return None
 
     def resolve_diagnoses_str(self, info, **kwargs):
         if not info.context.user.has_perms(MedicalConfig.gql_query_diagnosis_perms):
             raise PermissionDenied(_("unauthorized"))
         search_str = kwargs.get('str')
+        # filter_validity() and row security
+        queryset = Diagnosis.get_queryset(None, info)
         if search_str is not None:
-            return Diagnosis.objects \
-                .filter(*filter_validity()) \
-                .filter(Q(code__icontains=search_str) | Q(name__icontains=search_str))
+            # ranked matches of the in-memory autocomplete index, paged by the connection
+            return autocomplete_queryset(queryset, search_str, diagnosis_search_index)
         else:
-            return Diagnosis.objects.filter(*filter_validity())
+            return queryset
 
     def resolve_medical_items_str(self, info, pricelist_uuid=None, date=None, **kwargs):
         # OMT-281 allow listing of medical services even if the query right is not given
@@ -106,18 +244,19 @@ class Query(graphene.ObjectType):
         if info.context.user.is_anonymous:
             raise PermissionDenied(_("unauthorized"))
         search_str = kwargs.get("str")
-        q = Item.objects.filter(*filter_validity(date))
+        # the catalog as it was on the date (e.g. the visit date of a claim), the current one otherwise
+        q = Item.as_of(date) if date is not None else Item.objects.filter(*filter_validity())
         if pricelist_uuid is not None:
-            q = q.filter(pricelist_details__items_pricelist__uuid=pricelist_uuid,
-                         pricelist_details__validity_to__isnull=True)
+            q = filter_pricelist(q, pricelist_uuid)
         if search_str is not None:
-            q = q.filter(Q(code__icontains=search_str) | Q(name__icontains=search_str))
+            q = search_queryset(q, search_str, item_search_index if date is None else None)
         return q
 
     def resolve_medical_items(
         self,
         info,
         show_history=False,
+        include_archive=False,
         pricelist_uuid=None,
         client_mutation_id=None,
         **kwargs
@@ -127,13 +266,13 @@ class Query(graphene.ObjectType):
         # if not info.context.user.has_perms(MedicalConfig.gql_query_medical_items_perms):
         if info.context.user.is_anonymous:
             raise PermissionDenied(_("unauthorized"))
+        if is_not_modified(ENTITY_ITEM, kwargs.get("if_version_not")):
+            return Item.objects.none()
         queryset = Item.get_queryset(
-            None, user=info.context.user, show_history=show_history
+            None, user=info.context.user, show_history=show_history, include_archive=include_archive
         )
         if pricelist_uuid is not None:
-            queryset = queryset.filter(
-                pricelist_details__items_pricelist__uuid=pricelist_uuid
-            )
+            queryset = filter_pricelist(queryset, pricelist_uuid)
         if client_mutation_id:
             queryset = queryset.filter(
                 mutations__mutation__client_mutation_id=client_mutation_id
@@ -150,18 +289,19 @@ class Query(graphene.ObjectType):
         if info.context.user.is_anonymous:
             raise PermissionDenied(_("unauthorized"))
         search_str = kwargs.get("str")
-        q = Service.objects.filter(*filter_validity(date))
+        # the catalog as it was on the date (e.g. the visit date of a claim), the current one otherwise
+        q = Service.as_of(date) if date is not None else Service.objects.filter(*filter_validity())
         if pricelist_uuid is not None:
-            q = q.filter(pricelist_details__services_pricelist__uuid=pricelist_uuid,
-                         pricelist_details__validity_to__isnull=True)
+            q = filter_pricelist(q, pricelist_uuid)
         if search_str is not None:
-            q = q.filter(Q(code__icontains=search_str) | Q(name__icontains=search_str))
+            q = search_queryset(q, search_str, service_search_index if date is None else None)
         return q
 
     def resolve_medical_services(
         self,
         info,
         show_history=False,
+        include_archive=False,
         pricelist_uuid=None,
         client_mutation_id=None,
         **kwargs
@@ -170,13 +310,13 @@ class Query(graphene.ObjectType):
         # if not info.context.user.has_perms(MedicalConfig.gql_query_medical_services_perms):
         if info.context.user.is_anonymous:
             raise PermissionDenied(_("unauthorized"))
+        if is_not_modified(ENTITY_SERVICE, kwargs.get("if_version_not")):
+            return Service.objects.none()
         queryset = Service.get_queryset(
-            None, user=info.context.user, show_history=show_history
+            None, user=info.context.user, show_history=show_history, include_archive=include_archive
         )
         if pricelist_uuid is not None:
-            queryset = queryset.filter(
-                pricelist_details__services_pricelist__uuid=pricelist_uuid
-            )
+            queryset = filter_pricelist(queryset, pricelist_uuid)
         if client_mutation_id:
             queryset = queryset.filter(
                 mutations__mutation__client_mutation_id=client_mutation_id
@@ -185,6 +325,30 @@ class Query(graphene.ObjectType):
             queryset = queryset.filter(*filter_validity(**kwargs))
         return gql_optimizer.query(queryset, info)
 
+    def resolve_medical_items_changed_since(self, info, since, after_id=None, first=None, **kwargs):
+        # OMT-281 allow listing of medical items even if the query right is not given
+        if info.context.user.is_anonymous:
+            raise PermissionDenied(_("unauthorized"))
+        return changed_since(Item, since, after_id, page_size=_delta_page_size(first))
+
+    def resolve_medical_services_changed_since(self, info, since, after_id=None, first=None, **kwargs):
+        # OMT-281 allow listing of medical services even if the query right is not given
+        if info.context.user.is_anonymous:
+            raise PermissionDenied(_("unauthorized"))
+        return changed_since(Service, since, after_id, page_size=_delta_page_size(first))
+
+    def resolve_medical_item_history(self, info, uuid, include_archive=False, **kwargs):
+        if info.context.user.is_anonymous:
+            raise PermissionDenied(_("unauthorized"))
+        # OMT-281 the previous versions are only returned with the full query right, see Item.get_queryset
+        return version_history(Item, uuid, info.context.user, include_archive=include_archive)
+
+    def resolve_medical_service_history(self, info, uuid, include_archive=False, **kwargs):
+        if info.context.user.is_anonymous:
+            raise PermissionDenied(_("unauthorized"))
+        # OMT-281 the previous versions are only returned with the full query right, see Service.get_queryset
+        return version_history(Service, uuid, info.context.user, include_archive=include_archive)
+
     def resolve_validate_service_code(self, info, **kwargs):
         if not info.context.user.has_perms(MedicalConfig.gql_query_medical_services_perms):
             raise PermissionDenied(_("unauthorized"))
@@ -197,6 +361,41 @@ class Query(graphene.ObjectType):
         errors = check_unique_code_item(code=kwargs['item_code'])
         return False if errors else True
 
+    def resolve_validate_service_codes(self, info, service_codes, **kwargs):
+        if not info.context.user.has_perms(MedicalConfig.gql_query_medical_services_perms):
+            raise PermissionDenied(_("unauthorized"))
+        taken = taken_codes(Service, service_codes)
+        return [code for code in service_codes if code in taken]
+
+    def resolve_validate_item_codes(self, info, item_codes, **kwargs):
+        if not info.context.user.has_perms(MedicalConfig.gql_query_medical_items_perms):
+            raise PermissionDenied(_("unauthorized"))
+        taken = taken_codes(Item, item_codes)
+        return [code for code in item_codes if code in taken]
+
+    def resolve_medical_catalog_versions(self, info, **kwargs):
+        if info.context.user.is_anonymous:
+            raise PermissionDenied(_("unauthorized"))
+        return catalog_versions()
+
+    def resolve_medical_catalog_cache_stats(self, info, **kwargs):
+        if not info.context.user.has_perms(MedicalConfig.gql_query_medical_items_perms):
+            raise PermissionDenied(_("unauthorized"))
+        return catalog_cache_stats()
+
+    def resolve_medical_package_price(self, info, uuid=None, items=None, services=None, **kwargs):
+        if not info.context.user.has_perms(MedicalConfig.gql_query_medical_services_perms):
+            raise PermissionDenied(_("unauthorized"))
+        service_id = None
+        if uuid is not None:
+            record = service_catalog_cache.get_by_uuid(uuid)
+            # the cache of this process may not know a service written by another one yet
+            service_id = record.id if record is not None else \
+                Service.objects.filter(*filter_validity(), uuid=uuid).values_list("id", flat=True).first()
+            if service_id is None:
+                raise ValueError(_("service.validation.id_does_not_exist") % {'id': uuid})
+        return package_price(service_id, items, services)
+
 
 class Mutation(graphene.ObjectType):
     create_service = CreateServiceMutation.Field()
@@ -205,3 +404,5 @@ class Mutation(graphene.ObjectType):
     create_item = CreateItemMutation.Field()
     update_item = UpdateItemMutation.Field()
     delete_item = DeleteItemMutation.Field()
+    bulk_upsert_items = BulkUpsertItemsMutation.Field()
+    bulk_upsert_services = BulkUpsertServicesMutation.Field()
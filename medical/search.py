@@ -0,0 +1,260 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from array import array
+
+from django.db import connections
+from django.db.models import Q, Case, When, Value, IntegerField
+
+from medical.apps import MedicalConfig
+from medical.versions import catalog_version, ENTITY_ITEM, ENTITY_SERVICE
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 3
+# id__in lists longer than this are not sent to the database (MS SQL Server caps a query at 2100 parameters),
+# the search falls back to the LIKE filter instead
+MAX_INDEXED_IDS = 1000
+
+RANK_EXACT_CODE = 0
+RANK_CODE_PREFIX = 1
+RANK_NAME_PREFIX = 2
+RANK_OTHER = 3
+
+_TOKEN = re.compile(r"\w+")
+# sorts after any character a search string can hold, closes the range of the keys starting with a prefix
+_PREFIX_END = "\U0010ffff"
+
+
+def _ngrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def rank_match(code, name, needle):
+    """
+    :param code: upper-cased code of a matching row
+    :param name: upper-cased name of that row
+    :param needle: upper-cased search string
+    :return: rank of the match, exact code first, then code prefix, then name word prefix (start of the name or
+             after a space, like search_queryset()), then any other code/name match
+    """
+    if code == needle:
+        return RANK_EXACT_CODE
+    if code.startswith(needle):
+        return RANK_CODE_PREFIX
+    if name.startswith(needle) or f" {needle}" in name:
+        return RANK_NAME_PREFIX
+    return RANK_OTHER
+
+
+class NgramIndex:
+    """
+    Case-insensitive substring index over the (id, code, name) of a catalog.
+    Each row is registered under the trigrams of its code and name; a search intersects the postings of
+    the search string trigrams and checks the remaining candidates.
+    """
+
+    def __init__(self, rows):
+        self.ids = array("q")
+        self.codes = []
+        self.names = []
+        postings = {}
+        for position, (row_id, code, name) in enumerate(rows):
+            code, name = (code or "").upper(), (name or "").upper()
+            self.ids.append(row_id)
+            self.codes.append(code)
+            self.names.append(name)
+            for gram in _ngrams(code) | _ngrams(name):
+                postings.setdefault(gram, []).append(position)
+        self.postings = {gram: array("l", positions) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, needle):
+        if len(needle) < NGRAM_SIZE:
+            return range(len(self.ids))
+        lists = []
+        for gram in _ngrams(needle):
+            positions = self.postings.get(gram)
+            if positions is None:
+                return ()
+            lists.append(positions)
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for positions in lists[1:]:
+            candidates.intersection_update(positions)
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, text, limit=None):
+        """
+        :param text: the searched string, matched as a substring of the code or the name
+        :param limit: maximum number of ids to return
+        :return: ids of the matching rows, best ranked first
+        """
+        needle = text.upper()
+        matches = [
+            (rank_match(self.codes[position], self.names[position], needle), self.codes[position], self.ids[position])
+            for position in self._candidates(needle)
+            if needle in self.codes[position] or needle in self.names[position]
+        ]
+        matches.sort()
+        if limit is not None:
+            matches = matches[:limit]
+        return [row_id for _, _, row_id in matches]
+
+
+class AutocompleteIndex(NgramIndex):
+    """
+    NgramIndex with sorted arrays of the codes and of the name words, so that the prefix matches are found by
+    binary search. They are ranked before the other substring matches: exact code, code prefix, name word prefix,
+    then any other match. Lower ranks are not looked up once the limit is reached.
+    """
+
+    def __init__(self, rows):
+        super().__init__(rows)
+        codes = sorted((code, position) for position, code in enumerate(self.codes))
+        self.code_keys = [code for code, _ in codes]
+        self.code_positions = array("l", [position for _, position in codes])
+        words = sorted({(word, position) for position, name in enumerate(self.names) for word in _TOKEN.findall(name)})
+        self.word_keys = [word for word, _ in words]
+        self.word_positions = array("l", [position for _, position in words])
+
+    @staticmethod
+    def _prefixed(keys, positions, needle):
+        start = bisect.bisect_left(keys, needle)
+        end = bisect.bisect_left(keys, needle + _PREFIX_END, start)
+        return positions[start:end]
+
+    def search(self, text, limit=None):
+        needle = text.upper().strip()
+        if not needle:
+            return []
+        ranks = {}
+        for position in self._prefixed(self.code_keys, self.code_positions, needle):
+            ranks[position] = RANK_EXACT_CODE if self.codes[position] == needle else RANK_CODE_PREFIX
+        if limit is None or len(ranks) < limit:
+            for position in self._prefixed(self.word_keys, self.word_positions, needle):
+                ranks.setdefault(position, RANK_NAME_PREFIX)
+        if limit is None or len(ranks) < limit:
+            for position in self._candidates(needle):
+                if position not in ranks and (needle in self.codes[position] or needle in self.names[position]):
+                    ranks[position] = RANK_OTHER
+        matches = sorted((rank, self.codes[position], self.ids[position]) for position, rank in ranks.items())
+        if limit is not None:
+            matches = matches[:limit]
+        return [row_id for _, _, row_id in matches]
+
+
+class SearchIndexHolder:
+    """
+    Lazily (re)builds an index (NgramIndex by default) whenever the version of its source changes.
+    """
+
+    def __init__(self, load_rows, source_version, index_class=NgramIndex):
+        self._load_rows = load_rows
+        self._source_version = source_version
+        self._index_class = index_class
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def get(self):
+        version = self._source_version()
+        with self._lock:
+            if self._index is None or self._version != version:
+                self._index = self._index_class(self._load_rows())
+                self._version = version
+                logger.debug("medical search index rebuilt with %s rows", len(self._index))
+            return self._index
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+def _ttl_bucket():
+    ttl = MedicalConfig.catalog_cache_ttl
+    return int(time.monotonic() // ttl) if ttl else 0
+
+
+def _current_rows(model):
+    from core import filter_validity
+    return list(model.objects.filter(*filter_validity()).values_list("id", "code", "name"))
+
+
+def _catalog_search_index(model_name, entity):
+    # built from the database rather than the per-process catalog cache, and rebuilt when the catalog version
+    # changes, so that the rows written by the other processes are found as well
+    def load_rows():
+        from django.apps import apps
+        return _current_rows(apps.get_model("medical", model_name))
+
+    return SearchIndexHolder(load_rows, lambda: catalog_version(entity))
+
+
+item_search_index = _catalog_search_index("Item", ENTITY_ITEM)
+service_search_index = _catalog_search_index("Service", ENTITY_SERVICE)
+
+_diagnosis_generation = 0
+
+
+def invalidate_diagnosis_search_index():
+    global _diagnosis_generation
+    _diagnosis_generation += 1
+
+
+def _load_diagnosis_rows():
+    from medical.models import Diagnosis
+    return _current_rows(Diagnosis)
+
+
+diagnosis_search_index = SearchIndexHolder(
+    _load_diagnosis_rows, lambda: (_diagnosis_generation, _ttl_bucket()), AutocompleteIndex)
+
+
+def search_queryset(queryset, search_str, index_holder=None):
+    """
+    Filters a Diagnosis, Item or Service queryset on the rows whose code or name contains search_str
+    and orders them by rank (exact code, code prefix, name word prefix, other match) then code.
+    On PostgreSQL the LIKE filter is served by the pg_trgm indexes, on other backends the in-memory index
+    of the current rows (if given) resolves the matching ids. All the matches are kept: the connection
+    pages the result and counts it.
+    """
+    rank = Case(
+        When(code__iexact=search_str, then=Value(RANK_EXACT_CODE)),
+        When(code__istartswith=search_str, then=Value(RANK_CODE_PREFIX)),
+        When(Q(name__istartswith=search_str) | Q(name__icontains=f" {search_str}"), then=Value(RANK_NAME_PREFIX)),
+        default=Value(RANK_OTHER),
+        output_field=IntegerField(),
+    )
+    ids = None
+    if index_holder is not None and connections[queryset.db].vendor != "postgresql":
+        ids = index_holder.get().search(search_str)
+        if len(ids) > MAX_INDEXED_IDS:
+            ids = None
+    if ids is None:
+        queryset = queryset.filter(Q(code__icontains=search_str) | Q(name__icontains=search_str))
+    else:
+        queryset = queryset.filter(id__in=ids)
+    return queryset.annotate(search_rank=rank).order_by("search_rank", "code")
+
+
+def autocomplete_queryset(queryset, search_str, index_holder):
+    """
+    All the matches of search_str, in the order of the in-memory autocomplete index, on every backend: the
+    connection pages and counts the result. The queryset still filters the returned ids, so that its validity and
+    row security conditions apply. Too many matches are left to search_queryset().
+    """
+    ids = index_holder.get().search(search_str)
+    if len(ids) > MAX_INDEXED_IDS:
+        return search_queryset(queryset, search_str)
+    if not ids:
+        return queryset.none()
+    rank = Case(*[When(id=row_id, then=Value(position)) for position, row_id in enumerate(ids)],
+                output_field=IntegerField())
+    return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by("search_rank")
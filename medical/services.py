@@ -1,5 +1,34 @@
+import uuid
+from copy import copy
 from gettext import gettext as _
 
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+
+# keeps the IN (...) lists below the 2100 parameters accepted by MS SQL Server
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def history_copy(instance, now):
+    """
+    Same copy as VersionedModel.save_history(), without the per-row insert: the returned instance is meant to be
+    written with bulk_create()
+    """
+    histo = copy(instance)
+    histo.id = None
+    if hasattr(histo, "uuid"):
+        histo.uuid = uuid.uuid4()
+    histo.validity_to = now
+    histo.legacy_id = instance.id
+    return histo
+
+
 def set_item_or_service_deleted(item_service, item_or_service_element):
     """
     Marks an Item or Service as deleted, cascading onto the pricelists
@@ -21,6 +50,85 @@ def set_item_or_service_deleted(item_service, item_or_service_element):
         }
 
 
+def delete_history_in_bulk(model, ids, now):
+    """
+    VersionedModel.delete_history() for a list of ids: the history copies are bulk inserted and the rows marked
+    as deleted with one UPDATE per chunk
+    """
+    histories = []
+    for chunk in chunks(ids, LOOKUP_CHUNK_SIZE):
+        histories += [history_copy(instance, now) for instance in model.objects.filter(id__in=chunk)]
+    model.objects.bulk_create(histories, batch_size=LOOKUP_CHUNK_SIZE)
+    for chunk in chunks(ids, LOOKUP_CHUNK_SIZE):
+        model.objects.filter(id__in=chunk).update(validity_from=now, validity_to=now)
+
+
+def _current_pricelist_detail_ids(model, ids):
+    try:
+        relation = model._meta.get_field("pricelist_details")
+    except FieldDoesNotExist:
+        # medical_pricelist is not installed
+        return None, []
+    detail_model = relation.related_model
+    detail_ids = []
+    for chunk in chunks(ids, LOOKUP_CHUNK_SIZE):
+        detail_ids += detail_model.objects \
+            .filter(**{f"{relation.field.name}_id__in": chunk}, validity_to__isnull=True) \
+            .values_list("id", flat=True)
+    return detail_model, detail_ids
+
+
+def set_items_or_services_deleted(model, uuids, item_or_service_element):
+    """
+    Set-based version of set_item_or_service_deleted() for a list of uuids: the history copies are inserted with
+    bulk_create() and the rows are marked as deleted with one UPDATE per chunk of LOOKUP_CHUNK_SIZE ids, for the
+    Items or Services as well as for their current pricelist details, in a single transaction.
+    Rows that are already deleted are left untouched.
+    :param model: Item or Service
+    :param uuids: the uuids of the objects to mark as deleted
+    :param item_or_service_element: either "item" or "service", used for translation keys
+    :return: an empty array is everything goes well, an array with one error per uuid otherwise
+    """
+    from core.utils import TimeUtils
+    from .cache import catalog_cache_for
+    from .versions import bump_catalog_version_of
+    uuids = list(uuids)
+    found, current_ids = set(), []
+    for chunk in chunks(uuids, LOOKUP_CHUNK_SIZE):
+        for row_uuid, row_id, validity_to in model.objects \
+                .filter(uuid__in=chunk) \
+                .values_list("uuid", "id", "validity_to"):
+            found.add(str(row_uuid).lower())
+            if validity_to is None:
+                current_ids.append(row_id)
+    errors = [{
+        'title': row_uuid,
+        'list': [{'message': _(
+            f"{item_or_service_element}.validation.id_does_not_exist") % {'id': row_uuid}}]
+    } for row_uuid in uuids if str(row_uuid).lower() not in found]
+    if not current_ids:
+        return errors
+    try:
+        now = TimeUtils.now()
+        with transaction.atomic():
+            delete_history_in_bulk(model, current_ids, now)
+            bump_catalog_version_of(model)
+            detail_model, detail_ids = _current_pricelist_detail_ids(model, current_ids)
+            if detail_ids:
+                delete_history_in_bulk(detail_model, detail_ids, now)
+                bump_catalog_version_of(detail_model)
+    except Exception as exc:
+        return errors + [{
+            'title': row_uuid,
+            'list': [{
+                'message': _(f"medical.mutation.failed_to_delete_{item_or_service_element}") % {'uuid': row_uuid},
+                'detail': str(exc)}]
+        } for row_uuid in uuids if str(row_uuid).lower() in found]
+    # queryset.update() does not send post_save, the caches have to be told
+    catalog_cache_for(model).discard(current_ids)
+    return errors
+
+
 def clear_item_dict(item):
     new_dict = {
         "code": item.code,
@@ -36,15 +144,38 @@ def clear_item_dict(item):
     return new_dict
 
 
+def taken_codes(model, codes):
+    """
+    :param model: Item or Service
+    :param codes: the codes to check
+    :return: the set of the codes used by a current row, in one query per LOOKUP_CHUNK_SIZE codes. When the
+             catalog cache is enabled, the codes missing from its version checked snapshot are free without a
+             query: only the codes it knows are confirmed in the database.
+    """
+    from .cache import catalog_cache_for
+    codes = set(codes)
+    cache = catalog_cache_for(model)
+    if cache.is_enabled():
+        codes = cache.known_codes(codes)
+    taken = set()
+    for chunk in chunks(codes, LOOKUP_CHUNK_SIZE):
+        taken.update(model.objects.filter(code__in=chunk, validity_to__isnull=True).values_list("code", flat=True))
+    return taken
+
+
+def _code_exists(model, code):
+    return code in taken_codes(model, [code])
+
+
 def check_unique_code_service(code):
     from .models import Service
-    if Service.objects.filter(code=code, validity_to__isnull=True).exists():
+    if _code_exists(Service, code):
         return [{"message": "Services code %s already exists" % code}]
     return []
 
 
 def check_unique_code_item(code):
     from .models import Item
-    if Item.objects.filter(code=code, validity_to__isnull=True).exists():
+    if _code_exists(Item, code):
         return [{"message": "Items code %s already exists" % code}]
     return []
@@ -0,0 +1,227 @@
+import json
+import os
+import struct
+import tempfile
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+
+from medical.packages import KIND_ITEM, KIND_SERVICE
+from medical.pricing import to_cents
+from medical.versions import catalog_versions
+
+MAGIC = b"OIMEDSNP"
+FORMAT_VERSION = 1
+# magic, format version, length of the JSON header
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 64
+# frequency and price_asked of the rows where they are NULL
+NO_VALUE = -1
+# readable by the other users (e.g. workers running as another user), mkstemp() creates the file as 0600
+SNAPSHOT_FILE_MODE = 0o644
+
+SnapshotRecord = namedtuple("SnapshotRecord", ["id", "code", "price", "care_type", "patient_category", "frequency"])
+SnapshotServiceRecord = namedtuple("SnapshotServiceRecord", SnapshotRecord._fields + ("packagetype",))
+SnapshotLink = namedtuple("SnapshotLink", ["kind", "child_id", "qty_provided", "price_asked"])
+
+_KINDS = (KIND_ITEM, KIND_SERVICE)
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+def _table_columns(model, extra_fields=()):
+    code_length = model._meta.get_field("code").max_length
+    rows = list(model.objects
+                .filter(validity_to__isnull=True)
+                .order_by("id")
+                .values_list("id", "code", "price", "care_type", "patient_category", "frequency", *extra_fields)
+                .iterator(chunk_size=2000))
+    codes = np.array([row[1] for row in rows], dtype=f"U{code_length}")
+    code_rows = np.argsort(codes, kind="stable").astype(np.int32)
+    columns = {
+        "id": np.array([row[0] for row in rows], dtype=np.int64),
+        "code": codes,
+        "code_sorted": codes[code_rows],
+        "code_rows": code_rows,
+        "price": np.array([to_cents(row[2]) for row in rows], dtype=np.int64),
+        "care_type": np.array([row[3] or "" for row in rows], dtype="U1"),
+        "patient_category": np.array([row[4] or 0 for row in rows], dtype=np.int16),
+        "frequency": np.array([NO_VALUE if row[5] is None else row[5] for row in rows], dtype=np.int32),
+    }
+    for index, field in enumerate(extra_fields, start=6):
+        length = model._meta.get_field(field).max_length or 1
+        columns[field] = np.array([row[index] or "" for row in rows], dtype=f"U{length}")
+    return columns
+
+
+def _link_columns():
+    from medical.models import ServiceItem, ServiceService
+    links = []
+    for model, kind, child_field in ((ServiceItem, KIND_ITEM, "item_id"),
+                                     (ServiceService, KIND_SERVICE, "service_id")):
+        links += [(parent_id, _KINDS.index(kind), child_id, qty_provided, price_asked)
+                  for parent_id, child_id, qty_provided, price_asked in model.objects
+                  .filter(status=True, parent__validity_to__isnull=True)
+                  .values_list("parent_id", child_field, "qty_provided", "price_asked")
+                  .iterator(chunk_size=2000)]
+    links.sort(key=lambda link: link[0])
+    return {
+        "parent": np.array([link[0] for link in links], dtype=np.int64),
+        "kind": np.array([link[1] for link in links], dtype=np.int8),
+        "child": np.array([link[2] for link in links], dtype=np.int64),
+        "qty_provided": np.array([1 if link[3] is None else link[3] for link in links], dtype=np.int64),
+        "price_asked": np.array([NO_VALUE if link[4] is None else to_cents(link[4]) for link in links],
+                                dtype=np.int64),
+    }
+
+
+def write_snapshot(path):
+    """
+    Writes the current Items, Services and package links to a snapshot file: a JSON header (versions, layout) and
+    the columns as raw little-endian arrays, each aligned on 64 bytes, so that CatalogSnapshot can map them
+    without copying. The tables are sorted by id and have a code -> row index (code_sorted/code_rows). The file
+    is written aside and renamed over path, so the workers that mapped the previous file keep reading it.
+    :return: the header of the snapshot
+    """
+    from core.utils import TimeUtils
+    from medical.models import Item, Service
+    # read first: the snapshot is at least as recent as its versions
+    versions = catalog_versions()
+    tables = {
+        "item": _table_columns(Item),
+        "service": _table_columns(Service, ("packagetype",)),
+        "link": _link_columns(),
+    }
+    arrays, layout, offset = [], {}, 0
+    for table, columns in tables.items():
+        for name, array in columns.items():
+            array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+            offset += -offset % _ALIGNMENT
+            layout[f"{table}.{name}"] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            arrays.append((offset, array))
+            offset += array.nbytes
+    header = {
+        "format_version": FORMAT_VERSION,
+        "created_at": TimeUtils.now().isoformat(),
+        "catalog_versions": versions,
+        "arrays": layout,
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _PREAMBLE.size + len(header_bytes)
+    data_start += -data_start % _ALIGNMENT
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".medical-snapshot-")
+    try:
+        with os.fdopen(descriptor, "wb") as snapshot_file:
+            snapshot_file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            snapshot_file.write(header_bytes)
+            for array_offset, array in arrays:
+                snapshot_file.seek(data_start + array_offset)
+                snapshot_file.write(array.tobytes())
+            # up to the end of the last (possibly empty) column
+            snapshot_file.truncate(data_start + offset)
+        os.chmod(temporary_path, SNAPSHOT_FILE_MODE)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return header
+
+
+class SnapshotTable:
+    """
+    Items or Services of a snapshot, looked up by id or code without creating model instances
+    """
+
+    def __init__(self, columns, record_class):
+        self._columns = columns
+        self._record_class = record_class
+        self.ids = columns["id"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _record(self, row):
+        columns = self._columns
+        frequency = int(columns["frequency"][row])
+        values = [int(self.ids[row]), str(columns["code"][row]), Decimal(int(columns["price"][row])).scaleb(-2),
+                  str(columns["care_type"][row]), int(columns["patient_category"][row]),
+                  None if frequency == NO_VALUE else frequency]
+        values += [str(columns[field][row]) for field in self._record_class._fields[len(values):]]
+        return self._record_class(*values)
+
+    def row_of_id(self, row_id):
+        row = int(np.searchsorted(self.ids, row_id))
+        return row if row < len(self.ids) and self.ids[row] == row_id else None
+
+    def row_of_code(self, code):
+        codes = self._columns["code_sorted"]
+        position = int(np.searchsorted(codes, code))
+        return int(self._columns["code_rows"][position]) if position < len(codes) and codes[position] == code \
+            else None
+
+    def by_id(self, row_id):
+        row = self.row_of_id(row_id)
+        return None if row is None else self._record(row)
+
+    def by_code(self, code):
+        row = self.row_of_code(code)
+        return None if row is None else self._record(row)
+
+    def column(self, name):
+        """
+        :return: the read-only array of a column, in the order of the ids
+        """
+        return self._columns[name]
+
+
+class CatalogSnapshot:
+    """
+    Read-only view of a snapshot file made by write_snapshot(). The file is memory mapped: the columns are numpy
+    views on the mapping, so the processes opening the same file share its pages through the page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mapping = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, format_version, header_length = _PREAMBLE.unpack(self._mapping[:_PREAMBLE.size].tobytes())
+        if magic != MAGIC:
+            raise SnapshotFormatError(f"{path} is not a medical catalog snapshot")
+        if format_version != FORMAT_VERSION:
+            raise SnapshotFormatError(f"unsupported snapshot format version {format_version}")
+        self.header = json.loads(self._mapping[_PREAMBLE.size:_PREAMBLE.size + header_length].tobytes())
+        data_start = _PREAMBLE.size + header_length
+        data_start += -data_start % _ALIGNMENT
+        tables = {}
+        for key, spec in self.header["arrays"].items():
+            table, name = key.split(".", 1)
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            start = data_start + spec["offset"]
+            tables.setdefault(table, {})[name] = np.frombuffer(
+                self._mapping, dtype=dtype, count=count, offset=start).reshape(spec["shape"]) if count \
+                else np.empty(spec["shape"], dtype=dtype)
+        self.items = SnapshotTable(tables["item"], SnapshotRecord)
+        self.services = SnapshotTable(tables["service"], SnapshotServiceRecord)
+        self._links = tables["link"]
+
+    @property
+    def catalog_versions(self):
+        return self.header["catalog_versions"]
+
+    def children(self, service_id):
+        """
+        :return: the SnapshotLink of the content of a package
+        """
+        links = self._links
+        start, end = np.searchsorted(links["parent"], service_id, side="left"), \
+            np.searchsorted(links["parent"], service_id, side="right")
+        return [SnapshotLink(
+            _KINDS[int(links["kind"][index])],
+            int(links["child"][index]),
+            int(links["qty_provided"][index]),
+            None if links["price_asked"][index] == NO_VALUE else Decimal(int(links["price_asked"][index])).scaleb(-2),
+        ) for index in range(start, end)]
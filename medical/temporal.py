@@ -0,0 +1,99 @@
+import bisect
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from medical.services import LOOKUP_CHUNK_SIZE, chunks
+
+
+def end_of_day(date):
+    """
+    Same reference time as core.filter_validity(): a version is valid on a date if it is valid at 23:59:59
+    """
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    when = datetime.datetime(date.year, date.month, date.day, 23, 59, 59)
+    # aware when the validity columns are, so that it compares with the loaded versions as well
+    return timezone.make_aware(when) if settings.USE_TZ else when
+
+
+def validity_q(when, prefix=""):
+    """
+    :return: the condition selecting the versions valid at a datetime
+    """
+    return Q(**{f"{prefix}validity_from__lte": when}) & (
+        Q(**{f"{prefix}validity_to__isnull": True}) | Q(**{f"{prefix}validity_to__gte": when}))
+
+
+def versions_queryset(model):
+    """
+    :return: all the versions of a VersionedModel, including the archived ones (see medical.archive)
+    """
+    from medical.archive import has_archive, versions_model_for
+    return versions_model_for(model).objects.all() if has_archive(model) else model.objects.all()
+
+
+def as_of(model, date):
+    """
+    The versions of the rows of a VersionedModel that were valid on a date (at 23:59:59, like filter_validity()),
+    archived versions included.
+    """
+    return versions_queryset(model).filter(validity_q(end_of_day(date)))
+
+
+class VersionIntervals:
+    """
+    In-memory interval index of the versions of some codes: per code, the versions sorted by validity_from, so that
+    the version valid at a time is found by bisection.
+    """
+
+    def __init__(self, versions):
+        by_code = defaultdict(list)
+        for version in versions:
+            by_code[version.code].append(version)
+        self._starts = {}
+        self._versions = {}
+        for code, code_versions in by_code.items():
+            code_versions.sort(key=lambda version: (version.validity_from, version.validity_to is None))
+            self._versions[code] = code_versions
+            self._starts[code] = [version.validity_from for version in code_versions]
+
+    def at(self, code, when):
+        """
+        :return: the version of the code valid at the datetime when, None if there is none
+        """
+        starts = self._starts.get(code)
+        if not starts:
+            return None
+        position = bisect.bisect_right(starts, when)
+        # several versions can start before when, the last one still valid at that time wins
+        for version in reversed(self._versions[code][:position]):
+            if version.validity_to is None or version.validity_to >= when:
+                return version
+        return None
+
+
+def codes_as_of(model, requests):
+    """
+    Resolves a batch of (code, date) to the version of the Item/Service with that code valid on that date, in one
+    query per LOOKUP_CHUNK_SIZE codes: all the versions of the codes overlapping the requested period (archived
+    ones included) are fetched and each request is answered from a VersionIntervals index.
+    :param model: Item or Service
+    :param requests: iterable of (code, date) tuples
+    :return: {(code, date): version or None}
+    """
+    requests = list(requests)
+    if not requests:
+        return {}
+    times = {date: end_of_day(date) for _, date in requests}
+    first, last = min(times.values()), max(times.values())
+    versions = []
+    for chunk in chunks({code for code, _ in requests}, LOOKUP_CHUNK_SIZE):
+        versions += versions_queryset(model) \
+            .filter(code__in=chunk, validity_from__lte=last) \
+            .filter(Q(validity_to__isnull=True) | Q(validity_to__gte=first))
+    intervals = VersionIntervals(versions)
+    return {(code, date): intervals.at(code, times[date]) for code, date in requests}
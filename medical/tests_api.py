@@ -1,14 +1,20 @@
 import base64
 import json
 from dataclasses import dataclass
+from decimal import Decimal
+from unittest import mock
 
 from core.models import User
 from core.models.openimis_graphql_test_case import openIMISGraphQLTestCase
 from core.test_helpers import create_test_interactive_user
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from graphene_django.utils.testing import GraphQLTestCase
 from graphql_jwt.shortcuts import get_token
-from medical.models import Item, ServiceItem, ServiceService
+from medical.bulk import bulk_upsert_items_or_services, ROW_CREATED, ROW_UPDATED
+from medical.models import Diagnosis, Item, ServiceItem, ServiceService
+from medical.search import item_search_index
 from medical.test_helpers import create_test_item, create_test_service
 from medical.utils import item_create_hook, service_create_hook
 from rest_framework import status
@@ -502,4 +508,250 @@ class MedicalGQLTestCase(openIMISGraphQLTestCase):
         service_serv = ServiceService.objects.filter(parent=self.test_service_update.id).first()
         self.assertEquals(service_serv.price_asked, 600)
         self.assertEquals(service_serv.qty_provided, 1)
-        self.assertEquals(service_serv.service.id, self.test_service.id)
\ No newline at end of file
+        self.assertEquals(service_serv.service.id, self.test_service.id)
+
+    def test_items_str_search_ranks_code_matches_first(self):
+        # the versions of the previous tests are rolled back, an index of theirs could have the same version
+        item_search_index.invalidate()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_test_item(item_type="M", custom_props={"name": "Contains TSTAP0 in the name", "code": "ZZAP01"})
+        response = self.query(
+            'query { medicalItemsStr(str: "tstap0", first: 5) { edges { node { code } } } }',
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        codes = [edge["node"]["code"] for edge in content["data"]["medicalItemsStr"]["edges"]]
+        self.assertEqual(codes, ["TSTAP0", "ZZAP01"])
+
+    def test_items_str_search_pages(self):
+        item_search_index.invalidate()
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(3):
+                create_test_item(item_type="M", custom_props={"code": f"PGS00{index}"})
+        response = self.query(
+            'query { medicalItemsStr(str: "pgs00", first: 2) { totalCount pageInfo { hasNextPage } '
+            'edges { node { code } } } }',
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)["data"]["medicalItemsStr"]
+        self.assertEqual(content["totalCount"], 3)
+        self.assertTrue(content["pageInfo"]["hasNextPage"])
+        self.assertEqual([edge["node"]["code"] for edge in content["edges"]], ["PGS000", "PGS001"])
+
+    def test_mutation_bulk_upsert_items(self):
+        item = create_test_item(item_type="M", custom_props={"name": "Bulk existing", "code": "BLK000"})
+        csv_file = "code,name,type,care_type,patient_category,price\\nBLK002,Bulk from file,D,O,15,12.50\\n"
+        reports = []
+
+        def upsert(*args, **kwargs):
+            reports.append(bulk_upsert_items_or_services(*args, **kwargs))
+            return reports[-1]
+
+        with mock.patch("medical.gql_mutations.bulk_upsert_items_or_services", upsert):
+            response = self.query(
+                '''
+                mutation {
+                  bulkUpsertItems(input: {
+                    clientMutationId: "testbulk1"
+                    items: [
+                      {code: "BLK000", name: "Bulk existing", type: "M", careType: "O", patientCategory: 15,
+                       price: "150"},
+                      {code: "BLK001", name: "Bulk new", type: "D", careType: "O", patientCategory: 15, price: "10"}
+                    ]
+                    file: "%s"
+                  }) {
+                    internalId
+                    clientMutationId
+                  }
+                }
+                ''' % csv_file,
+                headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+            )
+            self.assertResponseNoErrors(response)
+            self.get_mutation_result('testbulk1', self.admin_token)
+
+        self.assertEqual([[(entry["code"], entry["status"]) for entry in report] for report in reports],
+                         [[("BLK000", ROW_UPDATED), ("BLK001", ROW_CREATED), ("BLK002", ROW_CREATED)]])
+        item.refresh_from_db()
+        self.assertEqual((item.price, item.care_type), (150, "O"))
+        self.assertEqual(Item.objects.filter(legacy_id=item.id).count(), 1)
+        self.assertEqual(Item.objects.filter(code__startswith="BLK", legacy_id__isnull=False).count(), 1)
+        self.assertEqual(Item.objects.get(code="BLK001", validity_to__isnull=True).name, "Bulk new")
+        self.assertEqual(Item.objects.get(code="BLK002", validity_to__isnull=True).price, Decimal("12.50"))
+
+    def test_diagnoses_str_autocomplete(self):
+        Diagnosis.objects.create(code="Y01", name="Autocomplete test", audit_user_id=-1)
+        Diagnosis.objects.create(code="Y02", name="Test autocomplete", audit_user_id=-1)
+        response = self.query(
+            'query { diagnosesStr(str: "autoc", first: 5) { edges { node { code } } } }',
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        self.assertEqual([edge["node"]["code"] for edge in content["data"]["diagnosesStr"]["edges"]], ["Y01", "Y02"])
+
+    def test_diagnoses_str_pages(self):
+        for index in range(3):
+            Diagnosis.objects.create(code=f"Y1{index}", name="Paged autocomplete", audit_user_id=-1)
+        response = self.query(
+            'query { diagnosesStr(str: "Y1", first: 2) { totalCount pageInfo { hasNextPage } '
+            'edges { node { code } } } }',
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)["data"]["diagnosesStr"]
+        self.assertEqual(content["totalCount"], 3)
+        self.assertTrue(content["pageInfo"]["hasNextPage"])
+        self.assertEqual([edge["node"]["code"] for edge in content["edges"]], ["Y10", "Y11"])
+
+    def test_validate_item_codes(self):
+        response = self.query(
+            'query { validateItemCodes(itemCodes: ["TSTAP0", "FREE01", "SVCAP0", "TSTAP9"]) }',
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        self.assertEqual(content["data"]["validateItemCodes"], ["TSTAP0", "TSTAP9"])
+
+    def _count_package_page_queries(self, prefix):
+        query = '''
+            query {
+              medicalServices(code_Istartswith: "%s", first: 100) {
+                edges { node {
+                  code
+                  servicesLinked { qtyProvided item { code name price } }
+                  serviceserviceSet { service { code } }
+                  servicesServices { parent { code } }
+                } }
+              }
+            }
+            ''' % prefix
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query(query, headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"})
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)
+        return len(queries), content["data"]["medicalServices"]["edges"]
+
+    def test_package_children_are_batched(self):
+        for prefix, count in (("DLA", 100), ("DLB", 2)):
+            for index in range(count):
+                package = create_test_service(category="A", custom_props={"code": f"{prefix}{index:03d}"})
+                item = create_test_item(item_type="M", custom_props={"code": f"{prefix}I{index:02d}"[:6]})
+                ServiceItem.objects.create(parent=package, item=item, qty_provided=1, price_asked=10)
+                ServiceService.objects.create(parent=package, service=self.test_service, qty_provided=1)
+
+        # the first request also loads the rights of the user
+        self._count_package_page_queries("DLB")
+        large_count, large_page = self._count_package_page_queries("DLA")
+        small_count, _ = self._count_package_page_queries("DLB")
+
+        self.assertEqual(len(large_page), 100)
+        self.assertEqual(large_page[0]["node"]["servicesLinked"][0]["item"]["code"], "DLAI00")
+        self.assertEqual(large_page[0]["node"]["serviceserviceSet"][0]["service"]["code"], "SVCAP0")
+        self.assertEqual(large_count, small_count)
+
+    def test_items_keyset_pagination(self):
+        for index in range(5):
+            create_test_item(item_type="M", custom_props={"code": f"KSA00{index}"})
+        query = '''
+            query {
+              medicalItems(code_Istartswith: "KSA", orderBy: ["-code"], keyset: true, first: 2%s) {
+                totalCount
+                pageInfo { hasNextPage endCursor }
+                edges { node { code } }
+              }
+            }
+            '''
+        codes, after = [], ""
+        while True:
+            response = self.query(query % after,
+                                  headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"})
+            self.assertResponseNoErrors(response)
+            content = json.loads(response.content)["data"]["medicalItems"]
+            self.assertEqual(content["totalCount"], 5)
+            codes += [edge["node"]["code"] for edge in content["edges"]]
+            if not content["pageInfo"]["hasNextPage"]:
+                break
+            after = ', after: "%s"' % content["pageInfo"]["endCursor"]
+        self.assertEqual(codes, ["KSA004", "KSA003", "KSA002", "KSA001", "KSA000"])
+
+        # no COUNT query when totalCount is not queried
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query(
+                'query { medicalItems(code_Istartswith: "KSA", keyset: true, first: 2) { edges { node { code } } } }',
+                headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"})
+        self.assertResponseNoErrors(response)
+        self.assertFalse([query for query in queries.captured_queries if "COUNT(" in query["sql"].upper()])
+
+    def test_items_if_version_not(self):
+        headers = {"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"}
+        response = self.query('query { medicalCatalogVersions }', headers=headers)
+        self.assertResponseNoErrors(response)
+        version = json.loads(json.loads(response.content)["data"]["medicalCatalogVersions"])["item"]
+        query = 'query { medicalItems(code: "TSTAP0", ifVersionNot: %s) { edges { node { code } } } }'
+
+        response = self.query(query % version, headers=headers)
+        self.assertResponseNoErrors(response)
+        self.assertEqual(json.loads(response.content)["data"]["medicalItems"]["edges"], [])
+
+        response = self.query(query % (version - 1), headers=headers)
+        self.assertResponseNoErrors(response)
+        self.assertEqual(len(json.loads(response.content)["data"]["medicalItems"]["edges"]), 1)
+
+    def test_items_include_archive(self):
+        from medical.archive import archive_history
+        item = create_test_item(item_type="D", custom_props={"code": "ARCAPI", "name": "Archived"})
+        item.name = "Renamed"
+        item.save()
+        Item.objects.filter(legacy_id=item.id).update(validity_to="2015-01-01")
+        archive_history(Item, "2016-01-01")
+        headers = {"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"}
+        query = 'query { medicalItems(showHistory: true, code: "ARCAPI"%s) { edges { node { name } } } }'
+
+        response = self.query(query % "", headers=headers)
+        self.assertResponseNoErrors(response)
+        self.assertEqual(len(json.loads(response.content)["data"]["medicalItems"]["edges"]), 1)
+
+        response = self.query(query % ", includeArchive: true", headers=headers)
+        self.assertResponseNoErrors(response)
+        names = {edge["node"]["name"] for edge in json.loads(response.content)["data"]["medicalItems"]["edges"]}
+        self.assertEqual(names, {"Archived", "Renamed"})
+
+    def test_item_history(self):
+        item = create_test_item(item_type="D", custom_props={"code": "HSTAPI", "price": 100})
+        item.price = 120
+        item.save()
+        response = self.query(
+            'query { medicalItemHistory(uuid: "%s") { version { code price } changes { field old new } } }'
+            % item.uuid,
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"})
+        self.assertResponseNoErrors(response)
+        versions = json.loads(response.content)["data"]["medicalItemHistory"]
+        self.assertEqual([version["version"]["price"] for version in versions], ["100.00", "120.00"])
+        self.assertEqual(versions[1]["changes"], [{"field": "price", "old": "100.00", "new": "120.00"}])
+
+    def test_items_changed_since(self):
+        create_test_item(item_type="M", custom_props={"code": "DLTAPI", "validity_from": "2019-07-01"})
+        create_test_item(item_type="M", custom_props={"code": "DLTAP2", "validity_from": "2019-07-02"})
+        response = self.query(
+            '''
+            query {
+              medicalItemsChangedSince(since: "2019-06-15T00:00:00", first: 1) {
+                until
+                untilId
+                hasMore
+                changed { code }
+                removed { uuid code deletedAt }
+              }
+            }
+            ''',
+            headers={"HTTP_AUTHORIZATION": f"{self.AUTH_HEADER} {self.admin_token}"},
+        )
+        self.assertResponseNoErrors(response)
+        content = json.loads(response.content)["data"]["medicalItemsChangedSince"]
+        self.assertIsNotNone(content["until"])
+        self.assertEqual([item["code"] for item in content["changed"]], ["DLTAPI"])
+        self.assertTrue(content["hasMore"])
+        self.assertIsNotNone(content["untilId"])
@@ -0,0 +1,86 @@
+import datetime
+from io import StringIO
+
+from core.test_helpers import create_test_interactive_user
+from django.core.management import call_command
+from django.test import TestCase
+
+from medical.archive import archive_history
+from medical.eligibility import check_eligibility, VERDICT_ELIGIBLE, VERDICT_PATIENT_CATEGORY
+from medical.history import version_history
+from medical.models import Item, ItemArchive, ItemColumns, ItemVersion
+from medical.test_helpers import create_test_item
+from medical.versions import catalog_version, ENTITY_ITEM
+
+OLD = datetime.datetime(2015, 1, 1)
+
+
+class ArchiveHistoryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = create_test_item("D", custom_props={"code": "ARC001"})
+        for price in (110, 120, 130):
+            item = Item.objects.get(id=cls.item.id)
+            item.price = price
+            item.save()
+        cls.history_ids = list(Item.objects.filter(legacy_id=cls.item.id).order_by("id").values_list("id", flat=True))
+        # two old versions, the last one closed recently
+        Item.objects.filter(id__in=cls.history_ids[:2]).update(validity_to=OLD)
+
+    def test_archive_in_chunks(self):
+        before = datetime.datetime(2016, 1, 1)
+        self.assertEqual(archive_history(Item, before, dry_run=True).moved, 2)
+
+        result = archive_history(Item, before, chunk_size=1, max_chunks=1)
+        self.assertEqual(result.moved, 1)
+        # resumes with the remaining versions
+        self.assertEqual(archive_history(Item, before, chunk_size=1).moved, 1)
+        self.assertEqual(archive_history(Item, before).moved, 0)
+
+        self.assertEqual(list(ItemArchive.objects.order_by("id").values_list("id", "legacy_id", "validity_to")),
+                         [(history_id, self.item.id, OLD) for history_id in self.history_ids[:2]])
+        self.assertEqual(list(Item.objects.filter(code="ARC001").order_by("id").values_list("id", flat=True)),
+                         [self.item.id, self.history_ids[2]])
+
+    def test_versions_view(self):
+        # the view and the archive have the columns of the model, in the same order
+        self.assertEqual([field.column for field in ItemColumns._meta.get_fields()],
+                         [field.column for field in Item._meta.concrete_fields])
+        archive_history(Item, datetime.datetime(2016, 1, 1))
+        versions = ItemVersion.objects.filter(code="ARC001").order_by("-validity_from", "id")
+        self.assertEqual(versions.count(), 4)
+        self.assertEqual(sorted(version.id for version in versions), sorted([self.item.id] + self.history_ids))
+        self.assertTrue(all(isinstance(version, Item) for version in versions))
+        self.assertEqual(list(ItemVersion.objects.filter(code="ARC001", price=110).values_list("id", flat=True)),
+                         [self.history_ids[1]])
+        self.assertEqual(ItemVersion.objects.filter(legacy_id=self.item.id).count(), 3)
+        user = create_test_interactive_user(username="testMedicalArchive")
+        self.assertEqual(len(version_history(Item, self.item.uuid, user)), 2)
+        history = version_history(Item, self.item.uuid, user, include_archive=True)
+        self.assertEqual([version.instance.price for version in history][1:], [110, 120, 130])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("archive_medical_history", "--before", "2016-01-01", "--entity", "item", stdout=out)
+        self.assertIn("item: 2 versions archived", out.getvalue())
+        self.assertIn("reclaimed", out.getvalue())
+
+    def test_past_versions_readers(self):
+        item = create_test_item("D", custom_props={"code": "ARC002", "price": 50, "patient_category": 15,
+                                                   "care_type": "O", "validity_from": datetime.datetime(2010, 1, 1)})
+        item.save_history()
+        Item.objects.filter(legacy_id=item.id).update(validity_to=datetime.datetime(2012, 1, 1))
+        Item.objects.filter(id=item.id).update(price=60, patient_category=1,
+                                               validity_from=datetime.datetime(2012, 1, 1))
+        version = catalog_version(ENTITY_ITEM)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive_history(Item, datetime.datetime(2016, 1, 1)).moved, 3)
+        self.assertGreater(catalog_version(ENTITY_ITEM), version)
+
+        self.assertEqual(list(Item.as_of("2011-01-01").filter(code="ARC002").values_list("price", flat=True)), [50])
+        self.assertEqual(Item.codes_as_of([("ARC002", datetime.date(2011, 1, 1))])[
+                             ("ARC002", datetime.date(2011, 1, 1))].price, 50)
+        # the archived version allowed all the patient categories, the current one doesn't
+        self.assertEqual(check_eligibility(Item, [(item.id, 2, "O", datetime.date(2011, 1, 1)),
+                                                  (item.id, 2, "O", datetime.date(2013, 1, 1))]),
+                         [VERDICT_ELIGIBLE, VERDICT_PATIENT_CATEGORY])
@@ -0,0 +1,145 @@
+"""
+Micro-benchmarks of the catalog access paths, skipped unless MEDICAL_BENCHMARKS is set:
+
+    MEDICAL_BENCHMARKS=1 python manage.py test medical.tests_benchmarks
+
+The timings are printed, only the results of the compared paths are asserted.
+"""
+import bisect
+import os
+import time
+import unittest
+from collections import defaultdict
+
+import numpy as np
+
+from django.test import TestCase
+
+from medical.frequency import frequency_rules_for, frequency_violations
+from medical.models import Item
+from medical.pagination import keyset_page, encode_cursor
+from medical.records import ItemRecord, as_records
+
+BENCHMARKS = os.environ.get("MEDICAL_BENCHMARKS")
+
+
+def best_of(function, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bulk_create_items(count, prefix, **props):
+    Item.objects.bulk_create([Item(**{
+        "code": f"{prefix}{index:05d}", "name": f"Benchmark item {index}", "type": "D", "price": index % 500,
+        "care_type": "B", "patient_category": 15, "validity_from": "2019-06-01", "audit_user_id": -1, **props
+    }) for index in range(count)], batch_size=1000)
+
+
+@unittest.skipUnless(BENCHMARKS, "set MEDICAL_BENCHMARKS to run the benchmarks")
+class KeysetPaginationBenchmark(TestCase):
+    ROWS = 50000
+    PAGE = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        # history view: mostly old versions
+        bulk_create_items(cls.ROWS, "B", validity_to="2020-01-01")
+
+    def test_offset_vs_keyset(self):
+        queryset = Item.objects.filter(code__startswith="B").order_by("code")
+        print(f"\n{'depth':>8} {'offset (ms)':>12} {'keyset (ms)':>12}")
+        for depth in (0, 1000, 10000, 40000):
+            offset_page = list(queryset.order_by("code", "id")[depth:depth + self.PAGE])
+            after = None
+            if depth:
+                # cursor of the last row of the previous page
+                previous = queryset.order_by("code", "id")[depth - 1]
+                after = encode_cursor([previous.code, previous.id])
+            keyset_rows, _, _ = keyset_page(queryset, self.PAGE, after)
+            self.assertEqual([item.id for item in keyset_rows], [item.id for item in offset_page])
+            offset_time = best_of(lambda: list(queryset.order_by("code", "id")[depth:depth + self.PAGE]))
+            keyset_time = best_of(lambda: keyset_page(queryset, self.PAGE, after))
+            print(f"{depth:>8} {offset_time * 1000:>12.2f} {keyset_time * 1000:>12.2f}")
+
+
+@unittest.skipUnless(BENCHMARKS, "set MEDICAL_BENCHMARKS to run the benchmarks")
+class CatalogRecordBenchmark(TestCase):
+    ROWS = 100000
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_create_items(cls.ROWS, "R")
+
+    def test_records_vs_models(self):
+        queryset = Item.objects.filter(code__startswith="R")
+        rows = list(queryset.values_list(*ItemRecord.FIELDS))
+        field_names = [field.attname for field in Item._meta.concrete_fields]
+        model_rows = list(queryset.values_list(*field_names))
+        self.assertEqual(len(rows), self.ROWS)
+
+        construction = (
+            ("model instances", lambda: [Item.from_db("default", field_names, row) for row in model_rows]),
+            ("records", lambda: [ItemRecord.from_row(row) for row in rows]),
+        )
+        queries = (
+            ("model queryset", lambda: list(queryset.iterator(chunk_size=2000))),
+            ("as_records", lambda: list(as_records(queryset))),
+        )
+        print(f"\n{'100k rows':>20} {'best of 3 (ms)':>16}")
+        for label, function in construction + queries:
+            print(f"{label:>20} {best_of(function, repeat=3) * 1000:>16.1f}")
+
+
+def _python_frequency_violations(frequencies, prior_codes, prior_dates, codes, dates):
+    # baseline: per line bisection in the sorted dates of its code
+    by_code = defaultdict(list)
+    for code, date in zip(prior_codes, prior_dates):
+        if code in frequencies:
+            by_code[code].append(date)
+    for code_dates in by_code.values():
+        code_dates.sort()
+    violating = []
+    for line, (code, date) in enumerate(zip(codes, dates)):
+        frequency = frequencies.get(code)
+        code_dates = by_code.get(code)
+        if frequency is None or not code_dates:
+            continue
+        position = bisect.bisect_right(code_dates, date)
+        if (position > 0 and (date - code_dates[position - 1]).days < frequency) or \
+                (position < len(code_dates) and (code_dates[position] - date).days < frequency):
+            violating.append(line)
+    return violating
+
+
+@unittest.skipUnless(BENCHMARKS, "set MEDICAL_BENCHMARKS to run the benchmarks")
+class FrequencyViolationsBenchmark(TestCase):
+    CODES = 2000
+    PRIOR = 1000000
+    LINES = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        bulk_create_items(cls.CODES, "F", frequency=30)
+
+    def test_vectorized_vs_python(self):
+        frequency_rules_for(Item).invalidate()
+        random = np.random.default_rng(0)
+        start = np.datetime64("2015-01-01")
+        prior_codes = np.array([f"F{index:05d}" for index in random.integers(0, self.CODES * 2, self.PRIOR)])
+        prior_dates = start + random.integers(0, 3650, self.PRIOR).astype("timedelta64[D]")
+        codes = np.array([f"F{index:05d}" for index in random.integers(0, self.CODES * 2, self.LINES)])
+        dates = start + random.integers(0, 3650, self.LINES).astype("timedelta64[D]")
+
+        frequencies = dict(Item.objects.filter(code__startswith="F", validity_to__isnull=True)
+                           .values_list("code", "frequency"))
+        python_inputs = (prior_codes.tolist(), prior_dates.tolist(), codes.tolist(), dates.tolist())
+        violations = frequency_violations(Item, prior_codes, prior_dates, codes, dates)
+        self.assertEqual([violation.line for violation in violations],
+                         _python_frequency_violations(frequencies, *python_inputs))
+        vectorized = best_of(lambda: frequency_violations(Item, prior_codes, prior_dates, codes, dates), repeat=3)
+        python = best_of(lambda: _python_frequency_violations(frequencies, *python_inputs), repeat=3)
+        print(f"\n1M prior lines, 10k lines: vectorized {vectorized * 1000:.1f} ms, python {python * 1000:.1f} ms")
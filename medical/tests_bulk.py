@@ -0,0 +1,13 @@
+from core.test_helpers import create_test_interactive_user
+from django.test import TestCase
+
+from medical.bulk import bulk_upsert_items_or_services, ROW_FAILED
+from medical.models import Item
+
+
+class BulkUpsertTestCase(TestCase):
+    def test_failed_rows_name_the_missing_fields(self):
+        user = create_test_interactive_user(username="testMedicalBulk")
+        report = bulk_upsert_items_or_services(Item, [{"code": "BLK100", "type": "D", "patient_category": 15}], user)
+        self.assertEqual([entry["status"] for entry in report], [ROW_FAILED])
+        self.assertTrue(report[0]["message"].endswith(": name, care_type, price"), report[0]["message"])
@@ -0,0 +1,82 @@
+from django.db import DatabaseError, transaction
+from django.test import TestCase
+
+from medical.cache import item_catalog_cache
+from medical.apps import MedicalConfig
+from medical.models import Item
+from medical.services import check_unique_code_item, set_item_or_service_deleted, taken_codes
+from medical.test_helpers import create_test_item
+from medical.versions import bump_catalog_version_of
+
+
+class CatalogCacheTestCase(TestCase):
+    def setUp(self):
+        item_catalog_cache.invalidate()
+
+    def test_cache_is_patched_on_create_update_and_delete(self):
+        item = create_test_item("D", custom_props={"code": "CCH001"})
+        self.assertTrue(item_catalog_cache.has_code("CCH001"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_item = create_test_item("D", custom_props={"code": "CCH002"})
+        with self.assertNumQueries(0):
+            self.assertEqual(item_catalog_cache.get_by_uuid(new_item.uuid).id, new_item.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.name = "Renamed item"
+            item.save()
+        self.assertEqual(item_catalog_cache.get_by_id(item.id).name, "Renamed item")
+        # the history copy written by the update is not a current row
+        self.assertEqual(item_catalog_cache.get_by_code("CCH001").id, item.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_item_or_service_deleted(item, "item")
+        self.assertIsNone(item_catalog_cache.get_by_code("CCH001"))
+        self.assertEqual(check_unique_code_item("CCH001"), [])
+        self.assertNotEqual(check_unique_code_item("CCH002"), [])
+
+    def test_rolled_back_save_is_not_cached(self):
+        item_catalog_cache.has_code("CCH007")
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    create_test_item("D", custom_props={"code": "CCH007"})
+                    raise DatabaseError("rollback")
+            except DatabaseError:
+                pass
+        self.assertIsNone(item_catalog_cache.get_by_code("CCH007"))
+
+    def test_stats_count_hits_and_misses(self):
+        create_test_item("D", custom_props={"code": "CCH003"})
+        item_catalog_cache.has_code("CCH003")
+        item_catalog_cache.has_code("NOPE")
+        stats = item_catalog_cache.stats()
+        self.assertTrue(stats["loaded"])
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["misses"], 1)
+
+    def test_taken_codes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_test_item("D", custom_props={"code": "CCH004"})
+            create_test_item("D", custom_props={"code": "CCH005"})
+        codes = ["CCH004", "CCH005", "CCH006"]
+        self.assertEqual(taken_codes(Item, codes), {"CCH004", "CCH005"})
+        # the free codes are answered by the version checked cache, the known ones are confirmed in the database
+        with self.assertNumQueries(1):
+            self.assertEqual(taken_codes(Item, ["CCH006", "CCH009"]), set())
+        with self.assertNumQueries(2):
+            self.assertEqual(taken_codes(Item, ["CCH004"]), {"CCH004"})
+        # written by another process, which bumps the catalog version once committed
+        Item.objects.bulk_create([Item(code="CCH006", name="Other process", type="D", price=1, care_type="O",
+                                       patient_category=15, audit_user_id=-1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version_of(Item)
+        self.assertEqual(taken_codes(Item, codes), {"CCH004", "CCH005", "CCH006"})
+        self.assertNotEqual(check_unique_code_item("CCH006"), [])
+
+        MedicalConfig.catalog_cache_enabled = False
+        try:
+            with self.assertNumQueries(1):
+                self.assertEqual(taken_codes(Item, codes), {"CCH004", "CCH005", "CCH006"})
+        finally:
+            MedicalConfig.catalog_cache_enabled = True
@@ -0,0 +1,85 @@
+import datetime
+
+from core.test_helpers import create_test_interactive_user
+from core.utils import TimeUtils
+from django.test import TestCase
+
+from medical.apps import MedicalConfig
+from medical.bulk import bulk_upsert_items_or_services, ROW_UPDATED
+from medical.delta import changed_since
+from medical.models import Item
+from medical.test_helpers import create_test_item
+
+
+class ChangedSinceTestCase(TestCase):
+    def test_changed_and_removed(self):
+        unchanged = create_test_item("D", custom_props={"code": "DLT001"})
+        updated = create_test_item("D", custom_props={"code": "DLT002"})
+        deleted = create_test_item("D", custom_props={"code": "DLT003"})
+        since = datetime.datetime(2020, 1, 1)
+
+        created = create_test_item("D", custom_props={"code": "DLT004", "validity_from": TimeUtils.now()})
+        updated.name = "Updated"
+        updated.save()
+        deleted.delete_history()
+
+        delta = changed_since(Item, since, until=TimeUtils.now())
+        codes = {item.code for item in delta.changed if item.code.startswith("DLT")}
+        self.assertEqual(codes, {created.code, updated.code})
+        self.assertNotIn(unchanged.code, codes)
+        self.assertEqual([tombstone.uuid for tombstone in delta.removed if tombstone.code.startswith("DLT")],
+                         [deleted.uuid])
+        self.assertFalse(delta.has_more)
+
+        # nothing changed since the end of the delta
+        next_delta = changed_since(Item, delta.until, delta.until_id)
+        self.assertFalse([item for item in next_delta.changed if item.code.startswith("DLT")])
+        self.assertEqual([tombstone for tombstone in next_delta.removed if tombstone.code.startswith("DLT")], [])
+
+    def test_until_lags_behind_now(self):
+        # written now, possibly by a transaction that is not committed yet: part of a later delta
+        create_test_item("D", custom_props={"code": "DLT005", "validity_from": TimeUtils.now()})
+        delta = changed_since(Item, datetime.datetime(2020, 1, 1))
+        self.assertLessEqual(delta.until,
+                             TimeUtils.now() - datetime.timedelta(seconds=MedicalConfig.delta_sync_lag))
+        self.assertNotIn("DLT005", [item.code for item in delta.changed])
+
+    def test_pages_of_changed_rows(self):
+        # rows sharing the same validity_from (bulk writes) are paged by id
+        when = datetime.datetime(2021, 6, 1)
+        for index in range(5):
+            create_test_item("D", custom_props={"code": f"DLP00{index}", "validity_from": when})
+        since, after_id, codes = datetime.datetime(2021, 5, 31), None, []
+        while True:
+            delta = changed_since(Item, since, after_id, until=datetime.datetime(2021, 6, 2), page_size=2)
+            codes += [item.code for item in delta.changed]
+            if not delta.has_more:
+                break
+            self.assertEqual((delta.until, len(delta.changed)), (when, 2))
+            since, after_id = delta.until, delta.until_id
+        self.assertEqual(codes, [f"DLP00{index}" for index in range(5)])
+
+    def test_bulk_change_of_unversioned_field(self):
+        # maximum_amount is not compared by Item.__eq__, its change still makes a new version
+        item = create_test_item("D", custom_props={"code": "DLT006", "maximum_amount": 10})
+        since = TimeUtils.now()
+        user = create_test_interactive_user(username="testMedicalDeltaBulk")
+        row = {"code": "DLT006", "name": item.name, "type": item.type, "price": item.price,
+               "care_type": item.care_type, "patient_category": item.patient_category, "maximum_amount": 20}
+
+        report = bulk_upsert_items_or_services(Item, [row], user)
+
+        self.assertEqual([entry["status"] for entry in report], [ROW_UPDATED])
+        self.assertEqual(list(Item.objects.filter(legacy_id=item.id).values_list("maximum_amount", flat=True)), [10])
+        delta = changed_since(Item, since, until=TimeUtils.now())
+        self.assertEqual([(version.code, version.maximum_amount) for version in delta.changed], [("DLT006", 20)])
+
+    def test_save_change_of_unversioned_field(self):
+        item = create_test_item("D", custom_props={"code": "DLT007", "maximum_amount": 10})
+        since = TimeUtils.now()
+        item.maximum_amount = 20
+        item.save()
+
+        self.assertEqual(list(Item.objects.filter(legacy_id=item.id).values_list("maximum_amount", flat=True)), [10])
+        delta = changed_since(Item, since, until=TimeUtils.now())
+        self.assertEqual([version.code for version in delta.changed], ["DLT007"])
@@ -0,0 +1,66 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from medical.diagnoses import load_diagnoses, read_code_file
+from medical.models import Diagnosis
+
+
+class LoadDiagnosesTestCase(TestCase):
+    def setUp(self):
+        self.kept = Diagnosis.objects.create(code="X01", name="Kept", audit_user_id=-1)
+        self.renamed = Diagnosis.objects.create(code="X02", name="Old name", audit_user_id=-1)
+        self.removed = Diagnosis.objects.create(code="X03", name="Removed", audit_user_id=-1)
+
+    def test_read_code_file(self):
+        self.assertEqual(list(read_code_file(["name\tcode\n", "Cholera\tA00\n", "\n"])), [("A00", "Cholera")])
+        self.assertEqual(list(read_code_file(["code;name\n", "A00;Cholera\n"])), [("A00", "Cholera")])
+        with self.assertRaises(ValueError):
+            list(read_code_file(["icd,label\n"]))
+
+    def test_load_diffs_against_the_current_rows(self):
+        rows = [("X01", "Kept"), ("X02", "New name"), ("X04", "Created"), ("X04", "Duplicate"), ("", "No code")]
+
+        stats = load_diagnoses(iter(rows), audit_user_id=-2, remove_missing=True, chunk_size=2)
+
+        self.assertEqual((stats["read"], stats["created"], stats["updated"], stats["unchanged"], stats["deleted"],
+                          stats["invalid"]), (5, 1, 1, 1, 1, 2))
+        current = dict(Diagnosis.objects.filter(validity_to__isnull=True).values_list("code", "name"))
+        self.assertEqual(current, {"X01": "Kept", "X02": "New name", "X04": "Created"})
+        history = Diagnosis.objects.get(legacy_id=self.renamed.id)
+        self.assertEqual(history.name, "Old name")
+        self.assertIsNotNone(history.validity_to)
+        self.removed.refresh_from_db()
+        self.assertIsNotNone(self.removed.validity_to)
+        self.assertEqual(Diagnosis.objects.filter(legacy_id=self.kept.id).count(), 0)
+
+    def test_command_dry_run(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as code_file:
+            code_file.write("code,name\nX01,Kept\nX05,New\n")
+        try:
+            output = StringIO()
+            call_command("load_diagnoses", code_file.name, "--dry-run", "--remove-missing", stdout=output)
+        finally:
+            os.unlink(code_file.name)
+        self.assertIn("1 created", output.getvalue())
+        self.assertIn("2 deleted", output.getvalue())
+        self.assertFalse(Diagnosis.objects.filter(code="X05").exists())
+
+    def test_missing_codes_are_kept_by_default(self):
+        stats = load_diagnoses(iter([("X01", "Kept")]), audit_user_id=-2)
+        self.assertEqual(stats["deleted"], 0)
+        self.removed.refresh_from_db()
+        self.assertIsNone(self.removed.validity_to)
+
+    def test_duplicated_current_codes_are_reported(self):
+        duplicate = Diagnosis.objects.create(code="X02", name="Other name", audit_user_id=-1)
+
+        stats = load_diagnoses(iter([("X02", "New name")]), audit_user_id=-2, remove_missing=True)
+
+        self.assertEqual(stats["duplicated"], [{"code": "X02", "ids": sorted([self.renamed.id, duplicate.id])}])
+        self.assertEqual((stats["updated"], stats["invalid"], stats["deleted"]), (0, 1, 2))
+        self.assertEqual(sorted(Diagnosis.objects.filter(code="X02", validity_to__isnull=True)
+                                .values_list("name", flat=True)), ["Old name", "Other name"])
@@ -0,0 +1,65 @@
+import datetime
+
+from core import PATIENT_CATEGORY_MASK_ADULT, PATIENT_CATEGORY_MASK_MALE, PATIENT_CATEGORY_MASK_MINOR, \
+    PATIENT_CATEGORY_MASK_FEMALE
+from django.test import TestCase
+
+from medical.eligibility import check_eligibility, eligibility_index_for, filter_eligible, EligibilityRequest, \
+    VERDICT_ELIGIBLE, VERDICT_NOT_VALID, VERDICT_PATIENT_CATEGORY, VERDICT_CARE_TYPE
+from medical.models import Item
+
+ADULT_MALE = PATIENT_CATEGORY_MASK_ADULT | PATIENT_CATEGORY_MASK_MALE
+MINOR_FEMALE = PATIENT_CATEGORY_MASK_MINOR | PATIENT_CATEGORY_MASK_FEMALE
+
+
+class EligibilityTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from medical.test_helpers import create_test_item
+        cls.adults = create_test_item("D", custom_props={
+            "code": "ELG001", "patient_category": PATIENT_CATEGORY_MASK_ADULT | PATIENT_CATEGORY_MASK_MALE |
+            PATIENT_CATEGORY_MASK_FEMALE, "care_type": "O", "validity_from": datetime.datetime(2019, 1, 1)})
+        cls.all = create_test_item("D", custom_props={
+            "code": "ELG002", "patient_category": 15, "care_type": "B",
+            "validity_from": datetime.datetime(2019, 1, 1)})
+        # in-patient only from 2021
+        cls.changed = Item.objects.get(id=cls.all.id)
+        cls.changed.care_type = "I"
+        cls.changed.save()
+        Item.objects.filter(id=cls.changed.id).update(validity_from=datetime.datetime(2021, 1, 1))
+        Item.objects.filter(legacy_id=cls.changed.id).update(validity_to=datetime.datetime(2021, 1, 1))
+
+    def setUp(self):
+        eligibility_index_for(Item).invalidate()
+
+    def test_batch(self):
+        before, after = datetime.date(2020, 6, 1), datetime.date(2022, 6, 1)
+        verdicts = check_eligibility(Item, [
+            EligibilityRequest(self.adults.id, ADULT_MALE, "O", after),
+            EligibilityRequest(self.adults.id, MINOR_FEMALE, "O", after),
+            EligibilityRequest(self.adults.id, ADULT_MALE, "I", after),
+            EligibilityRequest(self.adults.id, ADULT_MALE, "O", datetime.date(2018, 6, 1)),
+            EligibilityRequest(self.all.id, MINOR_FEMALE, "O", before),
+            EligibilityRequest(self.all.id, MINOR_FEMALE, "O", after),
+            EligibilityRequest(self.all.id, MINOR_FEMALE, "I", after),
+            EligibilityRequest(-1, ADULT_MALE, "O", after),
+        ])
+        self.assertEqual(verdicts, [
+            VERDICT_ELIGIBLE, VERDICT_PATIENT_CATEGORY, VERDICT_CARE_TYPE, VERDICT_NOT_VALID,
+            VERDICT_ELIGIBLE, VERDICT_CARE_TYPE, VERDICT_ELIGIBLE, VERDICT_NOT_VALID,
+        ])
+
+    def test_rebuilt_on_change(self):
+        request = (self.adults.id, MINOR_FEMALE, "O", datetime.date.today())
+        self.assertEqual(check_eligibility(Item, [request]), [VERDICT_PATIENT_CATEGORY])
+        item = Item.objects.get(id=self.adults.id)
+        item.patient_category = 15
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(check_eligibility(Item, [request]), [VERDICT_ELIGIBLE])
+
+    def test_filter_eligible(self):
+        items = Item.objects.filter(code__startswith="ELG", validity_to__isnull=True)
+        self.assertEqual(list(filter_eligible(items, ADULT_MALE, "O").values_list("code", flat=True)), ["ELG001"])
+        self.assertEqual(list(filter_eligible(items, MINOR_FEMALE, "I").values_list("code", flat=True)), ["ELG002"])
+        self.assertEqual(list(filter_eligible(items, MINOR_FEMALE, "O")), [])
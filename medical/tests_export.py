@@ -0,0 +1,40 @@
+import json
+from io import StringIO
+
+from core.test_helpers import create_test_interactive_user
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from medical.export import stream_export, FORMAT_NDJSON
+from medical.test_helpers import create_test_item
+from medical.views import export_catalog
+
+
+class CatalogExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = create_test_item("D", custom_props={"code": "EXP001", "name": "Exported item"})
+        cls.item.save_history()
+
+    def test_csv_export_of_current_rows(self):
+        out = StringIO()
+        call_command("export_medical_catalog", "items", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("id,uuid,code,name"))
+        self.assertEqual(len([line for line in lines if ",EXP001," in line]), 1)
+
+    def test_ndjson_export_with_history(self):
+        rows = [json.loads(line) for line in stream_export("items", FORMAT_NDJSON, show_history=True)]
+        versions = [row for row in rows if row["code"] == "EXP001"]
+        self.assertEqual(len(versions), 2)
+        self.assertEqual({row["legacy_id"] for row in versions}, {None, self.item.id})
+
+    def test_view(self):
+        request = APIRequestFactory().get("/medical/export/items", {"export_format": "ndjson", "as_of": "2999-01-01"})
+        force_authenticate(request, user=create_test_interactive_user(username="testMedicalExport"))
+        response = export_catalog(request, entity="items")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["legacy_id"] for row in rows if row["code"] == "EXP001"], [None])
@@ -0,0 +1,45 @@
+import datetime
+
+from django.test import TestCase
+
+from medical.frequency import frequency_rules_for, frequency_violations, FrequencyViolation
+from medical.models import Item
+from medical.test_helpers import create_test_item
+
+
+class FrequencyViolationsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_test_item("D", custom_props={"code": "FRQ001", "frequency": 30})
+        create_test_item("D", custom_props={"code": "FRQ002", "frequency": 7})
+        create_test_item("D", custom_props={"code": "FRQ003"})
+
+    def setUp(self):
+        frequency_rules_for(Item).invalidate()
+
+    def test_violations(self):
+        day = datetime.date(2024, 3, 1)
+        prior_codes = ["FRQ001", "FRQ002", "FRQ003", "FRQ001", "OTHER"]
+        prior_dates = [day - datetime.timedelta(days=40), day - datetime.timedelta(days=7), day,
+                       day + datetime.timedelta(days=10), day]
+        violations = frequency_violations(Item, prior_codes, prior_dates, [
+            "FRQ001",  # 10 days before a later use
+            "FRQ002",  # 7 days after the previous use: allowed
+            "FRQ003",  # no frequency
+            "FRQ001",  # 5 days after the use of 40 days before
+            "OTHER",
+        ], [day, day, day, day - datetime.timedelta(days=35), day])
+        self.assertEqual(violations, [
+            FrequencyViolation(0, "FRQ001", day, day + datetime.timedelta(days=10), 30),
+            FrequencyViolation(3, "FRQ001", day - datetime.timedelta(days=35), day - datetime.timedelta(days=40), 30),
+        ])
+        self.assertEqual(frequency_violations(Item, [], [], ["FRQ001"], [day]), [])
+
+    def test_refreshed_on_catalog_change(self):
+        day = datetime.date(2024, 3, 1)
+        self.assertEqual(frequency_violations(Item, ["FRQ003"], [day], ["FRQ003"], [day]), [])
+        item = Item.objects.get(code="FRQ003", validity_to__isnull=True)
+        item.frequency = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(len(frequency_violations(Item, ["FRQ003"], [day], ["FRQ003"], [day])), 1)
@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+from core.test_helpers import create_test_interactive_user
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from medical.history import version_history, FieldChange
+from medical.models import Item
+from medical.test_helpers import create_test_item
+
+
+class _NoRightUser:
+    is_anonymous = False
+
+    def has_perms(self, perms):
+        return False
+
+
+class VersionHistoryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_test_interactive_user(username="testMedicalHistory")
+        cls.item = create_test_item("D", custom_props={"code": "HST001", "name": "History", "price": 100,
+                                                      "package": None})
+        item = Item.objects.get(id=cls.item.id)
+        item.price = 110
+        item.package = ""
+        item.save()
+        item = Item.objects.get(id=cls.item.id)
+        item.name = "History renamed"
+        item.frequency = 30
+        item.save()
+        cls.other = create_test_item("D", custom_props={"code": "HST002"})
+
+    def test_chain_and_changes(self):
+        with CaptureQueriesContext(connection) as context:
+            history = version_history(Item, self.item.uuid, self.user)
+        # a single query for the versions, besides the permission check
+        self.assertEqual(len([query for query in context.captured_queries if "tblItems" in query["sql"]]), 1)
+        self.assertEqual([version.instance.legacy_id for version in history], [self.item.id, self.item.id, None])
+        self.assertEqual([version.changes for version in history], [
+            [],
+            # package None -> "" is not a change, like Item.__eq__
+            [FieldChange("price", Decimal("100.00"), Decimal("110.00"))],
+            [FieldChange("name", "History", "History renamed"), FieldChange("frequency", None, 30)],
+        ])
+        # same chain from the uuid of a history copy
+        self.assertEqual(len(version_history(Item, history[0].instance.uuid, self.user)), 3)
+
+    def test_full_right_only(self):
+        # OMT-281
+        history = version_history(Item, self.item.uuid, _NoRightUser())
+        self.assertEqual([version.instance.id for version in history], [self.item.id])
+        self.assertEqual(version_history(Item, "00000000-0000-0000-0000-000000000000", self.user), [])
@@ -0,0 +1,53 @@
+import datetime
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+
+from medical.models import Diagnosis, Item, Service
+from medical.test_helpers import create_test_item, create_test_service
+
+
+@skipUnless(connection.vendor in ("postgresql", "sqlite"), "query plans are only checked on PostgreSQL and SQLite")
+class CurrentRowIndexesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item = create_test_item("D", custom_props={"code": "IDX001"})
+        item.save_history()
+        create_test_service("S", custom_props={"code": "IDX001"})
+
+    def assertUsesIndex(self, queryset, *index_names):
+        if connection.vendor == "postgresql":
+            # the test tables are tiny, the planner would rather scan them
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertTrue(any(index_name in plan for index_name in index_names), plan)
+
+    def test_current_code_lookups(self):
+        # on tiny tables the planner can pick either index on the code
+        self.assertUsesIndex(Item.filter_queryset().filter(code="IDX001"),
+                             "tblItems_current_code", "tblItems_code_validity")
+        self.assertUsesIndex(Service.filter_queryset().filter(code="IDX001"),
+                             "tblServices_current_code", "tblServices_code_validity")
+        self.assertUsesIndex(Diagnosis.filter_queryset().filter(code="A00"), "tblICDCodes_current_code")
+        # check_if_code_already_exists / check_unique_code_*
+        self.assertUsesIndex(Item.objects.filter(code="IDX001", validity_to__isnull=True),
+                             "tblItems_current_code", "tblItems_code_validity")
+
+    def test_point_in_time_lookups(self):
+        self.assertUsesIndex(Item.as_of(datetime.date(2020, 1, 1)).filter(code="IDX001"), "tblItems_code_validity")
+
+    def test_history_chain(self):
+        item = Item.objects.get(code="IDX001", validity_to__isnull=True)
+        self.assertUsesIndex(Item.objects.filter(legacy_id=item.id).order_by("validity_from"), "tblItems_history")
+
+    def test_delta_sync(self):
+        since, until = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1)
+        self.assertUsesIndex(
+            Item.objects.filter(validity_to__isnull=True, validity_from__gt=since, validity_from__lte=until),
+            "tblItems_changed")
+        # on tiny tables the planner can pick either index starting with legacy_id IS NULL
+        self.assertUsesIndex(
+            Service.objects.filter(legacy_id__isnull=True, validity_to__gt=since, validity_to__lte=until),
+            "tblServices_removed", "tblServices_history")
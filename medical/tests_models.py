@@ -0,0 +1,51 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from medical.models import Item, Service
+from medical.test_helpers import create_test_item, create_test_service
+
+
+class SaveHistoryOnUpdateTestCase(TestCase):
+    def assertNoRowRead(self, queries, table, pk_column):
+        reads = [query["sql"] for query in queries
+                 if query["sql"].startswith("SELECT") and f'"{table}"' in query["sql"]
+                 and f'"{table}"."{pk_column}" =' in query["sql"]]
+        self.assertEqual(reads, [])
+
+    def test_create_does_not_read_the_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            item = create_test_item("D", custom_props={"code": "HST001"})
+        self.assertNoRowRead(queries, "tblItems", "ItemID")
+        self.assertFalse(Item.objects.filter(legacy_id=item.id).exists())
+
+    def test_update_uses_the_loaded_state(self):
+        create_test_item("D", custom_props={"code": "HST002"})
+        item = Item.objects.get(code="HST002")
+        item.name = "Changed name"
+        with CaptureQueriesContext(connection) as queries:
+            item.save()
+        self.assertNoRowRead(queries, "tblItems", "ItemID")
+        self.assertEqual(Item.objects.filter(legacy_id=item.id).count(), 1)
+        history = Item.objects.get(legacy_id=item.id)
+        self.assertEqual(history.name, "Test item")
+        self.assertIsNotNone(history.validity_to)
+
+        # a second update compares with the saved values
+        item.name = "Changed again"
+        with CaptureQueriesContext(connection) as queries:
+            item.save()
+        self.assertNoRowRead(queries, "tblItems", "ItemID")
+        self.assertEqual(
+            list(Item.objects.filter(legacy_id=item.id).order_by("id").values_list("name", flat=True)),
+            ["Test item", "Changed name"])
+
+    def test_update_without_change_writes_no_history(self):
+        service = create_test_service("S", custom_props={"code": "HST003"})
+        service = Service.objects.get(id=service.id)
+        # the audit user is not versioned
+        service.audit_user_id = 2
+        with CaptureQueriesContext(connection) as queries:
+            service.save()
+        self.assertNoRowRead(queries, "tblServices", "ServiceID")
+        self.assertFalse(Service.objects.filter(legacy_id=service.id).exists())
@@ -0,0 +1,65 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.test import TestCase
+
+from medical.exceptions import PackageCycleError
+from medical.models import ServiceItem, ServiceService
+from medical.packages import package_graph, expand_package, PackageLine, KIND_ITEM, KIND_SERVICE
+from medical.test_helpers import create_test_item, create_test_service
+from medical.utils import process_services_relations
+
+
+class PackageGraphTestCase(TestCase):
+    user = SimpleNamespace(id_for_audit=-1)
+
+    def setUp(self):
+        package_graph.invalidate()
+        self.item = create_test_item("D", custom_props={"code": "PKGI01"})
+        self.leaf = create_test_service("A", custom_props={"code": "PKGS01"})
+        self.outer = create_test_service("A", custom_props={"code": "PKGS02"})
+        self.inner = create_test_service("A", custom_props={"code": "PKGS03"})
+        ServiceItem.objects.create(parent=self.outer, item=self.item, qty_provided=3, price_asked=10)
+        ServiceService.objects.create(parent=self.outer, service=self.inner, qty_provided=2, price_asked=99)
+        ServiceItem.objects.create(parent=self.inner, item=self.item, qty_provided=4, price_asked=5)
+        ServiceService.objects.create(parent=self.inner, service=self.leaf, qty_provided=1, price_asked=7)
+        self.extra = create_test_service("A", custom_props={"code": "PKGS04"})
+
+    def test_expand_multiplies_the_quantities(self):
+        with self.assertNumQueries(2):
+            lines = expand_package(self.outer.id)
+        self.assertEqual(lines, [
+            PackageLine(KIND_ITEM, self.item.id, Decimal(11), Decimal(70) / 11, Decimal(70)),
+            PackageLine(KIND_SERVICE, self.leaf.id, Decimal(2), Decimal(7), Decimal(14)),
+        ])
+        with self.assertNumQueries(0):
+            self.assertEqual(expand_package(self.outer.id, 2)[1].qty_provided, Decimal(4))
+        self.assertEqual(expand_package(self.leaf.id), [])
+
+    def test_cycles_are_rejected(self):
+        # the graph of this process doesn't know the links written by other processes, the check reads them
+        expand_package(self.outer.id)
+        ServiceService.objects.create(parent=self.leaf, service=self.extra, qty_provided=1)
+        with self.assertRaises(PackageCycleError):
+            process_services_relations(self.user, self.extra, [
+                {"service_id": self.outer.id, "price_asked": None, "qty_provided": 1, "status": 1}])
+
+        with self.assertRaises(PackageCycleError):
+            process_services_relations(self.user, self.inner, [
+                {"service_id": self.outer.id, "price_asked": None, "qty_provided": 1, "status": 1}])
+        self.assertFalse(ServiceService.objects.filter(parent=self.inner, service=self.outer).exists())
+
+        ServiceService.objects.create(parent=self.leaf, service=self.outer, qty_provided=1)
+        package_graph.invalidate()
+        with self.assertRaises(PackageCycleError):
+            expand_package(self.outer.id)
+
+    def test_expansion_follows_package_updates(self):
+        expand_package(self.outer.id)
+        link = ServiceService.objects.get(parent=self.inner, service=self.leaf)
+        with self.captureOnCommitCallbacks(execute=True):
+            process_services_relations(self.user, self.inner, [
+                {"id": link.id, "service_id": self.leaf.id, "price_asked": Decimal(7), "qty_provided": 5,
+                 "status": 1}])
+
+        self.assertEqual(expand_package(self.outer.id)[1].qty_provided, Decimal(10))
@@ -0,0 +1,62 @@
+import datetime
+
+from django.test import TestCase
+
+from medical.models import Item
+from medical.pagination import KeysetConnectionField, keyset_page, keyset_ordering, encode_cursor
+from medical.schema import ItemGQLType
+from medical.test_helpers import create_test_item
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(7):
+            item = create_test_item("D", custom_props={"code": f"KSP0{index % 3}", "price": 10 * (index % 2)})
+            if index % 2:
+                item.save_history()
+        cls.items = Item.objects.filter(code__startswith="KSP")
+
+    def _all_pages(self, queryset, size):
+        rows, after = [], None
+        while True:
+            page, cursors, has_next = keyset_page(queryset, size, after)
+            rows += page
+            if not has_next:
+                return rows
+            after = cursors[-1]
+
+    def test_pages_match_the_ordered_queryset(self):
+        for order_by in (["code"], ["-code"], ["-price", "code"], ["validity_to"], ["-validity_to", "-code"]):
+            with self.subTest(order_by=order_by):
+                expected = list(self.items.order_by(*order_by, "id"))
+                # NULLs last in ascending order, first in descending order
+                nullable = order_by[0].lstrip("-") == "validity_to"
+                if nullable:
+                    expected.sort(key=lambda item: item.validity_to is None, reverse=order_by[0].startswith("-"))
+                for size in (1, 2, 5):
+                    self.assertEqual(
+                        [item.id for item in self._all_pages(self.items.order_by(*order_by), size)],
+                        [item.id for item in expected])
+
+    def test_ordering(self):
+        self.assertEqual(keyset_ordering(self.items.order_by("-validity_to")),
+                         [("validity_to", True, True), ("id", False, False)])
+        self.assertEqual(keyset_ordering(self.items.order_by("code", "pk")),
+                         [("code", False, False), ("id", False, False)])
+        self.assertIsNone(keyset_ordering(self.items.order_by("?")))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            keyset_page(self.items.order_by("code"), 2, "YXJyYXljb25uZWN0aW9uOjE=")
+        with self.assertRaises(ValueError):
+            keyset_page(self.items.order_by("code"), 2, encode_cursor([datetime.date(2020, 1, 1)]))
+
+    def test_first_is_capped_at_max_limit(self):
+        from core.test_helpers import create_test_interactive_user
+        queryset = self.items.order_by("code")
+        result = KeysetConnectionField.resolve_keyset_connection(
+            ItemGQLType._meta.connection, {"first": 5, "keyset": True}, queryset, keyset_ordering(queryset),
+            max_limit=2, user=create_test_interactive_user(username="testMedicalKeyset"))
+        self.assertEqual(len(result.edges), 2)
+        self.assertTrue(result.page_info.has_next_page)
@@ -0,0 +1,76 @@
+from django.apps import apps
+from django.test import TestCase
+
+from medical.apps import MedicalConfig
+from medical.models import Item
+from medical.pricelists import filter_pricelist, item_pricelist_membership
+from medical.services import set_items_or_services_deleted
+from medical.test_helpers import create_test_item
+from medical.versions import bump_catalog_version, ENTITY_ITEM_PRICELIST
+
+
+class PricelistMembershipTestCase(TestCase):
+    def setUp(self):
+        if not apps.is_installed("medical_pricelist"):
+            self.skipTest("medical_pricelist is not installed")
+        from medical_pricelist.models import ItemsPricelist, ItemsPricelistDetail
+        item_pricelist_membership.invalidate()
+        self.items = [create_test_item("D", custom_props={"code": f"PLM00{i}"}) for i in range(3)]
+        self.pricelist = ItemsPricelist.objects.create(
+            name="test-membership", pricelist_date="2019-01-01", validity_from="2019-01-01", audit_user_id=1)
+        for item in self.items[:2]:
+            ItemsPricelistDetail.objects.create(
+                items_pricelist=self.pricelist, item=item, validity_from="2019-01-01", audit_user_id=1)
+
+    def _members(self):
+        return set(filter_pricelist(Item.objects.all(), self.pricelist.uuid).values_list("code", flat=True))
+
+    def test_filter_without_join(self):
+        loads = item_pricelist_membership.loads
+        queryset = filter_pricelist(Item.objects.all(), self.pricelist.uuid)
+        self.assertNotIn("JOIN", str(queryset.query))
+        self.assertEqual(self._members(), {"PLM000", "PLM001"})
+        self.assertEqual(item_pricelist_membership.loads, loads + 1)
+
+        # without the index, same result with the join on the details
+        MedicalConfig.catalog_cache_enabled = False
+        try:
+            queryset = filter_pricelist(Item.objects.all(), self.pricelist.uuid)
+            self.assertIn("JOIN", str(queryset.query))
+            self.assertEqual(self._members(), {"PLM000", "PLM001"})
+        finally:
+            MedicalConfig.catalog_cache_enabled = True
+
+    def test_kept_current(self):
+        from medical_pricelist.models import ItemsPricelistDetail
+        self.assertEqual(self._members(), {"PLM000", "PLM001"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemsPricelistDetail.objects.create(
+                items_pricelist=self.pricelist, item=self.items[2], validity_from="2019-01-01", audit_user_id=1)
+        self.assertEqual(self._members(), {"PLM000", "PLM001", "PLM002"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemsPricelistDetail.objects.get(item=self.items[2], validity_to__isnull=True).delete_history()
+        self.assertEqual(self._members(), {"PLM000", "PLM001"})
+
+        # the bulk delete cascades onto the details with update(), without post_save
+        with self.captureOnCommitCallbacks(execute=True):
+            set_items_or_services_deleted(Item, [self.items[0].uuid], "item")
+        self.assertEqual(self._members(), {"PLM001"})
+
+    def test_changes_of_other_processes(self):
+        from medical_pricelist.models import ItemsPricelistDetail
+        self.assertEqual(self._members(), {"PLM000", "PLM001"})
+        # unchanged catalog version: one query for the version, one for the members
+        loads = item_pricelist_membership.loads
+        with self.assertNumQueries(2):
+            self.assertEqual(self._members(), {"PLM000", "PLM001"})
+        self.assertEqual(item_pricelist_membership.loads, loads)
+
+        # written by another process, which bumps the catalog version once committed
+        ItemsPricelistDetail.objects.bulk_create([ItemsPricelistDetail(
+            items_pricelist=self.pricelist, item=self.items[2], validity_from="2019-01-01", audit_user_id=1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version(ENTITY_ITEM_PRICELIST)
+        self.assertEqual(self._members(), {"PLM000", "PLM001", "PLM002"})
@@ -0,0 +1,63 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from medical.cache import service_catalog_cache, item_catalog_cache
+from medical.exceptions import PackageCycleError
+from medical.models import Service, ServiceItem, ServiceService
+from medical.packages import package_graph
+from medical.pricing import PackagePricing, package_price, update_package_prices
+from medical.test_helpers import create_test_item, create_test_service
+
+
+class PackagePricingTestCase(TestCase):
+    def setUp(self):
+        package_graph.invalidate()
+        service_catalog_cache.invalidate()
+        item_catalog_cache.invalidate()
+        self.item = create_test_item("D", custom_props={"code": "PRCI01", "price": Decimal("2.50")})
+        self.leaf = create_test_service("A", custom_props={"code": "PRCS01", "price": Decimal("40")})
+        self.outer = create_test_service("A", custom_props={"code": "PRCS02", "packagetype": "P"})
+        self.inner = create_test_service("A", custom_props={"code": "PRCS03", "packagetype": "F"})
+        self.manual = create_test_service("A", custom_props={
+            "code": "PRCS04", "packagetype": "P", "manualPrice": True})
+        # inner: 4 * 2.50 + 1 * 40 = 50, outer: 3 * 1.10 + 2 * 50 = 103.30
+        ServiceItem.objects.create(parent=self.inner, item=self.item, qty_provided=4)
+        ServiceService.objects.create(parent=self.inner, service=self.leaf, qty_provided=1)
+        ServiceItem.objects.create(parent=self.outer, item=self.item, qty_provided=3, price_asked=Decimal("1.10"))
+        ServiceService.objects.create(parent=self.outer, service=self.inner, qty_provided=2)
+        ServiceItem.objects.create(parent=self.manual, item=self.item, qty_provided=1)
+
+    def test_prices_of_nested_packages(self):
+        self.assertEqual(PackagePricing().changes(), {
+            self.outer.id: Decimal("103.30"),
+            self.inner.id: Decimal("50.00"),
+        })
+        self.assertEqual(package_price(self.outer.id), Decimal("103.30"))
+        self.assertEqual(package_price(self.outer.id, services=[
+            {"service_id": self.inner.id, "qty_provided": 1, "price_asked": None}]), Decimal("53.30"))
+
+    def test_update_writes_only_the_changed_prices(self):
+        update_package_prices(audit_user_id=-2)
+
+        self.outer.refresh_from_db()
+        self.assertEqual(self.outer.price, Decimal("103.30"))
+        self.assertEqual(self.outer.audit_user_id, -2)
+        self.assertEqual(Service.objects.filter(legacy_id=self.outer.id).count(), 1)
+        self.assertFalse(Service.objects.filter(legacy_id=self.manual.id).exists())
+        self.assertEqual(service_catalog_cache.get_by_id(self.inner.id).price, Decimal("50.00"))
+        self.assertEqual(update_package_prices(), {})
+
+    def test_cycles_are_reported(self):
+        ServiceService.objects.create(parent=self.inner, service=self.outer, qty_provided=1)
+        with self.assertRaises(PackageCycleError):
+            PackagePricing().changes()
+
+    def test_command_dry_run(self):
+        output = StringIO()
+        call_command("update_package_prices", "--dry-run", stdout=output)
+        self.assertIn("2 package prices would change", output.getvalue())
+        self.outer.refresh_from_db()
+        self.assertEqual(self.outer.price, Decimal("100"))
@@ -0,0 +1,50 @@
+import pickle
+
+from django.test import TestCase
+
+from medical.models import Diagnosis, Item, Service
+from medical.records import as_records, DiagnosisRecord, ItemRecord, ServiceRecord
+from medical.test_helpers import create_test_item, create_test_service
+
+
+class CatalogRecordTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = create_test_item("D", custom_props={"code": "REC001", "package": ""})
+        cls.service = create_test_service("A", custom_props={"code": "REC002"})
+        cls.diagnosis = Diagnosis.objects.create(code="REC03", name="Record test", audit_user_id=-1)
+
+    def test_as_records(self):
+        [item] = as_records(Item.objects.filter(code="REC001"))
+        self.assertIsInstance(item, ItemRecord)
+        self.assertEqual((item.id, item.code, item.price, item.care_type, item.patient_category),
+                         (self.item.id, "REC001", self.item.price, "1", 15))
+        [service] = as_records(Service.objects.filter(code="REC002"))
+        self.assertEqual(service.category, "A")
+        [diagnosis] = as_records(Diagnosis.objects.filter(code="REC03"))
+        self.assertEqual(str(diagnosis), "REC03 Record test")
+
+        with self.assertRaises(AttributeError):
+            item.price = 0
+        self.assertFalse(hasattr(item, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(item)), item)
+
+    def test_model_semantics(self):
+        [item] = as_records(Item.objects.filter(code="REC001"))
+        stored = Item.objects.get(id=self.item.id)
+        # same hash as the model instance
+        self.assertEqual(hash(item), hash(stored))
+        # the package None and "" are the same, like Item.__eq__
+        other = ItemRecord.from_row([None if name == "package" else getattr(item, name) for name in item.FIELDS])
+        self.assertEqual(item, other)
+        renamed = ItemRecord.from_row(["Renamed" if name == "name" else getattr(item, name) for name in item.FIELDS])
+        self.assertNotEqual(item, renamed)
+
+        [service] = as_records(Service.objects.filter(code="REC002"))
+        self.assertEqual(hash(service), hash(Service.objects.get(id=self.service.id)))
+        self.assertNotEqual(service, item)
+        self.assertIsInstance(service, ServiceRecord)
+
+        [diagnosis] = as_records(Diagnosis.objects.filter(code="REC03"))
+        self.assertEqual(diagnosis, DiagnosisRecord(self.diagnosis.id, "other", "row"))
+        self.assertEqual(hash(diagnosis), hash(self.diagnosis))
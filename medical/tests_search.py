@@ -0,0 +1,45 @@
+from django.test import TestCase
+
+from medical.models import Diagnosis
+from medical.search import AutocompleteIndex, autocomplete_queryset, diagnosis_search_index, search_queryset
+
+
+class AutocompleteIndexTestCase(TestCase):
+    rows = [
+        (1, "A09", "Diarrhoea and gastroenteritis of presumed infectious origin"),
+        (2, "A00", "Cholera"),
+        (3, "A001", "Cholera due to Vibrio cholerae 01, biovar eltor"),
+        (4, "B50", "Plasmodium falciparum malaria"),
+        (5, "B54", "Unspecified malaria"),
+        (6, "K35", "Acute appendicitis with generalized peritonitis"),
+    ]
+
+    def test_ranking(self):
+        index = AutocompleteIndex(self.rows)
+        # exact code, code prefix
+        self.assertEqual(index.search("a00"), [2, 3])
+        # name word prefixes (by code), then other substrings
+        self.assertEqual(index.search("mal"), [4, 5])
+        self.assertEqual(index.search("holera"), [2, 3])
+        self.assertEqual(index.search("chol"), [2, 3])
+        self.assertEqual(index.search("ITIS"), [1, 6])
+        self.assertEqual(index.search("b5", limit=1), [4])
+        self.assertEqual(index.search(" "), [])
+
+    def test_queryset_keeps_the_validity_filter(self):
+        current = Diagnosis.objects.create(code="Z001", name="Autocomplete current", audit_user_id=-1)
+        Diagnosis.objects.create(code="Z002", name="Autocomplete deleted", audit_user_id=-1,
+                                 validity_to="2020-01-01")
+        diagnosis_search_index.invalidate()
+        queryset = autocomplete_queryset(Diagnosis.filter_queryset(), "autocomplete", diagnosis_search_index)
+        self.assertEqual(list(queryset), [current])
+
+
+class SearchQuerysetTestCase(TestCase):
+    def test_ranking(self):
+        for code, name in [("Y20", "Submalarial fever"), ("Y21", "Malaria tertian"), ("Y22", "Acute malaria"),
+                           ("MAL1", "Test diagnosis")]:
+            Diagnosis.objects.create(code=code, name=name, audit_user_id=-1)
+        queryset = search_queryset(Diagnosis.filter_queryset(), "mal")
+        # code prefix, name word prefixes (by code), then other substrings
+        self.assertEqual([diagnosis.code for diagnosis in queryset], ["MAL1", "Y21", "Y22", "Y20"])
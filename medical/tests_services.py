@@ -0,0 +1,85 @@
+import uuid
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.test import TestCase
+
+from medical.cache import item_catalog_cache
+from medical.models import Item, ServiceItem
+from medical.packages import package_graph
+from medical.services import set_items_or_services_deleted
+from medical.test_helpers import create_test_item, create_test_service
+from medical.utils import process_items_relations
+
+
+class SetItemsOrServicesDeletedTestCase(TestCase):
+    def setUp(self):
+        item_catalog_cache.invalidate()
+
+    def test_batch_delete(self):
+        items = [create_test_item("D", custom_props={"code": f"BDL00{i}"}) for i in range(3)]
+        missing_uuid = str(uuid.uuid4())
+        self.assertTrue(item_catalog_cache.has_code("BDL000"))
+
+        errors = set_items_or_services_deleted(Item, [item.uuid for item in items] + [missing_uuid], "item")
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]["title"], missing_uuid)
+        for item in items:
+            item.refresh_from_db()
+            self.assertIsNotNone(item.validity_to)
+            self.assertEqual(Item.objects.filter(legacy_id=item.id).count(), 1)
+        self.assertFalse(item_catalog_cache.has_code("BDL000"))
+
+        # deleting again does not write another history copy
+        self.assertEqual(set_items_or_services_deleted(Item, [items[0].uuid], "item"), [])
+        self.assertEqual(Item.objects.filter(legacy_id=items[0].id).count(), 1)
+
+    def test_batch_delete_cascades_to_pricelist_details(self):
+        if not apps.is_installed("medical_pricelist"):
+            self.skipTest("medical_pricelist is not installed")
+        from medical_pricelist.models import ItemsPricelist, ItemsPricelistDetail
+        item = create_test_item("D", custom_props={"code": "BDL010"})
+        pricelist = ItemsPricelist.objects.create(
+            name="test-batch-delete", pricelist_date="2019-01-01", validity_from="2019-01-01", audit_user_id=1)
+        detail = ItemsPricelistDetail.objects.create(
+            items_pricelist=pricelist, item=item, validity_from="2019-01-01", audit_user_id=1)
+
+        self.assertEqual(set_items_or_services_deleted(Item, [item.uuid], "item"), [])
+
+        detail.refresh_from_db()
+        self.assertIsNotNone(detail.validity_to)
+        self.assertEqual(ItemsPricelistDetail.objects.filter(legacy_id=detail.id).count(), 1)
+
+
+class ProcessChildRelationTestCase(TestCase):
+    user = SimpleNamespace(id_for_audit=-1)
+
+    def setUp(self):
+        package_graph.invalidate()
+
+    def _package_update(self, package, count):
+        items = [create_test_item("D", custom_props={"code": f"PCR{package.id % 100:02d}{i}"}) for i in range(count)]
+        process_items_relations(self.user, package, [
+            {"item_id": item.id, "price_asked": Decimal("10.00"), "qty_provided": 1, "status": 1} for item in items
+        ])
+        children = list(ServiceItem.objects.filter(parent=package).order_by("id"))
+        return [{"id": child.id, "item_id": child.item_id, "price_asked": Decimal("20.00"), "qty_provided": 2,
+                 "status": 1} for child in children] + [
+            {"item_id": items[0].id, "price_asked": Decimal("5.00"), "qty_provided": 3, "status": 1}]
+
+    def test_query_count_does_not_depend_on_the_number_of_children(self):
+        small = create_test_service("A", custom_props={"code": "PCRS01"})
+        large = create_test_service("A", custom_props={"code": "PCRS02"})
+        small_children = self._package_update(small, 2)
+        large_children = self._package_update(large, 8)
+
+        with self.assertNumQueries(4):
+            process_items_relations(self.user, small, small_children)
+        with self.assertNumQueries(4):
+            process_items_relations(self.user, large, large_children)
+
+        children = ServiceItem.objects.filter(parent=large)
+        self.assertEqual(children.count(), 9)
+        self.assertEqual(children.filter(price_asked=Decimal("20.00"), qty_provided=2).count(), 8)
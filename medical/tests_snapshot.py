@@ -0,0 +1,69 @@
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from medical.models import ServiceItem, ServiceService
+from medical.snapshot import CatalogSnapshot, SnapshotFormatError, SnapshotLink, write_snapshot
+from medical.test_helpers import create_test_item, create_test_service
+
+
+class CatalogSnapshotTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = create_test_item("D", custom_props={"code": "SNP001", "price": Decimal("12.50"), "frequency": 3})
+        create_test_item("D", valid=False, custom_props={"code": "SNP002"})
+        cls.package = create_test_service("A", custom_props={"code": "SNP003", "packagetype": "P"})
+        cls.service = create_test_service("A", custom_props={"code": "SNP004"})
+        ServiceItem.objects.create(parent=cls.package, item=cls.item, qty_provided=2, price_asked=Decimal("10.00"))
+        ServiceService.objects.create(parent=cls.package, service=cls.service, qty_provided=1)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "catalog.snapshot")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookups(self):
+        write_snapshot(self.path)
+        snapshot = CatalogSnapshot(self.path)
+
+        item = snapshot.items.by_code("SNP001")
+        self.assertEqual(item.id, self.item.id)
+        self.assertEqual(item.price, Decimal("12.50"))
+        self.assertEqual(item.frequency, 3)
+        self.assertEqual(snapshot.items.by_id(self.item.id), item)
+        self.assertIsNone(snapshot.items.by_code("SNP002"))
+        self.assertIsNone(snapshot.items.by_id(-1))
+        self.assertEqual(snapshot.services.by_code("SNP003").packagetype, "P")
+        self.assertEqual(snapshot.services.by_code("SNP004").frequency, None)
+        self.assertEqual(sorted(snapshot.children(self.package.id)), [
+            SnapshotLink("item", self.item.id, 2, Decimal("10.00")),
+            SnapshotLink("service", self.service.id, 1, None),
+        ])
+        self.assertEqual(snapshot.children(self.service.id), [])
+        self.assertFalse(snapshot.items.column("price").flags.writeable)
+
+    def test_replaced_atomically(self):
+        write_snapshot(self.path)
+        previous = CatalogSnapshot(self.path)
+        create_test_item("D", custom_props={"code": "SNP005"})
+        out = StringIO()
+        call_command("export_catalog_snapshot", self.path, stdout=out)
+
+        self.assertIn("snapshot written", out.getvalue())
+        self.assertIsNotNone(CatalogSnapshot(self.path).items.by_code("SNP005"))
+        # the mapped file is still the previous one
+        self.assertIsNone(previous.items.by_code("SNP005"))
+        self.assertEqual(os.listdir(self.directory.name), ["catalog.snapshot"])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "wb") as not_a_snapshot:
+            not_a_snapshot.write(b"x" * 64)
+        with self.assertRaises(SnapshotFormatError):
+            CatalogSnapshot(self.path)
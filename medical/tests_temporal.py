@@ -0,0 +1,39 @@
+import datetime
+from decimal import Decimal
+
+from django.test import TestCase
+
+from medical.models import Item
+from medical.test_helpers import create_test_item
+
+
+class AsOfTestCase(TestCase):
+    def setUp(self):
+        self.item = create_test_item("D", custom_props={"code": "TMP001", "price": Decimal("10")})
+        self.item.price = Decimal("12")
+        self.item.save()
+        self.other = create_test_item("D", custom_props={"code": "TMP002", "price": Decimal("5")})
+        self.today = datetime.date.today()
+
+    def test_as_of_returns_the_version_valid_on_the_date(self):
+        old = Item.as_of(datetime.date(2020, 1, 1)).get(code="TMP001")
+        self.assertEqual(old.price, Decimal("10"))
+        self.assertEqual(old.legacy_id, self.item.id)
+        self.assertEqual(Item.as_of(self.today).get(code="TMP001").id, self.item.id)
+        self.assertFalse(Item.as_of(datetime.date(2019, 1, 1)).filter(code="TMP001").exists())
+
+    def test_codes_as_of_resolves_a_batch_in_one_query(self):
+        requests = [
+            ("TMP001", datetime.date(2020, 1, 1)),
+            ("TMP001", self.today),
+            ("TMP002", datetime.date(2020, 1, 1)),
+            ("TMP002", datetime.date(2019, 1, 1)),
+            ("NOPE", self.today),
+        ]
+        with self.assertNumQueries(1):
+            versions = Item.codes_as_of(requests)
+        self.assertEqual(versions[requests[0]].price, Decimal("10"))
+        self.assertEqual(versions[requests[1]].id, self.item.id)
+        self.assertEqual(versions[requests[2]].id, self.other.id)
+        self.assertIsNone(versions[requests[3]])
+        self.assertIsNone(versions[requests[4]])
@@ -0,0 +1,68 @@
+from django.db import DatabaseError, transaction
+from django.test import TestCase
+
+from medical.models import Item, ServiceItem
+from medical.services import set_items_or_services_deleted
+from medical.test_helpers import create_test_item, create_test_service
+from medical.versions import catalog_version, catalog_versions, is_not_modified, ENTITY_ITEM, ENTITY_SERVICE, \
+    ENTITY_PACKAGE, ENTITY_DIAGNOSIS, ENTITY_ITEM_PRICELIST, ENTITY_SERVICE_PRICELIST
+
+
+class CatalogVersionTestCase(TestCase):
+    def test_bumped_by_the_write_paths(self):
+        versions = catalog_versions()
+        self.assertEqual(set(versions), {ENTITY_ITEM, ENTITY_SERVICE, ENTITY_DIAGNOSIS, ENTITY_PACKAGE,
+                                         ENTITY_ITEM_PRICELIST, ENTITY_SERVICE_PRICELIST})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item = create_test_item("D", custom_props={"code": "CVS001"})
+        item_version = catalog_version(ENTITY_ITEM)
+        self.assertGreater(item_version, versions[ENTITY_ITEM])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_items_or_services_deleted(Item, [item.uuid], "item")
+        self.assertGreater(catalog_version(ENTITY_ITEM), item_version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            package = create_test_service("A", custom_props={"code": "CVS002"})
+        service_version = catalog_version(ENTITY_SERVICE)
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceItem.objects.create(parent=package, item=item, qty_provided=1)
+        # the package content is part of the services
+        self.assertGreater(catalog_version(ENTITY_SERVICE), service_version)
+        self.assertGreater(catalog_version(ENTITY_PACKAGE), versions[ENTITY_PACKAGE])
+        self.assertEqual(catalog_versions()[ENTITY_DIAGNOSIS], versions[ENTITY_DIAGNOSIS])
+
+    def test_bumped_once_on_commit(self):
+        version = catalog_version(ENTITY_ITEM)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(3):
+                item = create_test_item("D", custom_props={"code": "CVS004"})
+                item.name = "Renamed"
+                item.save()
+            # not bumped within the transaction
+            self.assertEqual(catalog_version(ENTITY_ITEM), version)
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(catalog_version(ENTITY_ITEM), version + 1)
+
+    def test_rolled_back_savepoint_keeps_the_other_bumps(self):
+        versions = catalog_versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_test_item("D", custom_props={"code": "CVS005"})
+            try:
+                with transaction.atomic():
+                    create_test_service("S", custom_props={"code": "CVS006"})
+                    raise DatabaseError("rollback")
+            except DatabaseError:
+                pass
+        self.assertEqual(catalog_version(ENTITY_ITEM), versions[ENTITY_ITEM] + 1)
+        self.assertEqual(catalog_version(ENTITY_SERVICE), versions[ENTITY_SERVICE])
+
+    def test_is_not_modified(self):
+        create_test_item("D", custom_props={"code": "CVS003"})
+        version = catalog_version(ENTITY_ITEM)
+        self.assertFalse(is_not_modified(ENTITY_ITEM, None))
+        self.assertFalse(is_not_modified(ENTITY_ITEM, version - 1))
+        self.assertTrue(is_not_modified(ENTITY_ITEM, version))
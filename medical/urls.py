@@ -1 +1,7 @@
-urlpatterns = []
\ No newline at end of file
+from django.urls import path
+
+from medical import views
+
+urlpatterns = [
+    path("export/<str:entity>", views.export_catalog),
+]
@@ -1,22 +1,64 @@
 import logging
 from medical.models import ServiceItem, ServiceService, Item, Service
+from medical.packages import check_children, refresh_package_on_commit
+from medical.versions import bump_catalog_version_of
 logger = logging.getLogger(__name__)
+
+
 def process_child_relation(user, data_children, service_id, children, create_hook):
+    """
+    Reconciles the children of a package in bulk: one query for the child rows to update, one for the
+    referenced items/services of the new rows, then one bulk_update and one bulk_create, whatever the number
+    of children. Service children are checked against the package links in the database first so that a package
+    can't end up containing itself.
+    """
     claimed = 0
     if isinstance(data_children, list):
+        child_model, definition_model, definition_field = _CHILD_RELATIONS[create_hook]
+        if child_model is ServiceService:
+            check_children(
+                children.id, [data_elt['service_id'] for data_elt in data_children if 'service_id' in data_elt])
+        to_update = {}
+        to_create = []
         for data_elt in data_children:
             elt_id = data_elt.pop('id') if 'id' in data_elt else None
             if elt_id:
-                if create_hook == item_create_hook:
-                    elt = ServiceItem.objects.get(id=elt_id)
-                else:
-                    elt = ServiceService.objects.get(id=elt_id)
-                [setattr(elt, k, v) for k, v in data_elt.items()]
-                elt.save()
+                to_update[elt_id] = data_elt
             else:
-                logger.debug("Create Item or Service")
                 data_elt['audit_user_id'] = user.id_for_audit
-                create_hook(children, data_elt)
+                to_create.append(data_elt)
+
+        if to_update:
+            existing = child_model.objects.in_bulk(list(to_update))
+            updated_fields = set()
+            for elt_id, data_elt in to_update.items():
+                if elt_id not in existing:
+                    raise child_model.DoesNotExist(f"{child_model.__name__} {elt_id} does not exist")
+                elt = existing[elt_id]
+                for key, value in data_elt.items():
+                    setattr(elt, key, value)
+                    updated_fields.add(child_model._meta.get_field(key).name)
+            child_model.objects.bulk_update(list(existing.values()), sorted(updated_fields))
+
+        if to_create:
+            logger.debug("Create %s Items or Services", len(to_create))
+            definition_ids = {data_elt[f"{definition_field}_id"] for data_elt in to_create}
+            definitions = definition_model.objects.in_bulk(list(definition_ids))
+            missing = definition_ids - set(definitions)
+            if missing:
+                raise definition_model.DoesNotExist(
+                    f"{definition_model.__name__} {', '.join(str(m) for m in sorted(missing))} does not exist")
+            child_model.objects.bulk_create([
+                child_model(**{
+                    "parent": children,
+                    definition_field: definitions[data_elt[f"{definition_field}_id"]],
+                    "price_asked": data_elt['price_asked'],
+                    "qty_provided": data_elt['qty_provided'],
+                }) for data_elt in to_create
+            ])
+        if to_update or to_create:
+            bump_catalog_version_of(child_model)
+        refresh_package_on_commit(children.id)
     return claimed
 
 
@@ -39,9 +81,16 @@ def service_create_hook(service_id, service):
     )
 
 
+# create hook -> (child model, model of the referenced definition, name of the reference field)
+_CHILD_RELATIONS = {
+    item_create_hook: (ServiceItem, Item, "item"),
+    service_create_hook: (ServiceService, Service, "service"),
+}
+
+
 def process_items_relations(user, Service, items):
     return process_child_relation(user, items, Service.id, Service, item_create_hook)
 
 
 def process_services_relations(user, Service, services):
-    return process_child_relation(user, services, Service.id, Service, service_create_hook)
\ No newline at end of file
+    return process_child_relation(user, services, Service.id, Service, service_create_hook)
@@ -0,0 +1,129 @@
+from django.db import IntegrityError, transaction, DEFAULT_DB_ALIAS
+from django.db.models import F
+
+ENTITY_ITEM = "item"
+ENTITY_SERVICE = "service"
+ENTITY_DIAGNOSIS = "diagnosis"
+# ServiceItem and ServiceService: a change of the content of a package also changes the service version, as the
+# package content is part of the services queries
+ENTITY_PACKAGE = "package"
+# the details of the item and service pricelists (medical_pricelist), for the pricelist membership indexes
+ENTITY_ITEM_PRICELIST = "item_pricelist"
+ENTITY_SERVICE_PRICELIST = "service_pricelist"
+ENTITIES = (ENTITY_ITEM, ENTITY_SERVICE, ENTITY_DIAGNOSIS, ENTITY_PACKAGE, ENTITY_ITEM_PRICELIST,
+            ENTITY_SERVICE_PRICELIST)
+
+_MODEL_ENTITIES = {
+    "Item": (ENTITY_ITEM,),
+    "Service": (ENTITY_SERVICE,),
+    "Diagnosis": (ENTITY_DIAGNOSIS,),
+    "ServiceItem": (ENTITY_PACKAGE, ENTITY_SERVICE),
+    "ServiceService": (ENTITY_PACKAGE, ENTITY_SERVICE),
+    "ItemsPricelistDetail": (ENTITY_ITEM_PRICELIST,),
+    "ServicesPricelistDetail": (ENTITY_SERVICE_PRICELIST,),
+}
+
+
+def entities_of(model):
+    """
+    :param model: model class or instance of the catalog
+    :return: the entities whose version changes with the rows of the model
+    """
+    return _MODEL_ENTITIES[model._meta.object_name]
+
+
+def _increment(entities, using):
+    from medical.models import CatalogVersion
+    versions = CatalogVersion.objects.using(using)
+    if versions.filter(entity__in=entities).update(version=F("version") + 1) == len(entities):
+        return
+    # entities created since the last migrate (see create_catalog_versions)
+    existing = set(versions.filter(entity__in=entities).values_list("entity", flat=True))
+    for entity in set(entities) - existing:
+        try:
+            with transaction.atomic(using=using):
+                versions.create(entity=entity, version=1)
+        except IntegrityError:
+            # created meanwhile by another process
+            versions.filter(entity=entity).update(version=F("version") + 1)
+
+
+class _PendingBump:
+    """
+    on_commit callback incrementing the versions of the entities changed by a transaction
+    """
+
+    def __init__(self, using, entities):
+        self.using = using
+        self.entities = set(entities)
+
+    def __call__(self):
+        if self.entities:
+            _increment(sorted(self.entities), self.using)
+
+
+def _previous_bump(connection):
+    """
+    :return: the last pending bump of the transaction that can be merged into a new one: the new one must not be
+             dropped by a savepoint rollback that would keep the previous one, its savepoints (the current ones)
+             have to be among the ones of the previous bump
+    """
+    savepoint_ids = set(connection.savepoint_ids)
+    for entry in reversed(connection.run_on_commit):
+        if isinstance(entry[1], _PendingBump):
+            return entry[1] if savepoint_ids <= entry[0] else None
+    return None
+
+
+def bump_catalog_version(*entities, using=DEFAULT_DB_ALIAS):
+    """
+    Increments the version of the entities once the current transaction commits (right away outside of one): the
+    version rows are not locked for the whole transaction, and each new bump takes over the entities of the
+    previous one, so that all the changes of a transaction make one UPDATE.
+    A reader can meanwhile get the new rows with the previous version, never the new version with the previous
+    rows.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        _increment(entities, using)
+        return
+    pending = _PendingBump(using, entities)
+    previous = _previous_bump(connection)
+    if previous is not None:
+        pending.entities |= previous.entities
+        previous.entities = set()
+    transaction.on_commit(pending, using=using)
+
+
+def create_catalog_versions(using="default"):
+    """
+    Creates the missing version rows, so that bumping a version is a single UPDATE
+    """
+    from medical.models import CatalogVersion
+    existing = set(CatalogVersion.objects.using(using).values_list("entity", flat=True))
+    CatalogVersion.objects.using(using).bulk_create(
+        [CatalogVersion(entity=entity, version=0) for entity in ENTITIES if entity not in existing])
+
+
+def bump_catalog_version_of(model, using=DEFAULT_DB_ALIAS):
+    bump_catalog_version(*entities_of(model), using=using)
+
+
+def catalog_versions():
+    """
+    :return: {entity: version} of all the entities, 0 for the entities that never changed
+    """
+    from medical.models import CatalogVersion
+    return {**{entity: 0 for entity in ENTITIES}, **dict(CatalogVersion.objects.values_list("entity", "version"))}
+
+
+def catalog_version(entity):
+    from medical.models import CatalogVersion
+    return CatalogVersion.objects.filter(entity=entity).values_list("version", flat=True).first() or 0
+
+
+def is_not_modified(entity, if_version_not):
+    """
+    Conditional fetch of a list query: the version the client already has is still the current one
+    """
+    return if_version_not is not None and if_version_not == catalog_version(entity)
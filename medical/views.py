@@ -1,3 +1,46 @@
-from django.shortcuts import render
+import datetime
 
-# Create your views here.
+from django.http import Http404, StreamingHttpResponse
+from django.utils.translation import gettext as _
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import IsAuthenticated
+
+from .apps import MedicalConfig
+from .export import EXPORTS, FORMATS, FORMAT_CSV, CONTENT_TYPES, stream_export
+
+EXPORT_PERMS = {
+    "items": lambda: MedicalConfig.gql_query_medical_items_perms,
+    "services": lambda: MedicalConfig.gql_query_medical_services_perms,
+    "service_items": lambda: MedicalConfig.gql_query_medical_services_perms,
+    "service_services": lambda: MedicalConfig.gql_query_medical_services_perms,
+    "diagnoses": lambda: MedicalConfig.gql_query_diagnosis_perms,
+}
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def export_catalog(request, entity):
+    """
+    Streams a catalog export: /medical/export/<entity>?export_format=csv|ndjson&show_history=true&as_of=YYYY-MM-DD
+    (not format, which Django REST framework reserves for its content negotiation)
+    """
+    if entity not in EXPORTS:
+        raise Http404
+    if not request.user.has_perms(EXPORT_PERMS[entity]()):
+        raise PermissionDenied(_("unauthorized"))
+    export_format = request.query_params.get("export_format", FORMAT_CSV)
+    if export_format not in FORMATS:
+        raise ValidationError({"export_format": FORMATS})
+    as_of = request.query_params.get("as_of")
+    try:
+        as_of = datetime.date.fromisoformat(as_of) if as_of else None
+    except ValueError:
+        raise ValidationError({"as_of": "YYYY-MM-DD"})
+    # OMT-281 history requires the full query right, which has been checked above
+    show_history = request.query_params.get("show_history", "").lower() == "true"
+    return StreamingHttpResponse(
+        stream_export(entity, export_format, show_history=show_history, as_of=as_of),
+        content_type=CONTENT_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="medical_{entity}.{export_format}"'},
+    )
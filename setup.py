@@ -22,6 +22,7 @@ setup(
         'django',
         'django-db-signals',
         'djangorestframework',
+        'numpy',
     ],   
     classifiers=[
         'Environment :: Web Environment',